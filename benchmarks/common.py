@@ -0,0 +1,95 @@
+"""Synthetic states shared by the benchmarks."""
+
+import time
+import numpy as np
+import sympl as sp
+import marble
+
+# column counts at which the network and decomposition paths are timed
+column_counts = [1, 100, 10000, 1000000]
+
+# ranges of physically plausible values of the scalar MARBLE inputs
+scalar_inputs = {
+    'liquid_water_static_energy_at_3km': ('J/kg', 3.1e5, 1e3),
+    'total_water_mixing_ratio_at_3km': ('kg/kg', 3e-3, 1e-3),
+    'surface_latent_heat_flux': ('W/m^2', -100., 30.),
+    'surface_sensible_heat_flux': ('W/m^2', -10., 5.),
+    'surface_temperature': ('degK', 290., 3.),
+    'mid_cloud_fraction': ('', 0.2, 0.1),
+    'high_cloud_fraction': ('', 0.2, 0.1),
+    'downwelling_shortwave_radiation_at_top_of_atmosphere': ('W/m^2', 500., 200.),
+    'downwelling_shortwave_radiation_at_3km': ('W/m^2', 400., 200.),
+    'surface_air_pressure': ('Pa', 1.01e5, 500.),
+    'rain_water_mixing_ratio_at_3km': ('kg/kg', 1e-6, 1e-7),
+}
+
+
+def get_latent_state(n_columns, seed=0):
+    """
+    Returns a state with every input of LatentMarble and
+    LatentHorizontalAdvectiveForcing, with a column dimension of length
+    n_columns.
+    """
+    random = np.random.RandomState(seed)
+    n_features = marble.components.marble.get_network_metadata().name_feature_counts
+    state = {'time': sp.timedelta(0)}
+    for name, alias in (
+            ('liquid_water_static_energy_components', 'sl'),
+            ('total_water_mixing_ratio_components', 'rt'),
+            ('vertical_wind_components', 'w')):
+        state[name] = sp.DataArray(
+            0.1 * random.randn(n_columns, n_features[alias]),
+            dims=('column', '{}_latent'.format(alias)), attrs={'units': ''})
+    for name, alias in (
+            ('liquid_water_static_energy_components_horizontal_advective_tendency', 'sl'),
+            ('total_water_mixing_ratio_components_horizontal_advective_tendency', 'rt')):
+        state[name] = sp.DataArray(
+            0.01 * random.randn(n_columns, n_features[alias]),
+            dims=('column', '{}_latent'.format(alias)), attrs={'units': 'hr^-1'})
+    for name, (units, mean, std) in scalar_inputs.items():
+        state[name] = sp.DataArray(
+            mean + std * random.randn(n_columns),
+            dims=('column',), attrs={'units': units})
+    return state
+
+
+def get_height_state(n_columns, seed=0):
+    """
+    Returns a state with the height-coordinate inputs of
+    InputHeightToPrincipalComponents, with a column dimension of length
+    n_columns.
+    """
+    random = np.random.RandomState(seed)
+    state = {'time': sp.timedelta(0)}
+    for name, alias, units in (
+            ('liquid_water_static_energy', 'sl', 'J/kg'),
+            ('total_water_mixing_ratio', 'rt', 'kg/kg'),
+            ('vertical_wind', 'w', 'm/s')):
+        mean = marble.get_basis(alias).mean
+        state[name] = sp.DataArray(
+            mean[None, :] * (1. + 0.01 * random.randn(n_columns, len(mean))),
+            dims=('column', 'z_star'), attrs={'units': units})
+    return state
+
+
+def get_array_state(component, state):
+    """Returns the arrays passed to array_call by component for state."""
+    return {
+        properties.get('alias', name): state[name].values
+        for name, properties in component.input_properties.items()
+    }
+
+
+def get_throughput(function, n_columns, n_steps=1, min_seconds=0.2):
+    """
+    Calls function repeatedly for at least min_seconds, and returns the
+    number of column-steps processed per second.
+    """
+    n_calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        n_calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return n_calls * n_columns * n_steps / elapsed
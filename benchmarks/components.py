@@ -0,0 +1,100 @@
+"""Benchmarks of the MARBLE network and principal component conversions."""
+
+import marble
+from .common import (
+    column_counts, get_latent_state, get_height_state, get_array_state,
+    get_throughput)
+
+
+class LatentMarbleSuite(object):
+    params = column_counts
+    param_names = ['n_columns']
+    timeout = 300
+
+    def setup(self, n_columns):
+        self.component = marble.LatentMarble()
+        self.state = get_latent_state(n_columns)
+        self.array_state = get_array_state(self.component, self.state)
+
+    def time_call(self, n_columns):
+        self.component(self.state)
+
+    def time_array_call(self, n_columns):
+        self.component.array_call(self.array_state)
+
+    def peakmem_call(self, n_columns):
+        self.component(self.state)
+
+    def track_call_throughput(self, n_columns):
+        return get_throughput(lambda: self.component(self.state), n_columns)
+    track_call_throughput.unit = 'columns/s'
+
+    def track_array_call_throughput(self, n_columns):
+        return get_throughput(
+            lambda: self.component.array_call(self.array_state), n_columns)
+    track_array_call_throughput.unit = 'columns/s'
+
+
+class DecompositionSuite(object):
+    params = column_counts
+    param_names = ['n_columns']
+    timeout = 300
+
+    def setup(self, n_columns):
+        self.height_to_pc = marble.InputHeightToPrincipalComponents()
+        self.pc_to_height = marble.InputPrincipalComponentsToHeight()
+        self.diagnostic_pc_to_height = marble.DiagnosticPrincipalComponentsToHeight()
+        self.height_state = get_height_state(n_columns)
+        self.latent_state = get_latent_state(n_columns)
+        _, diagnostics = marble.LatentMarble()(self.latent_state)
+        self.latent_state.update(diagnostics)
+
+    def time_input_height_to_principal_components(self, n_columns):
+        self.height_to_pc(self.height_state)
+
+    def time_input_principal_components_to_height(self, n_columns):
+        self.pc_to_height(self.latent_state)
+
+    def time_diagnostic_principal_components_to_height(self, n_columns):
+        self.diagnostic_pc_to_height(self.latent_state)
+
+    def peakmem_input_height_to_principal_components(self, n_columns):
+        self.height_to_pc(self.height_state)
+
+    def peakmem_diagnostic_principal_components_to_height(self, n_columns):
+        self.diagnostic_pc_to_height(self.latent_state)
+
+    def track_input_height_to_principal_components_throughput(self, n_columns):
+        return get_throughput(lambda: self.height_to_pc(self.height_state), n_columns)
+    track_input_height_to_principal_components_throughput.unit = 'columns/s'
+
+    def track_diagnostic_principal_components_to_height_throughput(self, n_columns):
+        return get_throughput(
+            lambda: self.diagnostic_pc_to_height(self.latent_state), n_columns)
+    track_diagnostic_principal_components_to_height_throughput.unit = 'columns/s'
+
+
+class EnsembleSuite(object):
+    """
+    Compares one :class:`marble.EnsembleLatentMarble` call against one
+    :class:`marble.LatentMarble` call per member.
+    """
+    params = ([4, 16], [100, 10000])
+    param_names = ['n_members', 'n_columns']
+    timeout = 300
+
+    def setup(self, n_members, n_columns):
+        weight_filenames = [marble.components.marble.weight_filename] * n_members
+        self.ensemble = marble.EnsembleLatentMarble(weight_filenames)
+        self.component = marble.LatentMarble()
+        self.state = get_latent_state(n_columns)
+
+    def time_ensemble_call(self, n_members, n_columns):
+        self.ensemble(self.state)
+
+    def time_separate_calls(self, n_members, n_columns):
+        for _ in range(n_members):
+            self.component(self.state)
+
+    def peakmem_ensemble_call(self, n_members, n_columns):
+        self.ensemble(self.state)
@@ -0,0 +1,70 @@
+"""Benchmarks of a full 30-day latent single column model run."""
+
+from datetime import timedelta
+import sympl as sp
+import marble
+from .common import get_latent_state, get_throughput
+
+timestep = timedelta(hours=1)
+n_steps = 30 * 24
+
+state_names = {
+    'sl': 'liquid_water_static_energy_components',
+    'rt': 'total_water_mixing_ratio_components',
+}
+
+
+class LatentSCMSuite(object):
+    """
+    Runs the loop of examples/scm.py in latent space on synthetic forcing
+    held constant in time, either with Sympl components or with
+    :class:`marble.LatentIntegrator`.
+    """
+    params = [1, 100, 10000]
+    param_names = ['n_columns']
+    timeout = 1800
+    number = 1
+    repeat = 1
+
+    def setup(self, n_columns):
+        self.state = get_latent_state(n_columns)
+        forcing_properties = marble.components.integrator.get_forcing_properties()
+        self.forcing = {
+            alias: self.state[properties['name']].values
+            for alias, properties in forcing_properties.items()}
+        self.latent_state = {
+            alias: self.state[name].values for alias, name in state_names.items()}
+
+    def run_sympl(self):
+        stepper = sp.AdamsBashforth(
+            [marble.LatentMarble(), marble.LatentHorizontalAdvectiveForcing()], order=1)
+        state = dict(self.state)
+        for _ in range(n_steps):
+            diagnostics, next_state = stepper(state, timestep=timestep)
+            state.update(diagnostics)
+            state.update(next_state)
+            state['time'] += timestep
+
+    def run_integrator(self):
+        integrator = marble.LatentIntegrator(timestep)
+        integrator.integrate(self.latent_state, self.forcing, n_steps)
+
+    def time_sympl(self, n_columns):
+        self.run_sympl()
+
+    def time_integrator(self, n_columns):
+        self.run_integrator()
+
+    def peakmem_sympl(self, n_columns):
+        self.run_sympl()
+
+    def peakmem_integrator(self, n_columns):
+        self.run_integrator()
+
+    def track_sympl_throughput(self, n_columns):
+        return get_throughput(self.run_sympl, n_columns, n_steps, min_seconds=0.)
+    track_sympl_throughput.unit = 'column-steps/s'
+
+    def track_integrator_throughput(self, n_columns):
+        return get_throughput(self.run_integrator, n_columns, n_steps, min_seconds=0.)
+    track_integrator_throughput.unit = 'column-steps/s'
@@ -0,0 +1,62 @@
+"""Benchmarks of output storage and alias lookup."""
+
+import numpy as np
+import sympl as sp
+import marble
+
+
+class ColumnStoreSuite(object):
+    params = [24, 30 * 24, 365 * 24]
+    param_names = ['n_times']
+
+    def setup(self, n_times):
+        self.states = [
+            {
+                'time': sp.timedelta(hours=i_time),
+                'liquid_water_static_energy': sp.DataArray(
+                    np.full(20, 3e5 + i_time), dims=['z_star'], attrs={'units': 'J/kg'}),
+                'cloud_fraction': sp.DataArray(
+                    np.full(20, 0.5), dims=['z_star'], attrs={'units': ''}),
+                'surface_precipitation_rate': sp.DataArray(
+                    np.array(0.1), dims=[], attrs={'units': 'mm/hr'}),
+            }
+            for i_time in range(n_times)
+        ]
+        self.full_store = marble.ColumnStore()
+        for state in self.states:
+            self.full_store.store(state)
+
+    def time_store(self, n_times):
+        store = marble.ColumnStore()
+        for state in self.states:
+            store.store(state)
+
+    def time_getitem(self, n_times):
+        self.full_store['liquid_water_static_energy']
+
+    def peakmem_store(self, n_times):
+        store = marble.ColumnStore()
+        for state in self.states:
+            store.store(state)
+
+
+class AliasDictSuite(object):
+
+    def setup(self):
+        marble.register_alias('bench_sl', 'liquid_water_static_energy')
+        self.alias_dict = marble.AliasDict(
+            {'liquid_water_static_energy': np.zeros(20)})
+        self.slot_dict = marble.SlotDict(
+            {'liquid_water_static_energy': np.zeros(20)})
+
+    def time_alias_getitem(self):
+        for _ in range(1000):
+            self.alias_dict['bench_sl']
+
+    def time_long_name_getitem(self):
+        for _ in range(1000):
+            self.alias_dict['liquid_water_static_energy']
+
+    def time_slot_dict_alias_getitem(self):
+        for _ in range(1000):
+            self.slot_dict['bench_sl']
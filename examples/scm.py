@@ -26,22 +26,25 @@ diagnostics_to_height = mb.DiagnosticPrincipalComponentsToHeight()
 advection = mb.LatentHorizontalAdvectiveForcing()
 # First order Adams Bashforth is the same as Forward Euler
 stepper = sp.AdamsBashforth([marble_tendency_component, advection], order=1)
-model_monitor = mb.ColumnStore()
-reference_monitor = mb.ColumnStore()
+model_monitor = mb.ColumnStore(capacity=30 * 24)
+reference_monitor = mb.ColumnStore(capacity=30 * 24)
 
-state = init.get_era5_state(init.column_filename, latent=True)
+# Read the forcing file once, and project its profiles onto principal components
+forcing_provider = mb.ERA5ForcingProvider(init.column_filename)
+state = forcing_provider.get_state(latent=True)
 
-while state['time'] < timedelta(days=30):
-    i_hour = int(state['time'].total_seconds() / 3600.)
-    state.update(init.get_era5_forcing(init.column_filename, latent=True, i_timestep=i_hour))
+# Prepare the forcing of upcoming hours while the model is stepped
+n_hours = int(timedelta(days=30) / timestep)
+for i_hour, forcing in mb.ForcingPrefetcher(forcing_provider.get_forcing, range(n_hours)):
+    state.update(forcing)
     diagnostics, next_state = stepper(state, timestep=timestep)
     state.update(diagnostics)
     # Convert to height coordinates and store in monitors for later analysis
     z_dict = inputs_to_height(state)
     z_dict.update(diagnostics_to_height(state))
     model_monitor.store(z_dict)
-    reference_z_dict = init.get_era5_state(init.column_filename, latent=False, i_timestep=i_hour)
-    reference_z_dict.update(init.get_era5_diagnostics(init.column_filename, i_timestep=i_hour))
+    reference_z_dict = forcing_provider.get_state(i_hour, latent=False)
+    reference_z_dict.update(forcing_provider.get_diagnostics(i_hour))
     reference_monitor.store(reference_z_dict)
     # Increment state and timestep
     state.update(next_state)
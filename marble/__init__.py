@@ -5,6 +5,35 @@
 __author__ = """Jeremy McGibbon"""
 __email__ = 'mcgibbon@uw.edu'
 __version__ = '0.1.0'
-from .components import *
-from .state import *
+import importlib
 
+# public names are imported from their submodule on first access, so that
+# importing the package does not load sympl, xarray or the MARBLE datasets
+_name_to_submodule = {
+    'register_alias': 'state',
+    'register_alias_dict': 'state',
+    'AliasDict': 'state',
+    'SlotDict': 'state',
+}
+for _name in importlib.import_module('.components', __name__).__all__:
+    _name_to_submodule[_name] = 'components'
+_submodule_names = ('components', 'state', 'docstrings')
+
+__all__ = list(_name_to_submodule)
+
+
+def __getattr__(name):
+    if name in _name_to_submodule:
+        module = importlib.import_module(
+            '.' + _name_to_submodule[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    elif name in _submodule_names:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodule_names))
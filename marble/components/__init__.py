@@ -1,4 +1,62 @@
-from .decomposition import *
-from .forcing import *
-from .marble import *
-from .monitor import *
+import importlib
+
+# public names are imported from their submodule on first access, so that
+# importing the package does not import every component module
+_name_to_submodule = {
+    'InputHeightToPrincipalComponents': 'decomposition',
+    'InputPrincipalComponentsToHeight': 'decomposition',
+    'DiagnosticPrincipalComponentsToHeight': 'decomposition',
+    'convert_height_to_principal_components': 'decomposition',
+    'convert_principal_components_to_height': 'decomposition',
+    'Basis': 'decomposition',
+    'StackedBasis': 'decomposition',
+    'get_basis': 'decomposition',
+    'LatentHorizontalAdvectiveForcing': 'forcing',
+    'LatentMarble': 'marble',
+    'HeightMarble': 'height',
+    'EnsembleLatentMarble': 'ensemble',
+    'StackedInferencePlan': 'ensemble',
+    'LatentIntegrator': 'integrator',
+    'ImplicitLatentIntegrator': 'integrator',
+    'AdaptiveLatentIntegrator': 'integrator',
+    'ERA5ForcingProvider': 'era5',
+    'ForcingPrefetcher': 'prefetch',
+    'instrument': 'instrumentation',
+    'InstrumentationStats': 'instrumentation',
+    'StageStats': 'instrumentation',
+    'apply_to_dataset': 'dataset',
+    'ColumnStore': 'monitor',
+    'NotAColumnException': 'monitor',
+    'StreamingStore': 'monitor',
+    'get_precision_deviation': 'precision',
+    'report_precision_deviation': 'precision',
+    'SharedParameters': 'parallel',
+    'ColumnProcessPool': 'parallel',
+    'ProcessParallelLatentMarble': 'parallel',
+    'ParameterBundle': 'bundle',
+    'export_parameter_bundle': 'bundle',
+    'load_parameter_bundle': 'bundle',
+}
+_submodule_names = (
+    'bundle', 'dataset', 'decomposition', 'ensemble', 'era5', 'forcing',
+    'height', 'instrumentation', 'integrator', 'marble', 'monitor', 'parallel',
+    'precision', 'prefetch')
+
+__all__ = list(_name_to_submodule)
+
+
+def __getattr__(name):
+    if name in _name_to_submodule:
+        module = importlib.import_module(
+            '.' + _name_to_submodule[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    elif name in _submodule_names:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodule_names))
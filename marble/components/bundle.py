@@ -0,0 +1,121 @@
+import collections
+import json
+import os
+import numpy as np
+from marble.components.marble import (
+    InferencePlan, NetworkMetadata, get_inference_plan, get_network_metadata)
+from marble.components.decomposition import Basis, get_basis
+from marble.components.parallel import basis_names, plan_array_names
+
+
+__all__ = [
+    'ParameterBundle', 'export_parameter_bundle', 'load_parameter_bundle']
+
+bundle_format_version = 1
+metadata_filename = 'metadata.json'
+
+
+def _get_array_filename(directory, *name_parts):
+    return os.path.join(directory, '_'.join(name_parts) + '.npy')
+
+
+class ParameterBundle(collections.namedtuple(
+        'ParameterBundle', ['precision', 'metadata', 'plan', 'bases'])):
+    """
+    MARBLE network metadata, compiled inference plan and principal component
+    bases (keyed by basis name) loaded from a parameter bundle.
+    """
+    __slots__ = ()
+
+    def preload(self):
+        """
+        Preloads the bundle into this process's caches, so that MARBLE
+        components created afterwards use its arrays instead of reading the
+        weight and principal component files.
+        """
+        get_network_metadata.preload(self.metadata)
+        get_inference_plan.preload(self.plan, self.precision)
+        for basis_name, basis in self.bases.items():
+            get_basis.preload(basis, basis_name, self.precision)
+
+
+def export_parameter_bundle(directory, precision='float64'):
+    """
+    Writes the compiled MARBLE inference plan, principal component bases and
+    network metadata to a directory of .npy files and a metadata.json file,
+    which can be memory-mapped by :func:`load_parameter_bundle`.
+
+    Args:
+        directory: directory to write the bundle into, created if it does
+            not exist.
+        precision: precision of the exported arrays, either 'float64'
+            (default) or 'float32'.
+    """
+    os.makedirs(directory, exist_ok=True)
+    plan = get_inference_plan(precision)
+    for name in plan_array_names:
+        np.save(
+            _get_array_filename(directory, 'plan', name), getattr(plan, name))
+    for basis_name in basis_names:
+        basis = get_basis(basis_name, precision)
+        for name in Basis._fields:
+            np.save(
+                _get_array_filename(directory, 'basis', basis_name, name),
+                getattr(basis, name))
+    bundle_metadata = {
+        'format_version': bundle_format_version,
+        'precision': precision,
+        'n_state': plan.n_state,
+        'n_diagnostic': plan.n_diagnostic,
+        'basis_names': list(basis_names),
+        'network': get_network_metadata()._asdict(),
+    }
+    with open(os.path.join(directory, metadata_filename), 'w') as f:
+        json.dump(bundle_metadata, f, indent=2)
+
+
+def load_parameter_bundle(directory, preload=True):
+    """
+    Loads a parameter bundle written by :func:`export_parameter_bundle`. The
+    arrays are memory-mapped read-only, so loading is nearly instant and the
+    pages are shared through the operating system's page cache between all
+    processes which load the same bundle.
+
+    Args:
+        directory: directory containing the bundle.
+        preload: if True (default), also preload the bundle into this
+            process's caches (see :meth:`ParameterBundle.preload`).
+
+    Returns:
+        bundle (ParameterBundle): the loaded parameters.
+    """
+    with open(os.path.join(directory, metadata_filename), 'r') as f:
+        bundle_metadata = json.load(f)
+    if bundle_metadata['format_version'] != bundle_format_version:
+        raise ValueError(
+            'parameter bundle in {} has format version {}, expected {}'.format(
+                directory, bundle_metadata['format_version'],
+                bundle_format_version))
+
+    def load(*name_parts):
+        return np.load(
+            _get_array_filename(directory, *name_parts), mmap_mode='r')
+
+    plan = InferencePlan(
+        n_state=bundle_metadata['n_state'],
+        n_diagnostic=bundle_metadata['n_diagnostic'],
+        **{name: load('plan', name) for name in plan_array_names})
+    bases = {
+        basis_name: Basis(**{
+            name: load('basis', basis_name, name) for name in Basis._fields})
+        for basis_name in bundle_metadata['basis_names']
+    }
+    bundle = ParameterBundle(
+        precision=bundle_metadata['precision'],
+        metadata=NetworkMetadata(**bundle_metadata['network']),
+        plan=plan,
+        bases=bases,
+    )
+    if preload:
+        bundle.preload()
+    return bundle
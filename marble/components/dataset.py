@@ -0,0 +1,180 @@
+import functools
+import threading
+import numpy as np
+import xarray as xr
+from marble.components.marble import LatentMarble, get_network_metadata
+from marble.components.decomposition import (
+    InputHeightToPrincipalComponents, DiagnosticPrincipalComponentsToHeight,
+    get_basis)
+
+
+__all__ = ['apply_to_dataset']
+
+# components are created once per thread, as dask may evaluate several blocks
+# concurrently and a component's workspaces must not be shared between calls
+_local = threading.local()
+
+
+def _get_component(component_class, precision):
+    components = getattr(_local, 'components', None)
+    if components is None:
+        components = _local.components = {}
+    key = (component_class, precision)
+    if key not in components:
+        components[key] = component_class(precision=precision)
+    return components[key]
+
+
+def _get_core_dims(properties):
+    return [dim for dim in properties['dims'] if dim != '*']
+
+
+def _get_column_outputs(component_class):
+    """
+    Returns the (name, properties) pairs of every output of component_class
+    which has a column dimension, tendencies first.
+    """
+    outputs = []
+    for prefix, output_properties in (
+            ('tendency_of_',
+             getattr(component_class, 'tendency_properties', {})),
+            ('', component_class.diagnostic_properties)):
+        for name, properties in output_properties.items():
+            if '*' in properties['dims']:
+                outputs.append((prefix + name, properties))
+    return outputs
+
+
+def _predict_block(
+        component_class, precision, input_properties, output_properties,
+        *arrays):
+    component = _get_component(component_class, precision)
+    # loop dimensions come first, and are size 1 in inputs which lack them
+    loop_shapes = [
+        array.shape[:array.ndim - len(_get_core_dims(properties))]
+        for array, properties in zip(arrays, input_properties)]
+    loop_shape = np.broadcast_shapes(*loop_shapes)
+    n_columns = int(np.prod(loop_shape))
+    inputs = {}
+    for array, loop_ndim_shape, properties in zip(
+            arrays, loop_shapes, input_properties):
+        core_shape = array.shape[len(loop_ndim_shape):]
+        inputs[properties['alias']] = np.ascontiguousarray(
+            np.broadcast_to(array, loop_shape + core_shape).reshape(
+                (n_columns,) + core_shape))
+    outputs = component.predict(inputs)
+    if isinstance(outputs, tuple):
+        output_dict = dict(outputs[1])
+        output_dict.update({
+            'tendency_of_' + alias: array
+            for alias, array in outputs[0].items()})
+    else:
+        output_dict = outputs
+    result = []
+    for name, properties in output_properties:
+        if name.startswith('tendency_of_'):
+            alias = 'tendency_of_' + properties['alias']
+        else:
+            alias = properties['alias']
+        array = output_dict[alias]
+        result.append(array.reshape(loop_shape + array.shape[1:]))
+    return tuple(result)
+
+
+def _apply_component(ds, component_class, precision):
+    """
+    Applies a MARBLE component blockwise over every dimension of ds other
+    than the component's own dimensions, returning a Dataset of its column
+    outputs.
+    """
+    input_names = list(component_class.input_properties)
+    missing_names = [name for name in input_names if name not in ds]
+    if missing_names:
+        raise ValueError(
+            'dataset is missing inputs of {}: {}'.format(
+                component_class.__name__, missing_names))
+    for name in input_names:
+        expected_units = component_class.input_properties[name]['units']
+        units = ds[name].attrs.get('units', expected_units)
+        if units != expected_units:
+            raise ValueError(
+                '{} must be in units of {!r}, got {!r}'.format(
+                    name, expected_units, units))
+    input_properties = [
+        component_class.input_properties[name] for name in input_names]
+    output_properties = _get_column_outputs(component_class)
+    output_core_dims = [
+        _get_core_dims(properties) for _, properties in output_properties]
+    name_feature_counts = get_network_metadata().name_feature_counts
+    # every basis reconstructs profiles on the same z_star levels
+    n_levels = get_basis('sl', precision).reconstruction_matrix.shape[1]
+    output_sizes = {}
+    for core_dims in output_core_dims:
+        for dim in core_dims:
+            if dim.endswith('_latent'):
+                quantity = dim[:-len('_latent')]
+                output_sizes[dim] = name_feature_counts[quantity]
+            else:
+                output_sizes[dim] = n_levels
+    results = xr.apply_ufunc(
+        functools.partial(
+            _predict_block, component_class, precision, input_properties,
+            output_properties),
+        *[ds[name] for name in input_names],
+        input_core_dims=[
+            _get_core_dims(properties) for properties in input_properties],
+        output_core_dims=output_core_dims,
+        dask='parallelized',
+        output_dtypes=[np.float64] * len(output_properties),
+        dask_gufunc_kwargs={
+            'output_sizes': output_sizes, 'allow_rechunk': True},
+    )
+    if not isinstance(results, tuple):
+        results = (results,)
+    output_ds = xr.Dataset()
+    for (name, properties), result in zip(output_properties, results):
+        output_ds[name] = result.assign_attrs(units=properties['units'])
+    return output_ds
+
+
+def apply_to_dataset(ds, precision='float64', height_diagnostics=True):
+    """
+    Applies MARBLE lazily over a Dataset with any number of column dimensions
+    (for example time, latitude and longitude). Inputs are converted block by
+    block with :meth:`LatentMarble.predict`, so if ds holds dask arrays the
+    result is a lazy Dataset, computed chunk by chunk when it is loaded or
+    written. Coordinates of ds are kept in the result.
+
+    The vertically-resolved inputs may be given either as principal
+    components (as named in the input_properties of :class:`LatentMarble`),
+    or in height coordinates (as named in the input_properties of
+    :class:`InputHeightToPrincipalComponents`), in which case they are
+    projected onto principal components first. Dimensions of the inputs
+    must be named as in those input_properties, and any units attributes
+    must match them.
+
+    Args:
+        ds: Dataset containing every input of :class:`LatentMarble`.
+        precision: floating point precision used for the computation, either
+            'float64' (default) or 'float32'.
+        height_diagnostics: if True (default), also convert the
+            vertically-resolved diagnostics to height coordinates with
+            :class:`DiagnosticPrincipalComponentsToHeight`.
+
+    Returns:
+        output_ds: Dataset of the MARBLE diagnostics, and of its latent
+            tendencies named by prefixing the tendency names with
+            'tendency_of_'.
+    """
+    latent_names = [
+        name for name, properties in LatentMarble.input_properties.items()
+        if properties['dims'] != ['*']]
+    if not all(name in ds for name in latent_names):
+        ds = ds.merge(_apply_component(
+            ds, InputHeightToPrincipalComponents, precision))
+    output_ds = _apply_component(ds, LatentMarble, precision)
+    if height_diagnostics:
+        output_ds = output_ds.merge(
+            _apply_component(
+                output_ds, DiagnosticPrincipalComponentsToHeight, precision))
+    return output_ds
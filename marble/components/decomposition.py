@@ -1,7 +1,18 @@
+import collections
 import numpy as np
 from sympl import DiagnosticComponent
-from marble.components.marble import pc_ds, name_feature_counts
 from marble.docstrings import document_properties
+from marble.components.marble import (
+    get_pc_dataset, get_network_metadata, get_precision_dtype,
+    preloadable_cache, _frozen)
+from marble.components.instrumentation import stage
+
+
+__all__ = [
+    'InputHeightToPrincipalComponents', 'InputPrincipalComponentsToHeight',
+    'DiagnosticPrincipalComponentsToHeight', 'Basis', 'StackedBasis',
+    'get_basis', 'convert_height_to_principal_components',
+    'convert_principal_components_to_height']
 
 
 @document_properties
@@ -9,6 +20,11 @@ class InputHeightToPrincipalComponents(DiagnosticComponent):
     """
     Converts MARBLE's vertically-resolved inputs from height coordinates to
     principal components.
+
+    Args:
+        precision: floating point precision used for the principal component
+            bases and matrix multiplications, either 'float64' (default) or
+            'float32'. Outputs are always returned in double precision.
     """
 
     input_properties = {
@@ -47,14 +63,256 @@ class InputHeightToPrincipalComponents(DiagnosticComponent):
         },
     }
 
+    def __init__(self, *args, precision='float64', **kwargs):
+        names = ('sl', 'rt', 'w')
+        self._basis = StackedBasis.from_bases(
+            names, [get_basis(name, precision) for name in names])
+        super(InputHeightToPrincipalComponents, self).__init__(*args, **kwargs)
+
     def array_call(self, state):
-        diagnostic_dict = {}
-        for name in 'w', 'sl', 'rt':
-            diagnostic_dict[f'{name}_latent'] = convert_height_to_principal_components(state[name], name, subtract_mean=True)
-        return diagnostic_dict
+        return self.predict(state)
+
+    def predict(self, inputs):
+        """
+        Projects plain numpy arrays onto principal components, without the
+        dimension checks, unit conversions and DataArray wrapping done when
+        the component is called on a Sympl state.
+
+        Args:
+            inputs: either a dictionary of height coordinate arrays keyed by
+                the aliases of input_properties and in their units, or a
+                single [*, 60] array of those arrays packed along their final
+                dimension in the order of input_properties.
+
+        Returns:
+            outputs: dictionary of principal component arrays keyed by the
+                aliases of diagnostic_properties.
+        """
+        with stage('pack', self):
+            height_array = self._basis.pack(inputs)
+        with stage('project', self):
+            latent_array = self._basis.project(height_array).astype(
+                np.float64, copy=False)
+        with stage('split', self):
+            return {
+                f'{name}_latent': array for name, array in self._basis.split(
+                    latent_array, self._basis.component_slices).items()
+            }
+
+    def __call__(self, state):
+        with stage('__call__', self):
+            return super(
+                InputHeightToPrincipalComponents, self).__call__(state)
+
+
+class Basis(collections.namedtuple(
+        'Basis', [
+            'projection_matrix', 'reconstruction_matrix', 'mean',
+            'projected_mean'])):
+    """
+    Truncated principal component basis of a vertically-resolved quantity,
+    holding C-contiguous read-only projection ([20, n_pc]) and reconstruction
+    ([n_pc, 20]) matrices, the mean vertical profile, and the projection of
+    the mean profile onto the principal components. The mean profile is
+    always held in double precision, so that it can be subtracted from
+    inputs before they are rounded to the basis dtype.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_principal_components(
+            cls, principal_components, mean, dtype=np.float64):
+        """
+        Creates a basis from a [n_pc, 20] array of principal components and a
+        mean vertical profile, with matrices held in the given dtype.
+        """
+        principal_components = np.asarray(
+            principal_components, dtype=np.float64)
+        mean = np.asarray(mean, dtype=np.float64)
+        return cls(
+            projection_matrix=_frozen(principal_components.T, dtype=dtype),
+            reconstruction_matrix=_frozen(principal_components, dtype=dtype),
+            mean=_frozen(mean),
+            projected_mean=_frozen(
+                np.dot(mean, principal_components.T), dtype=dtype),
+        )
 
+    @property
+    def dtype(self):
+        return self.projection_matrix.dtype
 
-def convert_height_to_principal_components(array, basis_name, subtract_mean=True):
+    @property
+    def n_components(self):
+        return self.reconstruction_matrix.shape[0]
+
+    @property
+    def n_levels(self):
+        return self.reconstruction_matrix.shape[1]
+
+    def project(self, array, out=None, subtract_mean=True):
+        """
+        Converts an array whose final dimension is height into principal
+        components.
+
+        Args:
+            array: array whose final dimension is of size n_levels.
+            out (optional): C-contiguous array of the basis dtype into which
+                the result is written.
+            subtract_mean: whether to subtract the mean vertical profile
+                before projecting.
+
+        Returns:
+            out: array whose final dimension is of size n_components.
+        """
+        if subtract_mean:
+            # profiles are much larger than their deviations from the mean,
+            # so the mean is subtracted before rounding to the basis dtype
+            array = np.subtract(array, self.mean)
+        array = np.asarray(array).astype(self.dtype, copy=False)
+        return np.dot(array, self.projection_matrix, out=out)
+
+    def reconstruct(self, array, out=None, add_mean=True):
+        """
+        Converts an array whose final dimension is principal component number
+        into height coordinates.
+
+        Args:
+            array: array whose final dimension is of size n_components.
+            out (optional): C-contiguous array of the basis dtype into which
+                the result is written.
+            add_mean: whether to add the mean vertical profile after
+                reconstructing.
+
+        Returns:
+            out: array whose final dimension is of size n_levels.
+        """
+        array = np.asarray(array).astype(self.dtype, copy=False)
+        out = np.dot(array, self.reconstruction_matrix, out=out)
+        if add_mean:
+            out += self.mean
+        return out
+
+
+@preloadable_cache
+def get_basis(basis_name, precision='float64'):
+    """
+    Returns the :class:`Basis` used by MARBLE for a basis quantity in the
+    given precision ('float32' or 'float64'). The basis is built on first use
+    and shared by all callers.
+    """
+    dtype = get_precision_dtype(precision)
+    pc_ds = get_pc_dataset()
+    n_features = get_network_metadata().name_feature_counts[basis_name]
+    return Basis.from_principal_components(
+        pc_ds[f'{basis_name}_principal_components'].values[:n_features, :],
+        pc_ds[f'{basis_name}_mean'].values,
+        dtype=dtype,
+    )
+
+
+class StackedBasis(collections.namedtuple(
+        'StackedBasis', [
+            'names', 'projection_matrix', 'reconstruction_matrix', 'mean',
+            'level_slices', 'component_slices'])):
+    """
+    Several principal component bases stacked into block-diagonal projection
+    and reconstruction matrices, so that a set of quantities packed along
+    their final dimension can be converted with a single matrix
+    multiplication. As for :class:`Basis`, the stacked mean profile is held
+    in double precision.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_bases(cls, names, bases, use_mean=None):
+        """
+        Creates a stacked basis.
+
+        Args:
+            names: names of the quantities, in packing order.
+            bases: :class:`Basis` for each quantity, all of the same dtype.
+            use_mean (optional): for each quantity, whether its mean profile
+                is subtracted when projecting and added when reconstructing.
+                By default means are used for all quantities.
+        """
+        if use_mean is None:
+            use_mean = [True] * len(bases)
+        n_levels = sum(basis.n_levels for basis in bases)
+        n_components = sum(basis.n_components for basis in bases)
+        dtype = bases[0].dtype
+        reconstruction_matrix = np.zeros((n_components, n_levels), dtype=dtype)
+        mean = np.zeros(n_levels)
+        level_slices, component_slices = [], []
+        i_level, i_component = 0, 0
+        for basis, basis_use_mean in zip(bases, use_mean):
+            level_slice = slice(i_level, i_level + basis.n_levels)
+            component_slice = slice(
+                i_component, i_component + basis.n_components)
+            reconstruction_matrix[component_slice, level_slice] = (
+                basis.reconstruction_matrix)
+            if basis_use_mean:
+                mean[level_slice] = basis.mean
+            level_slices.append(level_slice)
+            component_slices.append(component_slice)
+            i_level, i_component = level_slice.stop, component_slice.stop
+        return cls(
+            names=tuple(names),
+            projection_matrix=_frozen(reconstruction_matrix.T, dtype=dtype),
+            reconstruction_matrix=_frozen(reconstruction_matrix, dtype=dtype),
+            mean=_frozen(mean),
+            level_slices=tuple(level_slices),
+            component_slices=tuple(component_slices),
+        )
+
+    @property
+    def dtype(self):
+        return self.projection_matrix.dtype
+
+    def pack(self, array_dict):
+        """
+        Packs the arrays for each quantity in array_dict along their final
+        dimension into a single array. If array_dict is already a packed
+        array, it is returned unchanged. Arrays are cast to the basis dtype
+        by :meth:`project` and :meth:`reconstruct`, after any mean profile
+        is subtracted.
+        """
+        if isinstance(array_dict, np.ndarray):
+            return array_dict
+        return np.concatenate(
+            [np.asarray(array_dict[name]) for name in self.names], axis=-1)
+
+    def split(self, array, slices):
+        """
+        Splits a packed array into a dictionary of views for each quantity,
+        using either level_slices or component_slices.
+        """
+        return {
+            name: array[..., array_slice]
+            for name, array_slice in zip(self.names, slices)
+        }
+
+    def project(self, array, out=None):
+        """
+        Converts a packed array of height-coordinate quantities into a packed
+        array of principal components.
+        """
+        # subtracted before rounding to the basis dtype, see Basis.project
+        array = np.subtract(array, self.mean).astype(self.dtype, copy=False)
+        return np.dot(array, self.projection_matrix, out=out)
+
+    def reconstruct(self, array, out=None):
+        """
+        Converts a packed array of principal components into a packed array
+        of height-coordinate quantities.
+        """
+        array = np.asarray(array).astype(self.dtype, copy=False)
+        out = np.dot(array, self.reconstruction_matrix, out=out)
+        out += self.mean
+        return out
+
+
+def convert_height_to_principal_components(
+        array, basis_name, subtract_mean=True, precision='float64', out=None):
     """
     Converts a numpy array from height coordinates on a 20-point equidistant grid
     from 0 to 3km (inclusive) into principal components required by MARBLE.
@@ -68,20 +326,21 @@ def convert_height_to_principal_components(array, basis_name, subtract_mean=True
             components. Generally this is True if you are converting the basis
             quantity itself, and False if you are converting a difference to
             apply to the basis quantity (such as a tendency).
+        precision: floating point precision used for the computation, either
+            'float64' (default) or 'float32'.
+        out (optional): C-contiguous array of the given precision into which
+            the result is written.
 
     Returns:
         return_array: numpy array whose final dimension length is equal to the
             number of principal components used for hte basis quantity.
     """
-    if subtract_mean:
-        array = array - pc_ds[f'{basis_name}_mean'].values
-    return np.dot(
-        array,
-        pc_ds[f'{basis_name}_principal_components'].values[:name_feature_counts[basis_name], :].T
-    )
+    return get_basis(basis_name, precision).project(
+        array, out=out, subtract_mean=subtract_mean)
 
 
-def convert_principal_components_to_height(array, basis_name, add_mean=True):
+def convert_principal_components_to_height(
+        array, basis_name, add_mean=True, precision='float64', out=None):
     """
     Converts a numpy array from principal components as used by MARBLE to
     height coordinates on a 20-point equidistant grid from 0 to 3km (inclusive).
@@ -95,17 +354,16 @@ def convert_principal_components_to_height(array, basis_name, add_mean=True):
             coordinates. Generally this is True if you are converting the basis
             quantity itself, and False if you are converting a difference
             applied to the basis quantity (such as a tendency).
+        precision: floating point precision used for the computation, either
+            'float64' (default) or 'float32'.
+        out (optional): C-contiguous array of the given precision into which
+            the result is written.
 
     Returns:
         return_array: numpy array whose final dimension length is 20.
     """
-    result = np.dot(
-        array,
-        pc_ds[f'{basis_name}_principal_components'].values[:name_feature_counts[basis_name], :]
-    )
-    if add_mean:
-        result += pc_ds[f'{basis_name}_mean'].values
-    return result
+    return get_basis(basis_name, precision).reconstruct(
+        array, out=out, add_mean=add_mean)
 
 
 @document_properties
@@ -113,6 +371,11 @@ class InputPrincipalComponentsToHeight(DiagnosticComponent):
     """
     Converts MARBLE's vertically-resolved inputs from principal components to
     height coordinates.
+
+    Args:
+        precision: floating point precision used for the principal component
+            bases and matrix multiplications, either 'float64' (default) or
+            'float32'. Outputs are always returned in double precision.
     """
 
     input_properties = {
@@ -151,13 +414,43 @@ class InputPrincipalComponentsToHeight(DiagnosticComponent):
         },
     }
 
+    def __init__(self, *args, precision='float64', **kwargs):
+        names = ('sl', 'rt', 'w')
+        self._basis = StackedBasis.from_bases(
+            names, [get_basis(name, precision) for name in names])
+        super(InputPrincipalComponentsToHeight, self).__init__(*args, **kwargs)
+
     def array_call(self, state):
-        diagnostic_dict = {}
-        for name in 'sl', 'rt', 'w':
-            diagnostic_dict[name] = convert_principal_components_to_height(
-                state[name], basis_name=name, add_mean=True
-            )
-        return diagnostic_dict
+        return self.predict(state)
+
+    def predict(self, inputs):
+        """
+        Reconstructs height coordinate profiles from plain numpy arrays of
+        principal components. See
+        :meth:`InputHeightToPrincipalComponents.predict`.
+
+        Args:
+            inputs: either a dictionary of principal component arrays keyed by
+                the aliases of input_properties, or a single array of those
+                arrays packed along their final dimension in the order of
+                input_properties.
+
+        Returns:
+            outputs: dictionary of height coordinate arrays keyed by the
+                aliases of diagnostic_properties, in their units.
+        """
+        with stage('pack', self):
+            latent_array = self._basis.pack(inputs)
+        with stage('reconstruct', self):
+            height_array = self._basis.reconstruct(latent_array).astype(
+                np.float64, copy=False)
+        with stage('split', self):
+            return self._basis.split(height_array, self._basis.level_slices)
+
+    def __call__(self, state):
+        with stage('__call__', self):
+            return super(
+                InputPrincipalComponentsToHeight, self).__call__(state)
 
 
 @document_properties
@@ -165,6 +458,11 @@ class DiagnosticPrincipalComponentsToHeight(DiagnosticComponent):
     """
     Converts MARBLE's vertically-resolved diagnostic outputs from principal
     components to height coordinates.
+
+    Args:
+        precision: floating point precision used for the principal component
+            bases and matrix multiplications, either 'float64' (default) or
+            'float32'. Outputs are always returned in double precision.
     """
 
     input_properties = {
@@ -213,13 +511,45 @@ class DiagnosticPrincipalComponentsToHeight(DiagnosticComponent):
         },
     }
 
-    def array_call(self, state):
-        diagnostic_dict = {}
-        for name in 'rcld', 'rrain', 'cld':
-            diagnostic_dict[name] = convert_principal_components_to_height(
-                state[name], basis_name=name, add_mean=True,
-            )
-        diagnostic_dict['sl_rad_clr'] = convert_principal_components_to_height(
-            state['sl_rad_clr'], basis_name='sl', add_mean=False
+    def __init__(self, *args, precision='float64', **kwargs):
+        self._basis = StackedBasis.from_bases(
+            ('rcld', 'rrain', 'cld', 'sl_rad_clr'),
+            [
+                get_basis(name, precision)
+                for name in ('rcld', 'rrain', 'cld', 'sl')],
+            use_mean=(True, True, True, False),
         )
-        return diagnostic_dict
+        super(DiagnosticPrincipalComponentsToHeight, self).__init__(
+            *args, **kwargs)
+
+    def array_call(self, state):
+        return self.predict(state)
+
+    def predict(self, inputs):
+        """
+        Reconstructs height coordinate profiles from plain numpy arrays of
+        principal components. See
+        :meth:`InputHeightToPrincipalComponents.predict`.
+
+        Args:
+            inputs: either a dictionary of principal component arrays keyed by
+                the aliases of input_properties, or a single array of those
+                arrays packed along their final dimension in the order of
+                input_properties.
+
+        Returns:
+            outputs: dictionary of height coordinate arrays keyed by the
+                aliases of diagnostic_properties, in their units.
+        """
+        with stage('pack', self):
+            latent_array = self._basis.pack(inputs)
+        with stage('reconstruct', self):
+            height_array = self._basis.reconstruct(latent_array).astype(
+                np.float64, copy=False)
+        with stage('split', self):
+            return self._basis.split(height_array, self._basis.level_slices)
+
+    def __call__(self, state):
+        with stage('__call__', self):
+            return super(
+                DiagnosticPrincipalComponentsToHeight, self).__call__(state)
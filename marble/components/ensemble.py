@@ -0,0 +1,275 @@
+import collections
+import numpy as np
+from sympl import TendencyComponent
+from marble.docstrings import document_properties
+from marble.components.instrumentation import stage
+from marble.components.marble import (
+    LatentMarble, InferencePlan, preloadable_cache, get_precision_dtype,
+    get_weight_dataset, get_network_metadata, concatenate_pbl_input,
+    get_state_dict_from_array, get_diagnostic_dict_from_array, get_chunks,
+    z_star_height, _frozen)
+
+
+__all__ = ['EnsembleLatentMarble', 'StackedInferencePlan']
+
+
+def _with_member_dim(properties):
+    return {
+        name: dict(value, dims=['ensemble_member'] + value['dims'])
+        for name, value in properties.items()
+    }
+
+
+class StackedInferencePlan(collections.namedtuple(
+        'StackedInferencePlan', [
+            'encoder_W', 'encoder_b', 'hidden_W', 'hidden_b',
+            'decoder_W', 'decoder_b', 'n_state', 'n_diagnostic',
+            'n_members'])):
+    """
+    The :class:`InferencePlan` of several MARBLE networks with the same
+    architecture, stacked so that all members are evaluated together.
+
+    Because every member sees the same inputs, the encoder weights of all
+    members are concatenated along the hidden axis into one
+    [n_pbl_input, n_members * n_hidden] matrix, and the encoder layer is a
+    single matrix multiplication. The remaining layers have a leading member
+    axis and are evaluated as batched matrix multiplications.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_plans(cls, plans):
+        """
+        Stack a sequence of inference plans, which must have the same layer
+        sizes and dtype.
+        """
+        plans = list(plans)
+        if len(plans) == 0:
+            raise ValueError('at least one inference plan is required')
+        for plan in plans[1:]:
+            for name in ('encoder_W', 'hidden_W', 'decoder_W'):
+                if getattr(plan, name).shape != getattr(plans[0], name).shape:
+                    raise ValueError(
+                        'ensemble members must have the same architecture, '
+                        'got {} shapes {} and {}'.format(
+                            name, getattr(plans[0], name).shape,
+                            getattr(plan, name).shape))
+            if ((plan.n_state, plan.n_diagnostic) !=
+                    (plans[0].n_state, plans[0].n_diagnostic)):
+                raise ValueError(
+                    'ensemble members must have the same outputs')
+        dtype = plans[0].dtype
+
+        def stack(name):
+            return _frozen(
+                np.stack([getattr(plan, name) for plan in plans]), dtype=dtype)
+        return cls(
+            encoder_W=_frozen(
+                np.concatenate([plan.encoder_W for plan in plans], axis=1),
+                dtype=dtype),
+            encoder_b=_frozen(
+                np.concatenate([plan.encoder_b for plan in plans]),
+                dtype=dtype),
+            hidden_W=stack('hidden_W'),
+            hidden_b=stack('hidden_b')[:, None, :],
+            decoder_W=stack('decoder_W'),
+            decoder_b=stack('decoder_b')[:, None, :],
+            n_state=plans[0].n_state,
+            n_diagnostic=plans[0].n_diagnostic,
+            n_members=len(plans),
+        )
+
+    @property
+    def dtype(self):
+        return self.encoder_W.dtype
+
+    @property
+    def n_output(self):
+        return self.n_state + self.n_diagnostic
+
+    def evaluate(self, pbl_input_array, chunk_size=None):
+        """
+        Run every member network on a [*, n_pbl_input] array of unnormalized
+        inputs. Computation is done in the dtype of the plan.
+
+        Args:
+            pbl_input_array: [*, n_pbl_input] array of network inputs.
+            chunk_size (optional): if given, columns are evaluated in chunks
+                of at most this many columns, which keeps the hidden layer
+                activations of all members in cache.
+
+        Returns:
+            output_array: [n_members, *, n_state + n_diagnostic] array of
+                denormalized latent tendencies followed by denormalized
+                diagnostics for each member.
+        """
+        pbl_input_array = pbl_input_array.astype(self.dtype, copy=False)
+        n_columns = pbl_input_array.shape[0]
+        if chunk_size is None or n_columns <= chunk_size:
+            return self._evaluate_chunk(pbl_input_array)
+        output_array = np.empty(
+            (self.n_members, n_columns, self.n_output), dtype=self.dtype)
+        for chunk in get_chunks(n_columns, chunk_size):
+            output_array[:, chunk, :] = self._evaluate_chunk(
+                pbl_input_array[chunk])
+        return output_array
+
+    def _evaluate_chunk(self, pbl_input_array):
+        n_columns = pbl_input_array.shape[0]
+        X = np.dot(pbl_input_array, self.encoder_W)
+        X += self.encoder_b
+        np.maximum(X, 0., out=X)
+        # [*, n_members * n_hidden] -> [n_members, *, n_hidden]
+        X = X.reshape(n_columns, self.n_members, -1).transpose(1, 0, 2)
+        X = np.matmul(X, self.hidden_W)
+        X += self.hidden_b
+        np.maximum(X, 0., out=X)
+        output_array = np.matmul(X, self.decoder_W)
+        output_array += self.decoder_b
+        return output_array
+
+
+@preloadable_cache
+def get_stacked_inference_plan(filenames, precision='float64'):
+    """
+    Returns the :class:`StackedInferencePlan` of the MARBLE weights stored in
+    a tuple of filenames, at the given precision ('float32' or 'float64').
+    Every weight file must have the same network layout as the default MARBLE
+    weights.
+    """
+    dtype = get_precision_dtype(precision)
+    reference_metadata = get_network_metadata()
+    plans = []
+    for filename in filenames:
+        if get_network_metadata(filename) != reference_metadata:
+            raise ValueError(
+                'weights in {} do not have the same name lists and feature '
+                'counts as the default MARBLE weights'.format(filename))
+        plan = InferencePlan.from_dataset(get_weight_dataset(filename))
+        if dtype != plan.dtype:
+            plan = plan.astype(dtype)
+        plans.append(plan)
+    return StackedInferencePlan.from_plans(plans)
+
+
+@document_properties
+class EnsembleLatentMarble(TendencyComponent):
+    """
+    Ensemble of MARBLE networks working in latent space, which evaluates
+    several weight files of the same architecture (for example perturbed or
+    retrained networks) on the same inputs in one call. Outputs are those of
+    :class:`LatentMarble` with a leading ensemble_member dimension.
+
+    Args:
+        filenames: sequence of MARBLE weight filenames, one per ensemble
+            member. Every file must have the same name lists and feature
+            counts as the default weights.
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+            Outputs are always returned in double precision.
+        statistics: if True, also return the ensemble mean and spread
+            (standard deviation across members) of every output as
+            diagnostics named by appending '_ensemble_mean' and
+            '_ensemble_spread' to the diagnostic names, and to
+            'tendency_of_' followed by the tendency names.
+        chunk_size: number of columns evaluated at a time (default 256), or
+            None to evaluate all columns at once. Evaluating all members on a
+            few hundred columns at a time keeps their hidden layer
+            activations in cache.
+    """
+
+    input_properties = LatentMarble.input_properties
+
+    tendency_properties = _with_member_dim(LatentMarble.tendency_properties)
+
+    diagnostic_properties = _with_member_dim({
+        name: properties
+        for name, properties in LatentMarble.diagnostic_properties.items()
+        if name != 'height'
+    })
+    diagnostic_properties['height'] = (
+        LatentMarble.diagnostic_properties['height'])
+
+    def __init__(
+            self, filenames, *args, precision='float64', statistics=False,
+            chunk_size=256, **kwargs):
+        self._plan = get_stacked_inference_plan(tuple(filenames), precision)
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError(
+                'chunk_size must be positive, got {}'.format(chunk_size))
+        self._chunk_size = chunk_size
+        self._statistics = statistics
+        if statistics:
+            self.diagnostic_properties = dict(self.diagnostic_properties)
+            self.diagnostic_properties.update(
+                self._get_statistics_properties())
+        super(EnsembleLatentMarble, self).__init__(*args, **kwargs)
+
+    @property
+    def n_members(self):
+        return self._plan.n_members
+
+    @staticmethod
+    def _get_statistics_properties():
+        properties = {}
+        for prefix, output_properties in (
+                ('tendency_of_', LatentMarble.tendency_properties),
+                ('', LatentMarble.diagnostic_properties)):
+            for name, value in output_properties.items():
+                if name == 'height':
+                    continue
+                alias_prefix = prefix + value['alias']
+                for statistic in ('mean', 'spread'):
+                    key = '{}{}_ensemble_{}'.format(prefix, name, statistic)
+                    properties[key] = dict(
+                        value,
+                        alias='{}_ensemble_{}'.format(alias_prefix, statistic))
+        return properties
+
+    def array_call(self, state):
+        with stage('concatenate_pbl_input', self):
+            pbl_input_array = concatenate_pbl_input(state)
+        with stage('evaluate', self):
+            output_array = self._plan.evaluate(
+                pbl_input_array, chunk_size=self._chunk_size)
+        with stage('split_outputs', self):
+            output_array = output_array.astype(np.float64, copy=False)
+            tendency_dict, diagnostic_dict = self._get_output_dicts(
+                output_array)
+            if self._statistics:
+                diagnostic_dict.update(self._get_statistics(output_array))
+            diagnostic_dict['z'] = z_star_height.copy()
+        return tendency_dict, diagnostic_dict
+
+    def __call__(self, state):
+        with stage('__call__', self):
+            return super(EnsembleLatentMarble, self).__call__(state)
+
+    def _get_output_dicts(self, output_array):
+        n_members, n_columns, n_output = output_array.shape
+        # split along the last axis with the members folded into the columns
+        flat_output = output_array.reshape(n_members * n_columns, n_output)
+        n_state = self._plan.n_state
+        tendency_dict = get_state_dict_from_array(flat_output[:, :n_state])
+        diagnostic_dict = get_diagnostic_dict_from_array(
+            flat_output[:, n_state:])
+        for output_dict in (tendency_dict, diagnostic_dict):
+            for name, array in output_dict.items():
+                output_dict[name] = array.reshape(
+                    (n_members, n_columns) + array.shape[1:])
+        return tendency_dict, diagnostic_dict
+
+    def _get_statistics(self, output_array):
+        mean_tendencies, mean_diagnostics = self._get_output_dicts(
+            output_array.mean(axis=0)[None, :, :])
+        spread_tendencies, spread_diagnostics = self._get_output_dicts(
+            output_array.std(axis=0)[None, :, :])
+        statistics = {}
+        for prefix, mean_dict, spread_dict in (
+                ('tendency_of_', mean_tendencies, spread_tendencies),
+                ('', mean_diagnostics, spread_diagnostics)):
+            for alias in mean_dict:
+                name = prefix + alias
+                statistics[name + '_ensemble_mean'] = mean_dict[alias][0]
+                statistics[name + '_ensemble_spread'] = spread_dict[alias][0]
+        return statistics
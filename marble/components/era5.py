@@ -0,0 +1,230 @@
+import sympl as sp
+import xarray as xr
+from marble.components.decomposition import (
+    convert_height_to_principal_components)
+from marble.components.integrator import get_forcing_properties
+from marble.components.marble import z_star_height
+
+
+__all__ = ['ERA5ForcingProvider']
+
+# (name, variable, units) of column-scalar forcings, read at every timestep
+scalar_forcing_variables = (
+    ('surface_temperature', 'sst', 'degK'),
+    ('surface_air_pressure', 'p_surface', 'Pa'),
+    ('downwelling_shortwave_radiation_at_3km', 'swdn_tod', 'W/m^2'),
+    ('downwelling_shortwave_radiation_at_top_of_atmosphere', 'swdn_toa',
+     'W/m^2'),
+    ('mid_cloud_fraction', 'cldmid', ''),
+    ('high_cloud_fraction', 'cldhigh', ''),
+)
+
+# (name, variable, units) of heat fluxes accumulated over an hour in J/m^2
+flux_forcing_variables = (
+    ('surface_latent_heat_flux', 'lhf', 'W/m^2'),
+    ('surface_sensible_heat_flux', 'shf', 'W/m^2'),
+)
+
+# (name, variable, units) of forcings taken from the top level of a profile
+domain_top_forcing_variables = (
+    ('total_water_mixing_ratio_at_3km', 'rt', 'kg/kg'),
+    ('liquid_water_static_energy_at_3km', 'sl', 'J/kg'),
+    ('rain_water_mixing_ratio_at_3km', 'rrain', 'kg/kg'),
+)
+
+# (name, variable, units) of reference diagnostics
+diagnostic_variables = (
+    ('cloud_fraction', 'cld', ''),
+    ('surface_precipitation_rate', 'precip', 'mm/hr'),
+    ('rain_water_mixing_ratio', 'rrain', 'kg/kg'),
+    ('cloud_water_mixing_ratio', 'rcld', 'kg/kg'),
+    ('clear_sky_radiative_heating_rate', 'sl_rad_clr', 'degK/hr'),
+    ('low_cloud_fraction', 'cldlow', ''),
+    ('column_cloud_water', 'ccw', 'kg/m^2'),
+)
+
+advective_tendency_variables = {
+    'liquid_water_static_energy_horizontal_advective_tendency': 'sl_adv',
+    'total_water_mixing_ratio_horizontal_advective_tendency': 'rt_adv',
+}
+
+state_variables = (
+    ('liquid_water_static_energy', 'sl', 'J/kg'),
+    ('total_water_mixing_ratio', 'rt', 'kg/kg'),
+)
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+class ERA5ForcingProvider(object):
+    """
+    Provides initial states, forcings and reference diagnostics from an ERA5
+    column file, such as the one used in the MARBLE examples.
+
+    The file is read once when the provider is created, and the principal
+    components of the vertically-resolved fields are computed for every
+    timestep at once. The states returned for each timestep then hold
+    read-only views of these arrays rather than copies.
+
+    Args:
+        filename: path of the ERA5 column file.
+        precision: floating point precision used for the principal component
+            projections, either 'float64' (default) or 'float32'.
+    """
+
+    def __init__(self, filename, precision='float64'):
+        self.filename = filename
+        variable_names = set(
+            [variable for _, variable, _ in
+             scalar_forcing_variables + flux_forcing_variables +
+             domain_top_forcing_variables + diagnostic_variables +
+             state_variables] +
+            list(advective_tendency_variables.values()) + ['w']
+        )
+        self._arrays = {}
+        self._units = {}
+        with xr.open_dataset(filename) as dataset:
+            for variable in variable_names:
+                self._arrays[variable] = _read_only(dataset[variable].values)
+                self._units[variable] = dataset[variable].attrs.get(
+                    'units', '')
+            self.times = dataset['time'].values
+        for name, variable, _ in flux_forcing_variables:
+            # divide by one hour to go from J/m^2 to W/m^2
+            self._arrays[name] = _read_only(self._arrays[variable] / 3600.)
+        self._latent_arrays = {}
+        for name in ('sl', 'rt', 'w'):
+            self._latent_arrays[name] = _read_only(
+                convert_height_to_principal_components(
+                    self._arrays[name], basis_name=name, precision=precision))
+        for name in ('sl', 'rt'):
+            self._latent_arrays[name + '_adv'] = _read_only(
+                convert_height_to_principal_components(
+                    self._arrays[name + '_adv'], basis_name=name,
+                    subtract_mean=False, precision=precision))
+        self._height = z_star_height
+
+    @property
+    def n_times(self):
+        """Number of timesteps in the file."""
+        return len(self.times)
+
+    def get_state(self, i_timestep=0, latent=True):
+        """
+        Returns the model state at a timestep, with time set to zero.
+
+        Args:
+            i_timestep: index of the timestep.
+            latent: if True, the prognostic quantities are returned as
+                principal components. Otherwise, they are returned on height
+                coordinates together with the height.
+
+        Returns:
+            state (dict): a Sympl state dictionary.
+        """
+        state = {'time': sp.timedelta(0)}
+        if latent:
+            for name, variable, _ in state_variables:
+                state[name + '_components'] = self._latent_data_array(
+                    variable, i_timestep)
+        else:
+            for name, variable, units in state_variables:
+                state[name] = sp.DataArray(
+                    self._arrays[variable][i_timestep], dims=['z_star'],
+                    attrs={'units': units})
+            state['height'] = sp.DataArray(
+                self._height, dims=['z_star'], attrs={'units': 'm'})
+        return state
+
+    def get_forcing(self, i_timestep, latent=True):
+        """
+        Returns the forcing quantities at a timestep.
+
+        Args:
+            i_timestep: index of the timestep.
+            latent: if True, also include the principal components of the
+                vertical wind and horizontal advective tendencies.
+
+        Returns:
+            forcing (dict): dictionary of Sympl DataArrays.
+        """
+        forcing = {}
+        for name, variable, units in scalar_forcing_variables:
+            forcing[name] = sp.DataArray(
+                self._arrays[variable][i_timestep], dims=[],
+                attrs={'units': units})
+        for name, _, units in flux_forcing_variables:
+            forcing[name] = sp.DataArray(
+                self._arrays[name][i_timestep], dims=[],
+                attrs={'units': units})
+        for name, variable, units in domain_top_forcing_variables:
+            forcing[name] = sp.DataArray(
+                self._arrays[variable][i_timestep, -1], dims=[],
+                attrs={'units': units})
+        forcing['vertical_wind'] = sp.DataArray(
+            self._arrays['w'][i_timestep], dims=['z_star'],
+            attrs={'units': 'm/s'})
+        for name, variable in advective_tendency_variables.items():
+            forcing[name] = sp.DataArray(
+                self._arrays[variable][i_timestep], dims=['z_star'],
+                attrs={'units': self._units[variable]})
+        if latent:
+            for name, variable, units in state_variables:
+                forcing[name] = sp.DataArray(
+                    self._arrays[variable][i_timestep], dims=['z_star'],
+                    attrs={'units': units})
+            for name, variable in advective_tendency_variables.items():
+                latent_name = name.replace(
+                    '_horizontal', '_components_horizontal')
+                forcing[latent_name] = sp.DataArray(
+                    self._latent_arrays[variable][i_timestep],
+                    dims=[variable.replace('_adv', '_latent')],
+                    attrs={'units': 's^-1'})
+            forcing['vertical_wind_components'] = self._latent_data_array(
+                'w', i_timestep)
+        return forcing
+
+    def get_diagnostics(self, i_timestep):
+        """
+        Returns the reference ERA5 values of the MARBLE diagnostics at a
+        timestep, on height coordinates.
+        """
+        diagnostics = {}
+        for name, variable, units in diagnostic_variables:
+            array = self._arrays[variable][i_timestep]
+            diagnostics[name] = sp.DataArray(
+                array, dims=['z_star'] if array.ndim == 1 else [],
+                attrs={'units': units})
+        return diagnostics
+
+    def get_forcing_timeseries(self, start=None, stop=None):
+        """
+        Returns the forcing arrays for a range of timesteps in the form taken
+        by :meth:`LatentIntegrator.integrate`: keyed by alias, in the units of
+        the MARBLE input properties, with shape [n_times, 1, ...] for a single
+        column.
+        """
+        time_slice = slice(start, stop)
+        timeseries = {}
+        for alias, properties in get_forcing_properties().items():
+            if alias in self._latent_arrays:
+                array = self._latent_arrays[alias][time_slice]
+                if alias.endswith('_adv'):
+                    array = array * 3600.  # from s^-1 to hr^-1
+            elif alias.endswith('_domain_top'):
+                variable = alias[:-len('_domain_top')]
+                array = self._arrays[variable][time_slice, -1]
+            elif alias in ('lhf', 'shf'):
+                array = self._arrays[properties['name']][time_slice]
+            else:
+                array = self._arrays[alias][time_slice]
+            timeseries[alias] = array[:, None, ...]
+        return timeseries
+
+    def _latent_data_array(self, variable, i_timestep):
+        return sp.DataArray(
+            self._latent_arrays[variable][i_timestep],
+            dims=['{}_latent'.format(variable)], attrs={'units': ''})
@@ -0,0 +1,232 @@
+import numpy as np
+from marble.components.marble import (
+    LatentMarble, InferencePlan, get_inference_plan, get_network_metadata,
+    get_precision_dtype, preloadable_cache, z_star_height, _frozen)
+from marble.components.decomposition import get_basis
+from marble.docstrings import document_properties
+
+
+__all__ = ['HeightMarble']
+
+# diagnostics whose height profiles are differences, and so have no mean added
+_diagnostics_without_mean = ('sl_rad_clr',)
+
+
+def get_height_sizes(name_list):
+    """
+    Returns the number of height-coordinate features for each name in
+    name_list, which is the basis size for vertically-resolved quantities
+    and 1 otherwise.
+    """
+    metadata = get_network_metadata()
+    sizes = []
+    for name in name_list:
+        if name in metadata.decomposition_names:
+            basis = get_basis(metadata.decomposition_names[name])
+            sizes.append(basis.n_levels)
+        else:
+            sizes.append(1)
+    return sizes
+
+
+@preloadable_cache
+def get_height_inference_plan(precision='float64'):
+    """
+    Returns an :class:`InferencePlan` for the MARBLE network whose inputs and
+    outputs are on height coordinates rather than principal components.
+
+    The projection of height-coordinate inputs onto principal components is
+    folded into the encoder layer, and the expansion of outputs back onto
+    height coordinates (including addition of mean profiles) into the
+    decoder layer. Folding is always done in double precision before casting
+    to the given precision. The mean input profiles given by
+    :func:`get_height_input_mean` must be subtracted from the inputs before
+    evaluating the plan: folding them into the encoder bias would cancel
+    catastrophically in single precision.
+    """
+    dtype = get_precision_dtype(precision)
+    plan = get_inference_plan('float64')
+    metadata = get_network_metadata()
+
+    encoder_W_blocks = []
+    i_latent = 0
+    for name in metadata.pbl_input_name_list:
+        n_latent = metadata.name_feature_counts.get(name, 1)
+        W_block = plan.encoder_W[i_latent:i_latent + n_latent, :]
+        if name in metadata.decomposition_names:
+            basis = get_basis(metadata.decomposition_names[name], 'float64')
+            W_block = np.dot(basis.projection_matrix, W_block)
+        encoder_W_blocks.append(W_block)
+        i_latent += n_latent
+
+    decoder_W_blocks = []
+    decoder_b_blocks = []
+    i_latent = 0
+    for name in metadata.state_name_list + metadata.diagnostic_name_list:
+        n_latent = metadata.name_feature_counts.get(name, 1)
+        W_block = plan.decoder_W[:, i_latent:i_latent + n_latent]
+        b_block = plan.decoder_b[i_latent:i_latent + n_latent]
+        if name in metadata.decomposition_names:
+            basis = get_basis(metadata.decomposition_names[name], 'float64')
+            W_block = np.dot(W_block, basis.reconstruction_matrix)
+            b_block = np.dot(b_block, basis.reconstruction_matrix)
+            is_tendency = i_latent < plan.n_state
+            if not is_tendency and name not in _diagnostics_without_mean:
+                b_block = b_block + basis.mean
+        decoder_W_blocks.append(W_block)
+        decoder_b_blocks.append(b_block)
+        i_latent += n_latent
+
+    n_state = sum(get_height_sizes(metadata.state_name_list))
+    return InferencePlan(
+        encoder_W=_frozen(
+            np.concatenate(encoder_W_blocks, axis=0), dtype=dtype),
+        encoder_b=_frozen(plan.encoder_b, dtype=dtype),
+        hidden_W=_frozen(plan.hidden_W, dtype=dtype),
+        hidden_b=_frozen(plan.hidden_b, dtype=dtype),
+        decoder_W=_frozen(
+            np.concatenate(decoder_W_blocks, axis=1), dtype=dtype),
+        decoder_b=_frozen(np.concatenate(decoder_b_blocks), dtype=dtype),
+        n_state=n_state,
+        n_diagnostic=sum(get_height_sizes(metadata.diagnostic_name_list)),
+    )
+
+
+@preloadable_cache
+def get_height_input_mean():
+    """
+    Returns the double precision [n_pbl_input] array subtracted from the
+    packed height-coordinate inputs of the network, which holds the mean
+    profiles of vertically-resolved inputs and zero for scalar inputs.
+    """
+    metadata = get_network_metadata()
+    blocks = []
+    for name, size in zip(
+            metadata.pbl_input_name_list,
+            get_height_sizes(metadata.pbl_input_name_list)):
+        if name in metadata.decomposition_names:
+            basis_name = metadata.decomposition_names[name]
+            blocks.append(get_basis(basis_name, 'float64').mean)
+        else:
+            blocks.append(np.zeros(size))
+    return _frozen(np.concatenate(blocks))
+
+
+def split_height_array(array, name_list):
+    """Splits up a [*, n_height] array into individual quantity arrays."""
+    out_dict = {}
+    i_start = 0
+    for name, size in zip(name_list, get_height_sizes(name_list)):
+        if size == 1:
+            out_dict[name] = array[:, i_start]
+        else:
+            out_dict[name] = array[:, i_start:i_start + size]
+        i_start += size
+    return out_dict
+
+
+@document_properties
+class HeightMarble(LatentMarble):
+    """
+    MARBLE component which works directly in height coordinates. This is
+    equivalent to converting inputs to principal components with
+    :class:`InputHeightToPrincipalComponents`, running :class:`LatentMarble`,
+    and converting its outputs back to height coordinates with
+    :class:`DiagnosticPrincipalComponentsToHeight`, but the principal
+    component projections are folded into the network weights so that no
+    intermediate latent arrays are computed.
+
+    Because MARBLE only sees the principal components of its inputs, the
+    tendencies it produces lie in the space spanned by the truncated
+    principal components.
+
+    Takes the same arguments as :class:`LatentMarble`.
+    """
+
+    input_properties = {
+        'liquid_water_static_energy': {
+            'dims': ['*', 'z_star'],
+            'units': 'J/kg',
+            'alias': 'sl',
+        },
+        'total_water_mixing_ratio': {
+            'dims': ['*', 'z_star'],
+            'units': 'kg/kg',
+            'alias': 'rt',
+        },
+        'vertical_wind': {
+            'dims': ['*', 'z_star'],
+            'units': 'm/s',
+            'alias': 'w'
+        },
+    }
+    input_properties.update({
+        name: properties
+        for name, properties in LatentMarble.input_properties.items()
+        if properties['dims'] == ['*']
+    })
+
+    tendency_properties = {
+        'liquid_water_static_energy': {
+            'dims': ['*', 'z_star'],
+            'units': 'J/kg/hr',
+            'alias': 'sl',
+        },
+        'total_water_mixing_ratio': {
+            'dims': ['*', 'z_star'],
+            'units': 'kg/kg/hr',
+            'alias': 'rt',
+        },
+    }
+
+    diagnostic_properties = {
+        'cloud_water_mixing_ratio': {
+            'dims': ['*', 'z_star'],
+            'units': '',
+            'alias': 'rcld',
+        },
+        'rain_water_mixing_ratio': {
+            'dims': ['*', 'z_star'],
+            'units': '',
+            'alias': 'rrain',
+        },
+        'cloud_fraction': {
+            'dims': ['*', 'z_star'],
+            'units': '',
+            'alias': 'cld',
+        },
+        'clear_sky_radiative_heating_rate': {
+            'dims': ['*', 'z_star'],
+            'units': 'degK hr^-1',
+            'alias': 'sl_rad_clr',
+        },
+    }
+    diagnostic_properties.update({
+        name: properties
+        for name, properties in LatentMarble.diagnostic_properties.items()
+        if properties['dims'] in (['*'], ['z_star'])
+    })
+
+    @staticmethod
+    def _get_inference_plan(precision):
+        return get_height_inference_plan(precision)
+
+    def _pack_inputs(self, inputs, out=None):
+        # mean profiles are subtracted before rounding to the plan dtype
+        pbl_input_array = np.subtract(
+            super(HeightMarble, self)._pack_inputs(inputs),
+            get_height_input_mean())
+        if out is None:
+            return pbl_input_array
+        out[...] = pbl_input_array
+        return out
+
+    def _get_output_dicts(self, output_array):
+        metadata = get_network_metadata()
+        tendency_dict = split_height_array(
+            output_array[:, :self._plan.n_state], metadata.state_name_list)
+        diagnostic_dict = split_height_array(
+            output_array[:, self._plan.n_state:],
+            metadata.diagnostic_name_list)
+        diagnostic_dict['z'] = z_star_height.copy()
+        return tendency_dict, diagnostic_dict
@@ -0,0 +1,184 @@
+import collections
+import contextlib
+import threading
+import time
+import tracemalloc
+
+
+__all__ = ['instrument', 'InstrumentationStats', 'StageStats']
+
+# statistics being collected, or None if instrumentation is off
+_active_stats = None
+_null_stage = contextlib.nullcontext()
+
+
+class StageStats(collections.namedtuple(
+        'StageStats', ['calls', 'time', 'self_time', 'allocated_bytes'])):
+    """
+    Statistics collected for one stage.
+
+    Attributes:
+        calls: number of times the stage was run.
+        time: total wall time spent in the stage, in seconds.
+        self_time: wall time spent in the stage outside of any stages nested
+            inside it, in seconds.
+        allocated_bytes: sum over calls of the largest increase in traced
+            memory during the stage, in bytes, or None if memory was not
+            traced.
+    """
+    __slots__ = ()
+
+
+class InstrumentationStats(object):
+    """
+    Per-stage call counts, wall times and memory allocations collected while
+    instrumentation is enabled with :func:`instrument`.
+
+    Stages of MARBLE components are named by the component class and the
+    stage, for example 'LatentMarble.evaluate'. The '__call__' stage of a
+    component includes its other stages, so the time Sympl spends checking
+    and wrapping arrays is the self_time of that stage.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._stages = collections.OrderedDict()
+
+    def record(self, name, elapsed, self_time, allocated_bytes):
+        """Adds one call of a stage to the statistics."""
+        with self._lock:
+            totals = self._stages.setdefault(name, [0, 0., 0., 0])
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] += self_time
+            if allocated_bytes is not None:
+                totals[3] += allocated_bytes
+
+    def __getitem__(self, name):
+        calls, total_time, self_time, allocated_bytes = self._stages[name]
+        return StageStats(
+            calls, total_time, self_time,
+            allocated_bytes if self.trace_memory else None)
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def __iter__(self):
+        return iter(list(self._stages))
+
+    def __len__(self):
+        return len(self._stages)
+
+    def as_dict(self):
+        """Returns a dictionary of :class:`StageStats` keyed by stage name."""
+        return {name: self[name] for name in self}
+
+    def reset(self):
+        """Clears all collected statistics."""
+        with self._lock:
+            self._stages.clear()
+
+    def report(self, file=None):
+        """Prints a table of the collected statistics, slowest stages first."""
+        print('{:<50} {:>8} {:>12} {:>12} {:>14}'.format(
+            'stage', 'calls', 'time (s)', 'self (s)', 'allocated (B)'),
+            file=file)
+        stages = sorted(self.as_dict().items(), key=lambda item: -item[1].time)
+        for name, stats in stages:
+            allocated = stats.allocated_bytes
+            print('{:<50} {:>8d} {:>12.6f} {:>12.6f} {:>14}'.format(
+                name, stats.calls, stats.time, stats.self_time,
+                '-' if allocated is None else allocated), file=file)
+
+
+class _Stage(object):
+
+    _local = threading.local()
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if self.stats.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = self.peak = current
+        self.child_time = 0.
+        stack.append(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start_time
+        stack = self._local.stack
+        stack.pop()
+        allocated_bytes = None
+        if self.stats.trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            allocated_bytes = self.peak - self.start_memory
+        if stack:
+            stack[-1].child_time += elapsed
+            if self.stats.trace_memory:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        self.stats.record(
+            self.name, elapsed, elapsed - self.child_time, allocated_bytes)
+
+
+def stage(name, component=None):
+    """
+    Returns a context manager which records the time and memory spent in a
+    stage if instrumentation is enabled, and does nothing otherwise.
+
+    Args:
+        name: name of the stage.
+        component (optional): object whose class name prefixes the stage
+            name.
+    """
+    if _active_stats is None:
+        return _null_stage
+    if component is not None:
+        name = '{}.{}'.format(type(component).__name__, name)
+    return _Stage(_active_stats, name)
+
+
+@contextlib.contextmanager
+def instrument(trace_memory=True, stats=None):
+    """
+    Context manager which collects per-stage statistics of MARBLE components
+    called inside it. When not enabled, instrumentation costs one check per
+    stage::
+
+        with marble.instrument() as stats:
+            marble_component(state)
+        stats.report()
+
+    Args:
+        trace_memory: if True, also record memory allocated by each stage
+            using tracemalloc. This slows down code which allocates many
+            small objects.
+        stats (optional): :class:`InstrumentationStats` to add statistics to,
+            by default a new one is created.
+
+    Yields:
+        stats (InstrumentationStats): the collected statistics.
+    """
+    global _active_stats
+    if stats is None:
+        stats = InstrumentationStats(trace_memory=trace_memory)
+    start_tracing = stats.trace_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    previous_stats, _active_stats = _active_stats, stats
+    try:
+        yield stats
+    finally:
+        _active_stats = previous_stats
+        if start_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,526 @@
+import numpy as np
+import sympl as sp
+from marble.components.marble import (
+    LatentMarble, get_inference_plan, get_network_metadata,
+    get_diagnostic_dict_from_array)
+from marble.components.forcing import LatentHorizontalAdvectiveForcing
+
+
+__all__ = [
+    'LatentIntegrator', 'ImplicitLatentIntegrator',
+    'AdaptiveLatentIntegrator']
+
+# Adams-Bashforth coefficients for tendencies from newest to oldest
+adams_bashforth_coefficients = {
+    1: (1.,),
+    2: (3./2, -1./2),
+    3: (23./12, -4./3, 5./12),
+    4: (55./24, -59./24, 37./24, -3./8),
+}
+
+
+def get_forcing_properties():
+    """
+    Returns the input properties of every quantity which must be given as
+    forcing to a latent integration, keyed by alias. These are the inputs of
+    :class:`LatentMarble` other than the prognostic state, and the inputs of
+    :class:`LatentHorizontalAdvectiveForcing`.
+    """
+    state_names = get_network_metadata().state_name_list
+    properties = {}
+    all_input_properties = list(LatentMarble.input_properties.items()) + list(
+        LatentHorizontalAdvectiveForcing.input_properties.items())
+    for name, input_properties in all_input_properties:
+        alias = input_properties['alias']
+        if alias not in state_names:
+            properties[alias] = dict(input_properties, name=name)
+    return properties
+
+
+class LatentIntegrator(object):
+    """
+    Integrates MARBLE and horizontal advective forcing in latent space
+    directly on numpy arrays, without calling Sympl components on each step.
+    This gives the same results as stepping :class:`LatentMarble` and
+    :class:`LatentHorizontalAdvectiveForcing` with
+    ``sympl.AdamsBashforth`` of the same order, but avoids the overhead of
+    wrapping arrays and checking dimensions and units on every step.
+
+    Arrays are given in the units of the component input properties (for
+    example, advective forcings in hr^-1) and have a leading column
+    dimension. Many independent columns (for example, different sites) can be
+    integrated together with one network evaluation per step, and columns may
+    start and stop at different steps.
+
+    Like ``sympl.AdamsBashforth``, the integrator keeps a history of previous
+    tendencies between calls to :meth:`integrate`. Call :meth:`reset` to clear
+    it.
+
+    Args:
+        timestep (timedelta): the model timestep.
+        order: order of the Adams-Bashforth scheme, between 1 and 4. Order 1
+            is the same as Forward Euler.
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+            The state is always integrated in double precision.
+    """
+
+    def __init__(self, timestep, order=1, precision='float64'):
+        if order not in adams_bashforth_coefficients:
+            raise ValueError(
+                'order must be between 1 and 4, got {}'.format(order))
+        self.timestep = timestep
+        self.order = order
+        self._plan = get_inference_plan(precision)
+        metadata = get_network_metadata()
+        self._state_slices = {
+            name: metadata.get_name_slice(metadata.state_name_list, name)
+            for name in metadata.state_name_list
+        }
+        self._input_slices = {
+            name: metadata.get_name_slice(metadata.pbl_input_name_list, name)
+            for name in metadata.pbl_input_name_list
+            if name not in metadata.state_name_list
+        }
+        self._advective_names = {
+            '{}_adv'.format(name): name for name in metadata.state_name_list}
+        self._forcing_ndims = {
+            alias: len(properties['dims'])
+            for alias, properties in get_forcing_properties().items()}
+        # coefficients for each number of stored tendencies, padded with zeros
+        self._coefficient_table = np.zeros((order + 1, order))
+        for n_tendencies in range(1, order + 1):
+            coefficients = adams_bashforth_coefficients[n_tendencies]
+            self._coefficient_table[n_tendencies, :n_tendencies] = coefficients
+        self.reset()
+
+    def reset(self):
+        """Clears the history of previous tendencies."""
+        self._tendency_history = None
+        self._tendency_counts = None
+
+    @property
+    def _timestep_hours(self):
+        return self.timestep.total_seconds() / 3600.
+
+    def _pack_state(self, state):
+        n_columns = state[next(iter(self._state_slices))].shape[0]
+        state_array = np.empty((n_columns, self._plan.n_state))
+        for name, state_slice in self._state_slices.items():
+            state_array[:, state_slice] = state[name]
+        return state_array
+
+    def _unpack_state(self, state_array):
+        return {
+            name: state_array[..., state_slice].copy()
+            for name, state_slice in self._state_slices.items()
+        }
+
+    def _is_timeseries(self, forcing):
+        return {
+            name: np.ndim(forcing[name]) > self._forcing_ndims[name]
+            for name in self._forcing_ndims
+        }
+
+    def _set_forcing(
+            self, pbl_input_array, advective_array, forcing, i_step, names):
+        n_columns = pbl_input_array.shape[0]
+        for name in names:
+            array = forcing[name]
+            if np.ndim(array) > self._forcing_ndims[name]:
+                array = array[i_step]
+            if name in self._advective_names:
+                state_slice = self._state_slices[self._advective_names[name]]
+                advective_array[:, state_slice] = array
+            else:
+                pbl_input_array[:, self._input_slices[name]] = np.reshape(
+                    array, (n_columns, -1))
+
+    def integrate(
+            self, state, forcing, n_steps, store_history=False,
+            start_steps=None, durations=None):
+        """
+        Steps the latent state forward.
+
+        Args:
+            state (dict): latent prognostic arrays keyed by alias ('sl' and
+                'rt'), each of shape [n_columns, n_pc]. For columns with a
+                start step, this is the state at that step.
+            forcing: either a dictionary of forcing arrays keyed by alias, or
+                a function taking the step index (starting at 0) and returning
+                such a dictionary. The required aliases are the keys of
+                get_forcing_properties(). In a dictionary, arrays of shape
+                [n_columns, ...] are used for every step, and arrays of shape
+                [n_steps, n_columns, ...] give a forcing time series.
+            n_steps: number of timesteps to take.
+            store_history: if True, also return the state at the start of each
+                step and the diagnostics computed on each step.
+            start_steps (optional): array of the step at which each column
+                starts. By default all columns start at step 0.
+            durations (optional): array of the number of steps taken by each
+                column. By default each column runs until step n_steps.
+
+        Returns:
+            new_state (dict): latent prognostic arrays of each column after its
+                last step.
+            history (dict): only returned if store_history is True. Arrays
+                with a leading dimension of length n_steps of the state at the
+                start of each step (keyed by state alias) and the latent
+                diagnostics of each step (keyed by diagnostic alias). Values
+                are NaN for columns which are not active on a step.
+        """
+        state_array = self._pack_state(state)
+        n_columns, n_state = state_array.shape
+        active_mask = self._get_active_mask(
+            n_steps, n_columns, start_steps, durations)
+        if (self._tendency_history is None or
+                self._tendency_history.shape[1] != n_columns):
+            self._tendency_history = np.zeros((self.order, n_columns, n_state))
+            self._tendency_counts = np.zeros(n_columns, dtype=np.intp)
+        pbl_input_array = np.empty((n_columns, self._plan.encoder_W.shape[0]))
+        advective_array = np.empty((n_columns, n_state))
+        if callable(forcing):
+            varying_names = list(self._forcing_ndims)
+        else:
+            is_timeseries = self._is_timeseries(forcing)
+            varying_names = [
+                name for name in self._forcing_ndims if is_timeseries[name]]
+            self._set_forcing(
+                pbl_input_array, advective_array, forcing, 0, [
+                    name for name in self._forcing_ndims
+                    if not is_timeseries[name]])
+        if store_history:
+            state_history = np.empty((n_steps, n_columns, n_state))
+            diagnostic_history = np.empty(
+                (n_steps, n_columns, self._plan.n_diagnostic))
+        for i_step in range(n_steps):
+            if active_mask is None:
+                active = None
+            else:
+                active = active_mask[i_step]
+                if not active.any():
+                    if store_history:
+                        state_history[i_step] = np.nan
+                        diagnostic_history[i_step] = np.nan
+                    continue
+            step_forcing = forcing(i_step) if callable(forcing) else forcing
+            self._set_forcing(
+                pbl_input_array, advective_array, step_forcing, i_step,
+                varying_names)
+            if store_history:
+                state_history[i_step] = state_array
+            output_array = self._advance(
+                state_array, pbl_input_array, advective_array, active)
+            if store_history:
+                diagnostic_history[i_step] = output_array[:, n_state:]
+                if active is not None:
+                    state_history[i_step, ~active] = np.nan
+                    diagnostic_history[i_step, ~active] = np.nan
+        new_state = self._unpack_state(state_array)
+        if store_history:
+            history = self._unpack_state(state_history)
+            diagnostic_dict = get_diagnostic_dict_from_array(
+                diagnostic_history.reshape((n_steps * n_columns, -1)))
+            for name, array in diagnostic_dict.items():
+                history[name] = array.reshape(
+                    (n_steps, n_columns) + array.shape[1:])
+            return new_state, history
+        return new_state
+
+    @staticmethod
+    def _get_active_mask(n_steps, n_columns, start_steps, durations):
+        """
+        Returns a [n_steps, n_columns] boolean array of which columns are
+        stepped on each step, or None if all columns are always stepped.
+        """
+        if start_steps is None and durations is None:
+            return None
+        start_steps = np.broadcast_to(
+            0 if start_steps is None else np.asarray(start_steps),
+            (n_columns,))
+        if durations is None:
+            end_steps = np.full(n_columns, n_steps)
+        else:
+            end_steps = start_steps + np.broadcast_to(
+                np.asarray(durations), (n_columns,))
+        if (np.any(start_steps < 0) or np.any(end_steps > n_steps) or
+                np.any(end_steps < start_steps)):
+            raise ValueError(
+                'columns must start and end between step 0 and '
+                'n_steps ({})'.format(n_steps))
+        steps = np.arange(n_steps)[:, None]
+        return (steps >= start_steps[None, :]) & (steps < end_steps[None, :])
+
+    def _advance(self, state_array, pbl_input_array, advective_array, active):
+        """
+        Steps state_array forward in place by one timestep, returning the
+        network outputs at the start of the step.
+        """
+        n_state = state_array.shape[1]
+        pbl_input_array[:, :n_state] = state_array
+        output_array = self._plan.evaluate(pbl_input_array)
+        self._step(
+            state_array, output_array[:, :n_state] + advective_array, active)
+        return output_array
+
+    def _step(self, state_array, tendency_array, active=None):
+        history = self._tendency_history
+        if active is None:
+            history[1:] = history[:-1].copy()
+            history[0] = tendency_array
+            np.minimum(
+                self._tendency_counts + 1, self.order,
+                out=self._tendency_counts)
+            coefficients = self._coefficient_table[self._tendency_counts]
+        else:
+            history[1:, active] = history[:-1, active]
+            history[0, active] = tendency_array[active]
+            self._tendency_counts[active] = np.minimum(
+                self._tendency_counts[active] + 1, self.order)
+            coefficients = self._coefficient_table[self._tendency_counts]
+            coefficients[~active] = 0.
+        coefficients *= self._timestep_hours
+        for i_tendency in range(self.order):
+            state_array += (
+                coefficients[:, i_tendency, None] * history[i_tendency])
+
+    def integrate_state(self, state, n_steps):
+        """
+        Steps a Sympl state forward using the forcing it contains, which is
+        held constant during the integration. The state must contain every
+        input of :class:`LatentMarble` and
+        :class:`LatentHorizontalAdvectiveForcing`.
+
+        Args:
+            state (dict): a Sympl state dictionary.
+            n_steps: number of timesteps to take.
+
+        Returns:
+            new_state (dict): the latent prognostic quantities after n_steps,
+                as Sympl DataArrays with the same dimensions as in state, and
+                the updated time.
+        """
+        metadata = get_network_metadata()
+        state_properties = {
+            properties['alias']: dict(properties, name=name)
+            for name, properties in LatentMarble.input_properties.items()
+            if properties['alias'] in metadata.state_name_list
+        }
+        state_arrays = {}
+        for alias, properties in state_properties.items():
+            array = state[properties['name']].to_units(
+                properties['units']).values
+            state_arrays[alias] = array.reshape((-1, array.shape[-1]))
+        forcing = {}
+        for alias, properties in get_forcing_properties().items():
+            array = state[properties['name']].to_units(
+                properties['units']).values
+            if properties['dims'] == ['*']:
+                forcing[alias] = array.reshape((-1,))
+            else:
+                forcing[alias] = array.reshape((-1, array.shape[-1]))
+        new_state_arrays = self.integrate(state_arrays, forcing, n_steps)
+        new_state = {'time': state['time'] + n_steps * self.timestep}
+        for alias, properties in state_properties.items():
+            template = state[properties['name']]
+            new_state[properties['name']] = sp.DataArray(
+                new_state_arrays[alias].reshape(template.shape),
+                dims=template.dims, attrs={'units': properties['units']})
+        return new_state
+
+
+class ImplicitLatentIntegrator(LatentIntegrator):
+    """
+    Integrates MARBLE and horizontal advective forcing in latent space with an
+    implicit scheme, using the analytic Jacobian of the network tendencies.
+    This remains stable at longer timesteps than the explicit
+    Adams-Bashforth schemes of :class:`LatentIntegrator` when the tendencies
+    are stiff.
+
+    With method='rosenbrock', each step is a single linearly implicit
+    (Rosenbrock-Euler) step, solving (I - dt J) dx = dt f(x) with the
+    Jacobian J at the start of the step. With method='backward_euler', this
+    step is followed by n_iterations Newton iterations towards the backward
+    Euler solution x_new = x + dt f(x_new).
+
+    Takes the same arrays as :class:`LatentIntegrator`, and integrate has
+    the same arguments.
+
+    Args:
+        timestep (timedelta): the model timestep.
+        method: either 'rosenbrock' (default) or 'backward_euler'.
+        n_iterations: number of Newton iterations taken by the backward Euler
+            method.
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+            The linear systems are always solved in double precision.
+    """
+
+    methods = ('rosenbrock', 'backward_euler')
+
+    def __init__(
+            self, timestep, method='rosenbrock', n_iterations=2,
+            precision='float64'):
+        if method not in self.methods:
+            raise ValueError('method must be one of {}, got {}'.format(
+                self.methods, method))
+        super(ImplicitLatentIntegrator, self).__init__(
+            timestep, order=1, precision=precision)
+        self.method = method
+        self.n_iterations = n_iterations if method == 'backward_euler' else 0
+
+    def _solve(self, jacobian, right_hand_side, active):
+        """Solves (I - dt J) x = right_hand_side for each column."""
+        matrix = np.eye(jacobian.shape[1]) - self._timestep_hours * jacobian
+        if active is not None:
+            # keep the systems of columns with undefined forcing solvable
+            matrix[~active] = np.eye(jacobian.shape[1])
+            right_hand_side = np.where(active[:, None], right_hand_side, 0.)
+        return np.linalg.solve(matrix, right_hand_side[..., None])[..., 0]
+
+    def _advance(self, state_array, pbl_input_array, advective_array, active):
+        n_state = state_array.shape[1]
+        timestep_hours = self._timestep_hours
+        pbl_input_array[:, :n_state] = state_array
+        output_array, jacobian = self._plan.evaluate_with_jacobian(
+            pbl_input_array)
+        increment = self._solve(
+            jacobian,
+            timestep_hours * (output_array[:, :n_state] + advective_array),
+            active)
+        for _ in range(self.n_iterations):
+            pbl_input_array[:, :n_state] = state_array + increment
+            trial_output_array, jacobian = self._plan.evaluate_with_jacobian(
+                pbl_input_array)
+            residual = increment - timestep_hours * (
+                trial_output_array[:, :n_state] + advective_array)
+            increment -= self._solve(jacobian, residual, active)
+        if active is None:
+            state_array += increment
+        else:
+            state_array[active] += increment[active]
+        return output_array
+
+
+class AdaptiveLatentIntegrator(LatentIntegrator):
+    """
+    Integrates MARBLE and horizontal advective forcing in latent space with
+    adaptive sub-stepping. Each timestep (for example, the hourly forcing
+    interval) is divided into substeps of timestep / 2**level, where the
+    level is chosen separately for each column using the Heun-Euler
+    embedded pair. Substeps always land on the timestep, so forcing and
+    output times are unchanged. Columns which are stepping at the same time
+    are evaluated together in one network call, whatever their substep.
+
+    The local error estimate of each substep is compared to a tolerance on
+    the norm of the latent sl and rt vectors. A substep is accepted when, for
+    both quantities, ||error|| <= atol + rtol * ||state||. Rejected substeps
+    are retried with half the length, and a column's substep is doubled
+    after a substep whose error is well within the tolerance.
+
+    Takes the same arrays as :class:`LatentIntegrator`, and integrate has
+    the same arguments. The number of network evaluations (counted per
+    column, and only for columns which are active on a step) is kept in the
+    n_column_evaluations attribute.
+
+    Args:
+        timestep (timedelta): the interval at which forcing is updated and
+            the state is returned.
+        rtol: relative error tolerance of each substep.
+        atol: absolute error tolerance of each substep, in latent units.
+        max_level: the shortest substep is timestep / 2**max_level. Substeps
+            at this level are accepted whatever their error.
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+    """
+
+    def __init__(
+            self, timestep, rtol=1e-2, atol=0., max_level=6,
+            precision='float64'):
+        super(AdaptiveLatentIntegrator, self).__init__(
+            timestep, order=1, precision=precision)
+        self.rtol = rtol
+        self.atol = atol
+        self.max_level = max_level
+        self.n_column_evaluations = 0
+
+    def reset(self):
+        """Clears the substep levels of each column."""
+        super(AdaptiveLatentIntegrator, self).reset()
+        self._levels = None
+
+    def _evaluate_tendency(
+            self, pbl_input_array, advective_array, columns, state):
+        """Returns the total tendency of the given columns for a state."""
+        pbl_input = pbl_input_array[columns]
+        pbl_input[:, :state.shape[1]] = state
+        self.n_column_evaluations += len(state)
+        output_array = self._plan.evaluate(pbl_input)
+        return output_array[:, :state.shape[1]] + advective_array[columns]
+
+    def _get_error_ratio(self, error, state, new_state):
+        """Returns the largest ratio of the error norm to the tolerance."""
+        ratio = np.zeros(len(error))
+        for state_slice in self._state_slices.values():
+            scale = np.maximum(
+                np.linalg.norm(state[:, state_slice], axis=1),
+                np.linalg.norm(new_state[:, state_slice], axis=1))
+            tolerance = self.atol + self.rtol * scale
+            error_norm = np.linalg.norm(error[:, state_slice], axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                quantity_ratio = np.where(
+                    error_norm > 0., error_norm / tolerance, 0.)
+            np.maximum(ratio, quantity_ratio, out=ratio)
+        return ratio
+
+    def _advance(self, state_array, pbl_input_array, advective_array, active):
+        n_columns, n_state = state_array.shape
+        if self._levels is None or len(self._levels) != n_columns:
+            self._levels = np.zeros(n_columns, dtype=np.intp)
+        n_ticks = 2 ** self.max_level
+        ticks = np.zeros(n_columns, dtype=np.intp)
+        if active is not None:
+            ticks[~active] = n_ticks
+        hours_per_tick = self._timestep_hours / n_ticks
+        pbl_input_array[:, :n_state] = state_array
+        running = np.flatnonzero(ticks < n_ticks)
+        if active is None:
+            output_array = self._plan.evaluate(pbl_input_array)
+        else:
+            # outputs of inactive columns are not used
+            output_array = np.full((n_columns, self._plan.n_output), np.nan)
+            output_array[running] = self._plan.evaluate(
+                pbl_input_array[running])
+        self.n_column_evaluations += len(running)
+        first_tendency = output_array[:, :n_state] + advective_array
+        while len(running) > 0:
+            levels = self._levels[running]
+            step_ticks = n_ticks >> levels
+            step_hours = (step_ticks * hours_per_tick)[:, None]
+            state = state_array[running]
+            tendency = first_tendency[running]
+            second_tendency = self._evaluate_tendency(
+                pbl_input_array, advective_array, running,
+                state + step_hours * tendency)
+            increment = 0.5 * step_hours * (tendency + second_tendency)
+            error = 0.5 * step_hours * (second_tendency - tendency)
+            error_ratio = self._get_error_ratio(
+                error, state, state + increment)
+            accept = (error_ratio <= 1.) | (levels >= self.max_level)
+            accepted = running[accept]
+            state_array[accepted] += increment[accept]
+            ticks[accepted] += step_ticks[accept]
+            # lengthen the substep only where it stays aligned with the
+            # timestep
+            lengthen = (
+                accept & (error_ratio < 0.25) & (levels > 0) &
+                (ticks[running] % (2 * step_ticks) == 0))
+            self._levels[running[lengthen]] -= 1
+            self._levels[running[~accept]] += 1
+            continuing = accepted[ticks[accepted] < n_ticks]
+            if len(continuing) > 0:
+                first_tendency[continuing] = self._evaluate_tendency(
+                    pbl_input_array, advective_array, continuing,
+                    state_array[continuing])
+            running = np.flatnonzero(ticks < n_ticks)
+        return output_array
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 """Main module."""
-from sympl import TendencyComponent
+from sympl import TendencyComponent, get_numpy_arrays_with_properties
 import ast
+import collections
+import concurrent.futures
+import functools
+import inspect
 import os
+import time
 import xarray as xr
 import numpy as np
 from marble.docstrings import document_properties
+from marble.components.instrumentation import stage
 
 
 __all__ = ['LatentMarble']
@@ -18,37 +24,177 @@ data_path = os.path.join(
     ),
     'data'
 )
-weight_ds = xr.open_dataset(os.path.join(data_path, 'weights-nep-mb19.nc'))
-pc_ds = xr.open_dataset(os.path.join(data_path, 'era5-pc-mb19.nc'))
+weight_filename = os.path.join(data_path, 'weights-nep-mb19.nc')
+pc_filename = os.path.join(data_path, 'era5-pc-mb19.nc')
 
+# heights in m of the z_star levels on which the principal components are
+# defined, read-only as it is shared by every component
+z_star_height = np.linspace(0., 3000., 20)
+z_star_height.flags.writeable = False
 
-state_name_list = ast.literal_eval(weight_ds.state_name_list)
-# advective terms are not NN inputs but are included in this list due to a bug
-# must add state terms
-pbl_input_name_list = state_name_list + ast.literal_eval(weight_ds.pbl_input_name_list)
-diagnostic_name_list = ast.literal_eval(weight_ds.pbl_diagnostics_name_list)
-name_feature_counts = ast.literal_eval(weight_ds.name_feature_counts)
-decomposition_names = ast.literal_eval(weight_ds.decomposition_name_mapping)
+
+def preloadable_cache(func):
+    """
+    Caches the results of func keyed on its arguments (with defaults applied),
+    like functools.lru_cache(maxsize=None). Results can also be provided in
+    advance using func.preload(value, *args, **kwargs), for example from
+    parameters held in shared memory.
+    """
+    signature = inspect.signature(func)
+    cache = {}
+    # results keyed on the arguments exactly as passed, which avoids binding
+    # them to the signature on every call
+    call_cache = {}
+
+    def get_key(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return bound.args
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not kwargs and args in call_cache:
+            return call_cache[args]
+        key = get_key(args, kwargs)
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        if not kwargs:
+            call_cache[args] = cache[key]
+        return cache[key]
+
+    def preload(value, *args, **kwargs):
+        cache[get_key(args, kwargs)] = value
+        call_cache.clear()
+
+    def cache_clear():
+        cache.clear()
+        call_cache.clear()
+
+    wrapper.preload = preload
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+class NetworkMetadata(collections.namedtuple(
+        'NetworkMetadata', [
+            'state_name_list', 'pbl_input_name_list', 'diagnostic_name_list',
+            'name_feature_counts', 'decomposition_names'])):
+    """
+    Name lists and feature counts describing the layout of a MARBLE network's
+    inputs and outputs, as stored in the attributes of its weight dataset.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dataset(cls, weight_ds):
+        state_name_list = ast.literal_eval(weight_ds.state_name_list)
+        return cls(
+            state_name_list=state_name_list,
+            # advective terms are not NN inputs but are included in this
+            # list due to a bug, must add state terms
+            pbl_input_name_list=(
+                state_name_list +
+                ast.literal_eval(weight_ds.pbl_input_name_list)),
+            diagnostic_name_list=ast.literal_eval(
+                weight_ds.pbl_diagnostics_name_list),
+            name_feature_counts=ast.literal_eval(
+                weight_ds.name_feature_counts),
+            decomposition_names=ast.literal_eval(
+                weight_ds.decomposition_name_mapping),
+        )
+
+    def get_name_slice(self, name_list, name):
+        """
+        Returns the slice of a concatenated latent array occupied by name.
+        """
+        i_start = 0
+        for other_name in name_list[:name_list.index(name)]:
+            i_start += self.name_feature_counts.get(other_name, 1)
+        return slice(i_start, i_start + self.name_feature_counts.get(name, 1))
 
 
 def zero_sl_rad_clr_mean(weight_ds):
     """Need to set mean for sl_rad_clr to zero because its mean is not actually
     subtracted during neural network training.
     """
-    if 'sl_rad_clr' in diagnostic_name_list:
-        i_sl_rad_clr = diagnostic_name_list.index('sl_rad_clr')
-        i_start = 0
-        for i_name in range(0, i_sl_rad_clr):
-            i_start += name_feature_counts.get(diagnostic_name_list[i_name], 1)
-        i_end = i_start + name_feature_counts['sl_rad_clr']
-        weight_ds['diagnostic_mean'][i_start:i_end] = 0.
+    metadata = NetworkMetadata.from_dataset(weight_ds)
+    if 'sl_rad_clr' in metadata.diagnostic_name_list:
+        rad_slice = metadata.get_name_slice(
+            metadata.diagnostic_name_list, 'sl_rad_clr')
+        weight_ds['diagnostic_mean'][rad_slice] = 0.
+
+
+@functools.lru_cache(maxsize=None)
+def get_weight_dataset(filename=weight_filename):
+    """
+    Returns the MARBLE weight dataset stored in filename, loading it into
+    memory on first use.
+    """
+    with xr.open_dataset(filename) as weight_ds:
+        weight_ds = weight_ds.load()
+    zero_sl_rad_clr_mean(weight_ds)
+    return weight_ds
+
+
+@functools.lru_cache(maxsize=None)
+def get_pc_dataset(filename=pc_filename):
+    """
+    Returns the principal component dataset stored in filename, loading it
+    into memory on first use.
+    """
+    with xr.open_dataset(filename) as pc_ds:
+        return pc_ds.load()
 
-zero_sl_rad_clr_mean(weight_ds)
+
+@preloadable_cache
+def get_network_metadata(filename=weight_filename):
+    """
+    Returns the :class:`NetworkMetadata` of the MARBLE weights stored in
+    filename.
+    """
+    return NetworkMetadata.from_dataset(get_weight_dataset(filename))
+
+
+_lazy_attributes = {
+    'weight_ds': lambda: get_weight_dataset(),
+    'pc_ds': lambda: get_pc_dataset(),
+    'state_name_list': lambda: get_network_metadata().state_name_list,
+    'pbl_input_name_list': lambda: get_network_metadata().pbl_input_name_list,
+    'diagnostic_name_list': (
+        lambda: get_network_metadata().diagnostic_name_list),
+    'name_feature_counts': lambda: get_network_metadata().name_feature_counts,
+    'decomposition_names': lambda: get_network_metadata().decomposition_names,
+}
+
+
+def __getattr__(name):
+    # datasets and the values parsed from them are only loaded when accessed
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
 
 
-def concatenate_pbl_input(state):
+def concatenate_pbl_input(state, out=None):
+    """
+    Concatenates the network inputs in state into a [*, n_pbl_input] array.
+    If out is given, inputs are written into its columns instead of a new
+    array.
+    """
+    name_list = get_network_metadata().pbl_input_name_list
+    if out is not None:
+        i_start = 0
+        for name in name_list:
+            array = state[name]
+            if len(array.shape) == 2:
+                out[:, i_start:i_start + array.shape[1]] = array
+                i_start += array.shape[1]
+            else:
+                out[:, i_start] = array
+                i_start += 1
+        return out
     concat_list = []
-    for name in pbl_input_name_list:
+    for name in name_list:
         array = state[name]
         if len(array.shape) == 2:
             concat_list.append(array)
@@ -57,40 +203,224 @@ def concatenate_pbl_input(state):
     return np.concatenate(concat_list, axis=1)
 
 
-def normalize_pbl_input(pbl_input_array):
-    pbl_input_array -= weight_ds['pbl_input_mean'].values[None, :]
-    pbl_input_array /= weight_ds['pbl_input_scale'].values[None, :]
+# factors applied to raw inputs before normalization, folded into the encoder
+input_unit_factors = {
+    'lhf': 3600.,  # NN expects J/m^2 integrated over an hour
+    'shf': 3600.,
+}
 
 
-def denormalize_diagnostic_output(diagnostic_array):
-    diagnostic_array *= weight_ds['diagnostic_scale'].values[None, :]
-    diagnostic_array += weight_ds['diagnostic_mean'].values[None, :]
+precision_dtypes = {
+    'float32': np.float32,
+    'float64': np.float64,
+}
 
 
-def denormalize_state(state_array, add_mean=True):
-    state_array *= weight_ds['state_scale'].values[None, :]
-    if add_mean:
-        state_array += weight_ds['state_mean'].values[None, :]
+def get_precision_dtype(precision):
+    """
+    Returns the numpy dtype used for computation at the given precision,
+    which must be 'float32' or 'float64'.
+    """
+    try:
+        return precision_dtypes[precision]
+    except KeyError:
+        raise ValueError(
+            'precision must be one of {}, got {}'.format(
+                list(precision_dtypes.keys()), precision)
+        )
 
 
-def get_network_outputs(pbl_input_array):
-    X = pbl_input_array
-    X = np.dot(X, weight_ds['pbl_encoder_W'].values) + weight_ds['pbl_encoder_b'].values
-    X[X < 0.] = 0.
-    X = np.dot(X, weight_ds['pbl_hidden_W'].values) + weight_ds['pbl_hidden_b'].values
-    X[X < 0.] = 0.
-    tend_pbl = np.dot(X, weight_ds['pbl_tend_decoder_W'].values) + weight_ds['pbl_tend_decoder_b'].values
-    diag = np.dot(X, weight_ds['pbl_diag_decoder_W'].values) + weight_ds['pbl_diag_decoder_b'].values
-    return tend_pbl, diag
+def _frozen(array, dtype=np.float64):
+    array = np.ascontiguousarray(array, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+class InferencePlan(collections.namedtuple(
+        'InferencePlan', [
+            'encoder_W', 'encoder_b', 'hidden_W', 'hidden_b',
+            'decoder_W', 'decoder_b', 'n_state', 'n_diagnostic'])):
+    """
+    Precompiled, immutable form of the MARBLE boundary layer network.
+
+    Input normalization is folded into the encoder layer, and output
+    denormalization into a single decoder layer whose first n_state columns
+    are the latent tendencies (including clear-sky radiative heating) and
+    whose remaining n_diagnostic columns are the diagnostic outputs.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dataset(cls, weight_ds):
+        """
+        Compile an inference plan from a MARBLE weight dataset.
+        """
+        def get(name):
+            return weight_ds[name].values.astype(np.float64)
+        metadata = NetworkMetadata.from_dataset(weight_ds)
+        input_factor = np.concatenate([
+            np.full(
+                metadata.name_feature_counts.get(name, 1),
+                input_unit_factors.get(name, 1.))
+            for name in metadata.pbl_input_name_list
+        ])
+        input_mean = get('pbl_input_mean') / input_factor
+        input_scale = get('pbl_input_scale') / input_factor
+        encoder_W = get('pbl_encoder_W') / input_scale[:, None]
+        encoder_b = get('pbl_encoder_b') - np.dot(input_mean, encoder_W)
+        state_scale = get('state_scale')
+        tend_W = get('pbl_tend_decoder_W') * state_scale[None, :]
+        tend_b = get('pbl_tend_decoder_b') * state_scale
+        diagnostic_scale = get('diagnostic_scale')
+        diagnostic_mean = get('diagnostic_mean')
+        diag_W = get('pbl_diag_decoder_W') * diagnostic_scale[None, :]
+        diag_b = get('pbl_diag_decoder_b') * diagnostic_scale + diagnostic_mean
+        if 'sl_rad_clr' in metadata.diagnostic_name_list:
+            # clear-sky radiative heating is applied as part of the sl tendency
+            sl_slice = metadata.get_name_slice(metadata.state_name_list, 'sl')
+            rad_slice = metadata.get_name_slice(
+                metadata.diagnostic_name_list, 'sl_rad_clr')
+            tend_W[:, sl_slice] += diag_W[:, rad_slice]
+            tend_b[sl_slice] += diag_b[rad_slice]
+        return cls(
+            encoder_W=_frozen(encoder_W),
+            encoder_b=_frozen(encoder_b),
+            hidden_W=_frozen(get('pbl_hidden_W')),
+            hidden_b=_frozen(get('pbl_hidden_b')),
+            decoder_W=_frozen(np.concatenate([tend_W, diag_W], axis=1)),
+            decoder_b=_frozen(np.concatenate([tend_b, diag_b])),
+            n_state=tend_W.shape[1],
+            n_diagnostic=diag_W.shape[1],
+        )
+
+    @property
+    def dtype(self):
+        return self.encoder_W.dtype
+
+    def astype(self, dtype):
+        """
+        Returns a copy of this plan with its weights held in the given dtype.
+        """
+        return self._replace(**{
+            name: _frozen(getattr(self, name), dtype=dtype) for name in (
+                'encoder_W', 'encoder_b', 'hidden_W', 'hidden_b',
+                'decoder_W', 'decoder_b')
+        })
+
+    @property
+    def n_output(self):
+        return self.n_state + self.n_diagnostic
+
+    def evaluate(self, pbl_input_array, out=None, workspace=None):
+        """
+        Run the network on a [*, n_pbl_input] array of unnormalized inputs.
+        Computation is done in the dtype of the plan.
+
+        Args:
+            pbl_input_array: [*, n_pbl_input] array of network inputs.
+            out (optional): C-contiguous [*, n_output] array of the plan's
+                dtype into which outputs are written.
+            workspace (optional): :class:`InferenceWorkspace` for the same
+                number of columns, whose hidden layer arrays are used instead
+                of allocating new ones.
+
+        Returns:
+            output_array: [*, n_state + n_diagnostic] array of denormalized
+                latent tendencies followed by denormalized diagnostics.
+        """
+        if workspace is None:
+            output_array, _, _ = self._forward(pbl_input_array, out=out)
+        else:
+            output_array, _, _ = self._forward(
+                pbl_input_array, out=out, encoded=workspace.encoded,
+                hidden=workspace.hidden)
+        return output_array
+
+    def _forward(self, pbl_input_array, out=None, encoded=None, hidden=None):
+        # shared by evaluate and evaluate_with_jacobian, returns the output
+        # and the activations of both hidden layers, which are positive
+        # exactly where each ReLU unit is active
+        pbl_input_array = pbl_input_array.astype(self.dtype, copy=False)
+        X1 = np.dot(pbl_input_array, self.encoder_W, out=encoded)
+        X1 += self.encoder_b
+        np.maximum(X1, 0., out=X1)
+        X2 = np.dot(X1, self.hidden_W, out=hidden)
+        X2 += self.hidden_b
+        np.maximum(X2, 0., out=X2)
+        output_array = np.dot(X2, self.decoder_W, out=out)
+        output_array += self.decoder_b
+        return output_array, X1, X2
+
+    def evaluate_with_jacobian(self, pbl_input_array):
+        """
+        Run the network on a [*, n_pbl_input] array of unnormalized inputs,
+        and also compute the Jacobian of the latent tendencies with respect to
+        the latent state, which makes up the first n_state inputs. Because the
+        hidden layers use ReLU activations, the Jacobian is the product of the
+        layer weights restricted to the units active for each column.
+
+        Args:
+            pbl_input_array: [*, n_pbl_input] array of network inputs.
+
+        Returns:
+            output_array: [*, n_state + n_diagnostic] array of denormalized
+                latent tendencies followed by denormalized diagnostics.
+            jacobian: [*, n_state, n_state] array whose element [c, i, j] is
+                the derivative of tendency i with respect to state j in
+                column c.
+        """
+        output_array, X1, X2 = self._forward(pbl_input_array)
+        # transposed Jacobian, [*, state, tendency]
+        jacobian_T = (
+            self.encoder_W[None, :self.n_state, :] * (X1 > 0)[:, None, :])
+        jacobian_T = np.matmul(jacobian_T, self.hidden_W)
+        jacobian_T *= (X2 > 0)[:, None, :]
+        jacobian_T = np.matmul(jacobian_T, self.decoder_W[:, :self.n_state])
+        return output_array, jacobian_T.transpose(0, 2, 1)
+
+
+class InferenceWorkspace(collections.namedtuple(
+        'InferenceWorkspace', ['pbl_input', 'encoded', 'hidden', 'output'])):
+    """
+    Reusable arrays for evaluating an :class:`InferencePlan` on a fixed
+    number of columns: the network input, the two hidden layer activations,
+    and the network output. The output array is None when outputs are
+    returned to the caller in double precision, and so must be newly
+    allocated on every call. The input array is None when inputs are
+    already packed by the caller.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def for_plan(cls, plan, n_columns, pbl_input=True):
+        """
+        Allocates a workspace for evaluating plan on n_columns columns,
+        including an input array only if pbl_input is True.
+        """
+        n_pbl_input, n_hidden = plan.encoder_W.shape
+        if plan.dtype == np.float64:
+            output = None
+        else:
+            output = np.empty((n_columns, plan.n_output), dtype=plan.dtype)
+        return cls(
+            pbl_input=(
+                np.empty((n_columns, n_pbl_input), dtype=plan.dtype)
+                if pbl_input else None),
+            encoded=np.empty((n_columns, n_hidden), dtype=plan.dtype),
+            hidden=np.empty(
+                (n_columns, plan.hidden_W.shape[1]), dtype=plan.dtype),
+            output=output,
+        )
 
 
 def get_diagnostic_dict_from_array(diagnostic_array):
     """Splits up a [*, n_latent] array of diagnostics into individual quantity
     arrays."""
+    metadata = get_network_metadata()
     out_dict = {}
     i_latent = 0
-    for name in diagnostic_name_list:
-        n_latent = name_feature_counts.get(name, 1)
+    for name in metadata.diagnostic_name_list:
+        n_latent = metadata.name_feature_counts.get(name, 1)
         out_dict[name] = diagnostic_array[:, i_latent:i_latent+n_latent]
         i_latent += n_latent
     for name, array in out_dict.items():
@@ -101,23 +431,99 @@ def get_diagnostic_dict_from_array(diagnostic_array):
 
 def get_state_dict_from_array(state_array):
     """Splits up a [*, n_latent] state array into individual quantity arrays."""
+    metadata = get_network_metadata()
     out_dict = {}
     i_latent = 0
-    for name in state_name_list:
-        n_latent = name_feature_counts[name]
+    for name in metadata.state_name_list:
+        n_latent = metadata.name_feature_counts[name]
         out_dict[name] = state_array[:, i_latent:i_latent+n_latent]
         i_latent += n_latent
     return out_dict
 
 
+chunk_size_candidates = (256, 1024, 4096, 16384)
+
+
+def tune_chunk_size(
+        plan, n_workers=1, candidates=chunk_size_candidates, n_repeats=3):
+    """
+    Returns the chunk size from candidates which gives the highest throughput
+    when evaluating plan on n_workers threads, measured on synthetic inputs.
+    """
+    random = np.random.RandomState(0)
+    n_input = plan.encoder_W.shape[0]
+    best_chunk_size, best_time_per_column = None, np.inf
+    for chunk_size in candidates:
+        n_columns = chunk_size * n_workers
+        pbl_input_array = random.randn(n_columns, n_input).astype(plan.dtype)
+        output_array = np.empty((n_columns, plan.n_output), dtype=plan.dtype)
+        chunks = get_chunks(n_columns, chunk_size)
+        with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+            def evaluate(chunk):
+                plan.evaluate(pbl_input_array[chunk], out=output_array[chunk])
+            list(executor.map(evaluate, chunks))  # warm up
+            start = time.perf_counter()
+            for _ in range(n_repeats):
+                list(executor.map(evaluate, chunks))
+            time_per_column = (
+                (time.perf_counter() - start) / (n_repeats * n_columns))
+        if time_per_column < best_time_per_column:
+            best_chunk_size, best_time_per_column = chunk_size, time_per_column
+    return best_chunk_size
+
+
+def get_chunks(n_columns, chunk_size):
+    """Returns a list of slices dividing n_columns into chunks."""
+    return [
+        slice(i_start, min(i_start + chunk_size, n_columns))
+        for i_start in range(0, n_columns, chunk_size)
+    ]
+
+
+@preloadable_cache
+def get_inference_plan(precision='float64'):
+    """
+    Returns the compiled :class:`InferencePlan` for the MARBLE weights at the
+    given precision ('float32' or 'float64'). The plan is built on first use
+    and shared by all components. Weights are always folded in double
+    precision before being cast.
+    """
+    dtype = get_precision_dtype(precision)
+    plan = InferencePlan.from_dataset(get_weight_dataset())
+    if dtype != plan.dtype:
+        plan = plan.astype(dtype)
+    return plan
+
+
 @document_properties
 class LatentMarble(TendencyComponent):
     """
     MARBLE component which works in latent space (inputs and outputs
     denormalized principal components) without converting to or from the
     real height coordinate.
+
+    Args:
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+            Outputs are always returned in double precision.
+        chunk_size: if given, the column dimension is split into chunks of at
+            most this many columns, each evaluated separately and written into
+            preallocated output arrays. If 'auto', the chunk size is tuned on
+            the first call with more columns than the smallest candidate size.
+        n_workers: number of threads used to evaluate chunks concurrently.
+            Only used if chunk_size is given. You may want to limit the number
+            of BLAS threads when using more than one worker.
+
+    Unchunked calls reuse the input and hidden layer arrays kept for each of
+    the max_workspaces most recently used column counts, so that repeated
+    calls on the same number of columns only allocate their outputs. Because
+    these arrays are shared between calls, an instance must not be called
+    from more than one thread at a time; use one instance per thread, or
+    chunk_size and n_workers to evaluate a single call on several threads.
     """
 
+    max_workspaces = 4
+
     input_properties = {
         'liquid_water_static_energy_components': {
             'dims': ['*', 'sl_latent'],
@@ -247,17 +653,180 @@ class LatentMarble(TendencyComponent):
         }
     }
 
+    def __init__(
+            self, *args, precision='float64', chunk_size=None, n_workers=1,
+            **kwargs):
+        self._plan = self._get_inference_plan(precision)
+        if isinstance(chunk_size, str):
+            if chunk_size != 'auto':
+                raise ValueError(
+                    "chunk_size must be a positive integer, 'auto' or None, "
+                    "got {!r}".format(chunk_size))
+        elif chunk_size is not None and chunk_size < 1:
+            raise ValueError(
+                'chunk_size must be positive, got {}'.format(chunk_size))
+        if n_workers < 1:
+            raise ValueError(
+                'n_workers must be positive, got {}'.format(n_workers))
+        self._chunk_size = chunk_size
+        self._n_workers = n_workers
+        self._workspaces = collections.OrderedDict()
+        super(LatentMarble, self).__init__(*args, **kwargs)
+
+    def _get_workspace(self, n_columns, pbl_input=True):
+        """
+        Returns the workspace for n_columns columns, keeping those of the
+        most recently used batch sizes. Its input array is only allocated
+        once pbl_input is True.
+        """
+        workspace = self._workspaces.pop(n_columns, None)
+        if workspace is None:
+            workspace = InferenceWorkspace.for_plan(
+                self._plan, n_columns, pbl_input=pbl_input)
+            if len(self._workspaces) >= self.max_workspaces:
+                self._workspaces.popitem(last=False)
+        elif pbl_input and workspace.pbl_input is None:
+            workspace = workspace._replace(pbl_input=np.empty(
+                (n_columns, self._plan.encoder_W.shape[0]),
+                dtype=self._plan.dtype))
+        self._workspaces[n_columns] = workspace
+        return workspace
+
+    def _evaluate_in_chunks(self, inputs, n_columns):
+        if self._chunk_size == 'auto':
+            self._chunk_size = tune_chunk_size(self._plan, self._n_workers)
+        output_array = np.empty(
+            (n_columns, self._plan.n_output), dtype=self._plan.dtype)
+        input_names = get_network_metadata().pbl_input_name_list
+
+        def evaluate(chunk):
+            if isinstance(inputs, np.ndarray):
+                pbl_input_array = self._pack_inputs(inputs[chunk])
+            else:
+                pbl_input_array = self._pack_inputs(
+                    {name: inputs[name][chunk] for name in input_names})
+            self._plan.evaluate(pbl_input_array, out=output_array[chunk])
+
+        chunks = get_chunks(n_columns, self._chunk_size)
+        if self._n_workers == 1:
+            for chunk in chunks:
+                evaluate(chunk)
+        else:
+            # chunked calls are large, so starting the threads costs little
+            with concurrent.futures.ThreadPoolExecutor(
+                    self._n_workers) as executor:
+                list(executor.map(evaluate, chunks))
+        return output_array
+
     def array_call(self, state):
-        state['lhf'] = state['lhf'] * 3600.  # NN expects J/m^2 integrated over an hour
-        state['shf'] = state['shf'] * 3600.
-        pbl_input_array = concatenate_pbl_input(state)
-        normalize_pbl_input(pbl_input_array)
-        tendency_array, diagnostic_array = get_network_outputs(pbl_input_array)
-        denormalize_diagnostic_output(diagnostic_array)
-        diagnostic_dict = get_diagnostic_dict_from_array(diagnostic_array)
-        denormalize_state(tendency_array, add_mean=False)
-        tendency_dict = get_state_dict_from_array(tendency_array)
-        tendency_dict['sl'] += diagnostic_dict['sl_rad_clr']
-        diagnostic_dict['z'] = np.linspace(0., 3000., 20)
-        return tendency_dict, diagnostic_dict
+        return self.predict(state)
+
+    def predict(self, inputs):
+        """
+        Runs MARBLE on plain numpy arrays, without the dimension checks, unit
+        conversions and DataArray wrapping done when the component is called
+        on a Sympl state. This is the cheapest way to call MARBLE from a host
+        model which already holds its inputs in contiguous arrays.
+
+        Args:
+            inputs: either a dictionary of arrays keyed by the aliases of
+                input_properties, in the units of input_properties and with
+                a leading column dimension, or a C-contiguous
+                [n_columns, n_pbl_input] array of those arrays packed along
+                their final dimension in the order of pbl_input_name_list
+                (sl, rt and w, then the scalar inputs).
 
+        Returns:
+            tendencies: dictionary of [n_columns, ...] tendency arrays keyed
+                by the aliases of tendency_properties, in their units.
+            diagnostics: dictionary of [n_columns, ...] diagnostic arrays
+                keyed by the aliases of diagnostic_properties, in their
+                units.
+
+        The returned arrays are views into a single output array, which is
+        newly allocated on every call.
+        """
+        if isinstance(inputs, np.ndarray):
+            n_pbl_input = self._plan.encoder_W.shape[0]
+            if inputs.ndim != 2 or inputs.shape[1] != n_pbl_input:
+                raise ValueError(
+                    'packed inputs must have shape [n_columns, {}], '
+                    'got {}'.format(n_pbl_input, inputs.shape))
+            n_columns = inputs.shape[0]
+        else:
+            n_columns = inputs['sst'].shape[0]
+        if self._chunk_size is None:
+            use_chunks = False
+        elif self._chunk_size == 'auto':
+            use_chunks = n_columns > min(chunk_size_candidates)
+        else:
+            use_chunks = n_columns > self._chunk_size
+        if use_chunks:
+            with stage('evaluate', self):
+                output_array = self._evaluate_in_chunks(inputs, n_columns)
+        else:
+            workspace = self._get_workspace(
+                n_columns, pbl_input=not isinstance(inputs, np.ndarray))
+            if isinstance(inputs, np.ndarray):
+                pbl_input_array = self._pack_inputs(inputs)
+            else:
+                with stage('concatenate_pbl_input', self):
+                    pbl_input_array = self._pack_inputs(
+                        inputs, out=workspace.pbl_input)
+            with stage('evaluate', self):
+                output_array = self._plan.evaluate(
+                    pbl_input_array, out=workspace.output, workspace=workspace)
+        with stage('split_outputs', self):
+            output_array = output_array.astype(np.float64, copy=False)
+            return self._get_output_dicts(output_array)
+
+    def __call__(self, state):
+        with stage('__call__', self):
+            return super(LatentMarble, self).__call__(state)
+
+    def array_jacobian(self, state):
+        """
+        Returns the Jacobian of the latent tendencies with respect to the
+        latent state, for a dictionary of input arrays keyed by alias as
+        passed to array_call. The state is ordered as sl components followed
+        by rt components.
+
+        Returns:
+            jacobian: [n_columns, n_state, n_state] array whose element
+                [c, i, j] is the derivative of tendency i (in hr^-1) with
+                respect to state j in column c.
+        """
+        with stage('evaluate_with_jacobian', self):
+            _, jacobian = self._plan.evaluate_with_jacobian(
+                self._pack_inputs(state))
+        return jacobian.astype(np.float64, copy=False)
+
+    def jacobian(self, state):
+        """
+        Returns the Jacobian of the latent tendencies with respect to the
+        latent state for a model state. See :meth:`array_jacobian`.
+        """
+        return self.array_jacobian(
+            get_numpy_arrays_with_properties(state, self.input_properties))
+
+    @staticmethod
+    def _get_inference_plan(precision):
+        return get_inference_plan(precision)
+
+    def _pack_inputs(self, inputs, out=None):
+        """
+        Returns the network input array for a dictionary of input arrays
+        keyed by alias, written into out if given. Packed input arrays are
+        returned unchanged.
+        """
+        if isinstance(inputs, np.ndarray):
+            return inputs
+        return concatenate_pbl_input(inputs, out=out)
+
+    def _get_output_dicts(self, output_array):
+        tendency_dict = get_state_dict_from_array(
+            output_array[:, :self._plan.n_state])
+        diagnostic_dict = get_diagnostic_dict_from_array(
+            output_array[:, self._plan.n_state:])
+        diagnostic_dict['z'] = z_star_height.copy()
+        return tendency_dict, diagnostic_dict
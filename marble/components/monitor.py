@@ -1,6 +1,14 @@
+import datetime
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
 import sympl as sp
 import numpy as np
-from marble.state import AliasDict
+import xarray as xr
+from marble.state import SlotDict, _alias_to_long_name
 
 
 class NotAColumnException(Exception):
@@ -10,11 +18,34 @@ class NotAColumnException(Exception):
 class ColumnStore(sp.Monitor):
     """
     Stores single-column values as numpy arrays to later retrieve a timeseries.
+
+    Values are kept in preallocated arrays for each quantity, which double in
+    length whenever they fill up. If spill_directory is given, these arrays
+    are memory-mapped files in a new temporary directory inside
+    spill_directory, so that the stored history does not need to fit in
+    memory. Call :meth:`close` to delete these files once you are done with
+    the stored values.
+
+    Args:
+        capacity (optional): expected number of times the state will be
+            stored, used as the initial length of the storage arrays.
+        spill_directory (optional): directory in which to create
+            memory-mapped storage files.
     """
 
-    def __init__(self, *args, **kwargs):
+    default_capacity = 64
+
+    def __init__(self, *args, capacity=None, spill_directory=None, **kwargs):
         super(ColumnStore, self).__init__(*args, **kwargs)
-        self._column_lists = AliasDict()
+        self._capacity = capacity or self.default_capacity
+        # [storage array, count] for each quantity, keyed by long name
+        self._columns = {}
+        if spill_directory is not None:
+            self._spill_directory = tempfile.mkdtemp(
+                prefix='marble-column-store-', dir=spill_directory)
+        else:
+            self._spill_directory = None
+        self._spill_filenames = {}
 
     def store(self, state):
         """
@@ -34,12 +65,340 @@ class ColumnStore(sp.Monitor):
                     'array for {} is not a column, has shape {}, dims {}'.format(
                         name, array.shape, array.dims)
                 )
-            elif len(array.shape) == 1:
-                self._column_lists[name] = self._column_lists.get(name, [])
-                self._column_lists[name].append(array.values[None, :])
-            elif len(array.shape) == 0:
-                self._column_lists[name] = self._column_lists.get(name, [])
-                self._column_lists[name].append(array.values[None])
+            else:
+                self._append(name, array.values)
+
+    def _append(self, name, value):
+        # spill files are keyed by long name, so that a quantity stored under
+        # both its alias and long name grows a single file
+        name = _alias_to_long_name.get(name, name)
+        column = self._columns.get(name)
+        if column is None:
+            column_array = self._allocate(
+                name, (self._capacity,) + value.shape, value.dtype)
+            column = self._columns[name] = [column_array, 0]
+        column_array, count = column
+        if count == column_array.shape[0]:
+            column_array = column[0] = self._grow(name, column_array, count)
+        column_array[count] = value
+        column[1] = count + 1
+
+    def _allocate(self, name, shape, dtype):
+        if self._spill_directory is None:
+            return np.empty(shape, dtype=dtype)
+        filename = os.path.join(
+            self._spill_directory, '{}_{}.dat'.format(
+                len(self._spill_filenames), re.sub(r'[^\w.-]', '_', name)))
+        self._spill_filenames[name] = filename
+        return np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+
+    def _grow(self, name, column_array, count):
+        shape = (2 * column_array.shape[0],) + column_array.shape[1:]
+        if self._spill_directory is None:
+            new_array = np.empty(shape, dtype=column_array.dtype)
+            new_array[:count] = column_array[:count]
+            return new_array
+        else:
+            # extend the file in place rather than copying stored values
+            column_array.flush()
+            filename = self._spill_filenames[name]
+            with open(filename, 'r+b') as f:
+                f.truncate(int(np.prod(shape)) * column_array.dtype.itemsize)
+            return np.memmap(
+                filename, dtype=column_array.dtype, mode='r+', shape=shape)
+
+    def __getitem__(self, item):
+        """
+        Returns the stored timeseries of a quantity, with time as the first
+        dimension. The returned array is a view of the storage, and is not
+        updated by later calls to store.
+        """
+        name = _alias_to_long_name.get(item, item)
+        column_array, count = self._columns[name]
+        return column_array[:count]
+
+    def close(self):
+        """
+        Deletes any memory-mapped storage files. Stored values can no longer
+        be retrieved after calling this method.
+        """
+        self._columns = {}
+        self._spill_filenames = {}
+        if self._spill_directory is not None:
+            shutil.rmtree(self._spill_directory, ignore_errors=True)
+            self._spill_directory = None
+
+
+class StreamingStore(sp.Monitor):
+    """
+    Stores states of any shape (for example [*, z_star] arrays from batched or
+    gridded runs) by buffering a number of timesteps in memory and writing
+    them as chunks to a netCDF or zarr store on disk. Writing is done by a
+    background thread, so that storing a state only copies it into the
+    current buffer.
+
+    Call :meth:`close` (or use the store as a context manager) once the run is
+    finished to write any remaining buffered timesteps.
+
+    Args:
+        filename: path of the netCDF file or zarr store to write.
+        chunk_length: number of timesteps buffered before being written as a
+            chunk.
+        file_format (optional): either 'netcdf' or 'zarr'. By default this is
+            'zarr' if filename ends with '.zarr', and 'netcdf' otherwise.
+        max_pending_chunks: number of filled buffers which may wait to be
+            written before store blocks.
+    """
+
+    def __init__(
+            self, filename, chunk_length=24, file_format=None,
+            max_pending_chunks=4):
+        if file_format is None:
+            if filename.rstrip('/').endswith('.zarr'):
+                file_format = 'zarr'
+            else:
+                file_format = 'netcdf'
+        if file_format == 'netcdf':
+            self._writer = NetCDFChunkWriter(filename, chunk_length)
+        elif file_format == 'zarr':
+            self._writer = ZarrChunkWriter(filename, chunk_length)
+        else:
+            raise ValueError(
+                "file_format must be 'netcdf' or 'zarr', "
+                "got {}".format(file_format))
+        self.filename = filename
+        self.chunk_length = chunk_length
+        self._buffers = None
+        self._times = []
+        self._properties = {}
+        self._names = SlotDict()
+        self._reference_time = None
+        self._queue = queue.Queue(maxsize=max_pending_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self._thread.start()
+
+    def store(self, state):
+        """
+        Store a given state.
+
+        Units and dimensions are assumed to be the same each time the state is
+        stored.
+
+        Args:
+            state (dict): a state dictionary, which must contain 'time'.
+        """
+        if self._thread is None:
+            raise ValueError('cannot store a state after the store is closed')
+        self._raise_writer_error()
+        self._check_state(state)
+        if self._buffers is None:
+            self._buffers = {}
+            for name, array in state.items():
+                if name != 'time':
+                    self._buffers[name] = np.empty(
+                        (self.chunk_length,) + array.shape, dtype=array.dtype)
+                    if name not in self._properties:
+                        self._properties[name] = (
+                            tuple(array.dims), array.attrs.get('units', ''))
+                        self._names[name] = name
+        i_time = len(self._times)
+        for name, buffer in self._buffers.items():
+            buffer[i_time] = state[name].values
+        self._times.append(self._get_time_value(state['time']))
+        if len(self._times) == self.chunk_length:
+            self._submit_buffers()
+
+    def _check_state(self, state):
+        # the file layout is fixed by the first state, so a state that does
+        # not match it would otherwise only fail later in the writer thread
+        if 'time' not in state:
+            raise ValueError('state must contain time')
+        if not self._properties:
+            return
+        names = set(state.keys()) - {'time'}
+        if names != set(self._properties.keys()):
+            raise ValueError(
+                'state quantities {} do not match previously stored '
+                'quantities {}'.format(
+                    sorted(names), sorted(self._properties.keys())))
+        for name in names:
+            dims = tuple(state[name].dims)
+            if dims != self._properties[name][0]:
+                raise ValueError(
+                    'dims of {} changed from {} to {}'.format(
+                        name, self._properties[name][0], dims))
+
+    def _get_time_value(self, time):
+        if self._reference_time is None:
+            self._reference_time = time
+            if isinstance(time, datetime.timedelta):
+                self._time_units = 'seconds'
+            else:
+                self._time_units = 'seconds since {}'.format(time.isoformat())
+        if isinstance(time, datetime.timedelta):
+            return time.total_seconds()
+        return (time - self._reference_time).total_seconds()
+
+    def _submit_buffers(self):
+        if self._buffers is not None and len(self._times) > 0:
+            n_times = len(self._times)
+            chunk = {
+                name: buffer[:n_times]
+                for name, buffer in self._buffers.items()}
+            self._queue.put((
+                chunk, np.array(self._times), self._time_units,
+                self._properties))
+        self._buffers = None
+        self._times = []
+
+    def _write_chunks(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    self._writer.write(*item)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """
+        Writes any buffered timesteps and waits for all pending chunks to be
+        written to disk.
+        """
+        self._submit_buffers()
+        self._queue.join()
+        self._raise_writer_error()
+
+    def close(self):
+        """Writes any remaining timesteps and closes the file."""
+        if self._thread is not None:
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, name, start=None, stop=None):
+        """
+        Reads the stored values of a quantity between timestep indices start
+        and stop from disk, flushing any buffered timesteps first. Only the
+        requested quantity and time range are read.
+
+        Args:
+            name: name or alias of the quantity.
+            start (optional): index of the first timestep to read.
+            stop (optional): index one past the last timestep to read.
+
+        Returns:
+            array: numpy array whose first dimension is time.
+        """
+        if self._thread is not None:
+            self.flush()
+        return self._writer.read(self._names[name], slice(start, stop))
 
     def __getitem__(self, item):
-        return np.concatenate(self._column_lists[item], axis=0)
+        return self.read(item)
+
+
+class NetCDFChunkWriter(object):
+    """Appends chunks of timesteps to a netCDF file along an unlimited time
+    dimension."""
+
+    def __init__(self, filename, chunk_length):
+        self.filename = filename
+        self.chunk_length = chunk_length
+        self._dataset = None
+        self._n_times = 0
+        self._lock = threading.Lock()
+
+    def write(self, chunk, times, time_units, properties):
+        with self._lock:
+            if self._dataset is None:
+                self._create(chunk, time_units, properties)
+            i_start = self._n_times
+            i_end = i_start + len(times)
+            self._dataset.variables['time'][i_start:i_end] = times
+            for name, array in chunk.items():
+                self._dataset.variables[name][i_start:i_end] = array
+            self._dataset.sync()
+            self._n_times = i_end
+
+    def _create(self, chunk, time_units, properties):
+        import netCDF4
+        self._dataset = netCDF4.Dataset(self.filename, 'w')
+        self._dataset.createDimension('time', None)
+        time = self._dataset.createVariable('time', np.float64, ('time',))
+        time.units = time_units
+        for name, array in chunk.items():
+            dims, units = properties[name]
+            for dim, length in zip(dims, array.shape[1:]):
+                if dim not in self._dataset.dimensions:
+                    self._dataset.createDimension(dim, length)
+            variable = self._dataset.createVariable(
+                name, array.dtype, ('time',) + dims,
+                chunksizes=(self.chunk_length,) + array.shape[1:])
+            variable.units = units
+
+    def read(self, name, time_slice):
+        with self._lock:
+            if self._dataset is None:
+                import netCDF4
+                with netCDF4.Dataset(self.filename, 'r') as dataset:
+                    return np.ma.getdata(dataset.variables[name][time_slice])
+            return np.ma.getdata(self._dataset.variables[name][time_slice])
+
+    def close(self):
+        with self._lock:
+            if self._dataset is not None:
+                self._dataset.close()
+                self._dataset = None
+
+
+class ZarrChunkWriter(object):
+    """Appends chunks of timesteps to a zarr store along its time dimension.
+    Requires the zarr package."""
+
+    def __init__(self, filename, chunk_length):
+        self.filename = filename
+        self.chunk_length = chunk_length
+        self._initialized = False
+
+    def write(self, chunk, times, time_units, properties):
+        data_vars = {}
+        for name, array in chunk.items():
+            dims, units = properties[name]
+            data_vars[name] = xr.Variable(
+                ('time',) + dims, array, attrs={'units': units})
+        time = xr.Variable(('time',), times, attrs={'units': time_units})
+        dataset = xr.Dataset(data_vars, coords={'time': time})
+        if not self._initialized:
+            encoding = {
+                name: {'chunks': (self.chunk_length,) + array.shape[1:]}
+                for name, array in chunk.items()}
+            dataset.to_zarr(self.filename, mode='w', encoding=encoding)
+            self._initialized = True
+        else:
+            dataset.to_zarr(self.filename, mode='a', append_dim='time')
+
+    def read(self, name, time_slice):
+        with xr.open_zarr(self.filename, decode_times=False) as dataset:
+            return dataset[name][time_slice].values
+
+    def close(self):
+        pass
@@ -0,0 +1,279 @@
+import functools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from marble.components.marble import (
+    LatentMarble, InferencePlan, get_inference_plan, get_network_metadata,
+    get_chunks, z_star_height)
+from marble.components.decomposition import Basis, get_basis
+from marble.docstrings import document_properties
+
+
+__all__ = [
+    'SharedParameters', 'ColumnProcessPool', 'ProcessParallelLatentMarble']
+
+basis_names = ('w', 'sl', 'rt', 'rcld', 'rrain', 'cld')
+plan_array_names = (
+    'encoder_W', 'encoder_b', 'hidden_W', 'hidden_b', 'decoder_W', 'decoder_b')
+_alignment = 64
+
+# shared memory and component instances held by each worker process
+_worker_shared_memory = None
+_worker_components = {}
+
+
+class SharedParameters(object):
+    """
+    Publishes the MARBLE network weights (as compiled inference plans) and
+    principal component bases in a single shared memory block, so that other
+    processes can attach to them without copying or reading any files.
+
+    Args:
+        precision: precision of the parameters to publish, either 'float64'
+            (default) or 'float32'.
+    """
+
+    def __init__(self, precision='float64'):
+        self.precision = precision
+        arrays = {}
+        plan = get_inference_plan(precision)
+        for name in plan_array_names:
+            arrays[('plan', name)] = getattr(plan, name)
+        for basis_name in basis_names:
+            basis = get_basis(basis_name, precision)
+            for name in Basis._fields:
+                arrays[('basis', basis_name, name)] = getattr(basis, name)
+        self.layout = {}
+        offset = 0
+        for key, array in arrays.items():
+            self.layout[key] = (offset, array.shape, array.dtype.str)
+            offset += -(-array.nbytes // _alignment) * _alignment
+        self._shared_memory = shared_memory.SharedMemory(
+            create=True, size=max(offset, 1))
+        for key, array in arrays.items():
+            shared_array = get_shared_array(
+                self._shared_memory, self.layout[key])
+            shared_array[...] = array
+        self.n_state = plan.n_state
+        self.n_diagnostic = plan.n_diagnostic
+        self.metadata = get_network_metadata()
+
+    @property
+    def name(self):
+        """Name of the shared memory block."""
+        return self._shared_memory.name
+
+    def get_attach_args(self):
+        """
+        Returns the (picklable) arguments to pass to
+        :func:`attach_shared_parameters` in another process.
+        """
+        return (
+            self.name, self.layout, self.precision, self.n_state,
+            self.n_diagnostic, self.metadata)
+
+    def close(self):
+        """Releases and destroys the shared memory block."""
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+            self._shared_memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_shared_array(shared_memory_block, array_layout):
+    offset, shape, dtype = array_layout
+    dtype = np.dtype(dtype)
+    return np.ndarray(
+        shape, dtype=dtype, buffer=shared_memory_block.buf, offset=offset)
+
+
+def attach_shared_parameters(
+        name, layout, precision, n_state, n_diagnostic, metadata):
+    """
+    Attaches to parameters published by :class:`SharedParameters` and
+    preloads them into this process's caches, so that MARBLE components
+    created in this process use the shared arrays instead of loading their
+    own copies.
+    """
+    global _worker_shared_memory
+    _worker_shared_memory = shared_memory.SharedMemory(name=name)
+
+    def get(key):
+        array = get_shared_array(_worker_shared_memory, layout[key])
+        array.flags.writeable = False
+        return array
+
+    get_network_metadata.preload(metadata)
+    get_inference_plan.preload(
+        InferencePlan(
+            n_state=n_state, n_diagnostic=n_diagnostic,
+            **{name: get(('plan', name)) for name in plan_array_names}),
+        precision
+    )
+    for basis_name in basis_names:
+        get_basis.preload(
+            Basis(**{
+                name: get(('basis', basis_name, name))
+                for name in Basis._fields}),
+            basis_name, precision
+        )
+
+
+class ColumnProcessPool(object):
+    """
+    Pool of worker processes which apply a function to partitions of the
+    column dimension of a set of arrays. The MARBLE network weights and
+    principal component bases are published once in shared memory, and any
+    MARBLE component created inside a worker uses them without copying.
+
+    Args:
+        n_processes: number of worker processes.
+        precision: precision of the shared parameters, either 'float64'
+            (default) or 'float32'.
+        context (optional): multiprocessing context used to start workers.
+    """
+
+    def __init__(self, n_processes, precision='float64', context=None):
+        self.n_processes = n_processes
+        self._shared_parameters = SharedParameters(precision)
+        context = context or multiprocessing.get_context()
+        try:
+            self._pool = context.Pool(
+                n_processes, initializer=attach_shared_parameters,
+                initargs=self._shared_parameters.get_attach_args())
+        except BaseException:
+            self._shared_parameters.close()
+            raise
+
+    def map_columns(self, function, array_dict, n_columns=None):
+        """
+        Applies function to partitions of the column (first) dimension of
+        the arrays in array_dict, and gathers the results.
+
+        Args:
+            function: picklable function taking a dictionary of arrays and
+                returning a dictionary of arrays whose first dimension is the
+                column dimension.
+            array_dict (dict): arrays whose first dimension is the column
+                dimension.
+            n_columns (optional): length of the column dimension, by default
+                taken from the first array.
+
+        Returns:
+            result_dict (dict): outputs of function, concatenated along the
+                column dimension.
+        """
+        if n_columns is None:
+            n_columns = next(iter(array_dict.values())).shape[0]
+        chunk_size = max(-(-n_columns // self.n_processes), 1)
+        # with no columns, one empty partition gives correctly shaped outputs
+        chunks = get_chunks(n_columns, chunk_size) or [slice(0, 0)]
+        partitions = [
+            {name: array[chunk] for name, array in array_dict.items()}
+            for chunk in chunks
+        ]
+        results = self._pool.map(function, partitions)
+        return {
+            name: np.concatenate([result[name] for result in results], axis=0)
+            for name in results[0].keys()
+        }
+
+    def close(self):
+        """Shuts down the worker processes and releases shared memory."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._shared_parameters.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_packed_input_key = 'packed_inputs'
+
+
+def _latent_marble_worker(precision, state):
+    if precision not in _worker_components:
+        _worker_components[precision] = LatentMarble(precision=precision)
+    # packed inputs are sent as the only array of the state
+    inputs = state.get(_packed_input_key, state)
+    tendency_dict, diagnostic_dict = _worker_components[precision].predict(
+        inputs)
+    diagnostic_dict.pop('z')  # not a column quantity
+    result = {
+        ('tendency', name): array for name, array in tendency_dict.items()}
+    result.update({
+        ('diagnostic', name): array
+        for name, array in diagnostic_dict.items()})
+    return result
+
+
+@document_properties
+class ProcessParallelLatentMarble(LatentMarble):
+    """
+    MARBLE component which works in latent space like :class:`LatentMarble`,
+    but partitions columns across a pool of worker processes that share the
+    network weights through shared memory. Call :meth:`close` (or use the
+    component as a context manager) to shut down the workers.
+
+    Args:
+        n_processes: number of worker processes.
+        precision: floating point precision used for the network weights and
+            matrix multiplications, either 'float64' (default) or 'float32'.
+    """
+
+    def __init__(
+            self, n_processes, *args, precision='float64', context=None,
+            **kwargs):
+        for name in ('chunk_size', 'n_workers'):
+            if name in kwargs:
+                raise TypeError(
+                    '{} is not supported by ProcessParallelLatentMarble, '
+                    'whose columns are partitioned across '
+                    'processes'.format(name))
+        super(ProcessParallelLatentMarble, self).__init__(
+            *args, precision=precision, **kwargs)
+        self._precision = precision
+        self._process_pool = ColumnProcessPool(
+            n_processes, precision=precision, context=context)
+
+    def predict(self, inputs):
+        if isinstance(inputs, np.ndarray):
+            state = {_packed_input_key: inputs}
+            n_columns = inputs.shape[0]
+        else:
+            state = {
+                name: value for name, value in inputs.items()
+                if name != 'time'}
+            n_columns = state['sst'].shape[0]
+        result = self._process_pool.map_columns(
+            functools.partial(_latent_marble_worker, self._precision),
+            state, n_columns=n_columns)
+        tendency_dict, diagnostic_dict = {}, {}
+        for (kind, name), array in result.items():
+            if kind == 'tendency':
+                tendency_dict[name] = array
+            else:
+                diagnostic_dict[name] = array
+        diagnostic_dict['z'] = z_star_height.copy()
+        return tendency_dict, diagnostic_dict
+
+    def close(self):
+        """Shuts down the worker processes and releases shared memory."""
+        self._process_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+__all__ = ['get_precision_deviation', 'report_precision_deviation']
+
+
+def get_precision_deviation(
+        component_class, state, precision='float32', **kwargs):
+    """
+    Compares the outputs of a MARBLE component run at reduced precision with
+    those of the same component run at double precision.
+
+    Args:
+        component_class: class of the component to compare, for example
+            :class:`marble.LatentMarble` or
+            :class:`marble.InputHeightToPrincipalComponents`.
+        state (dict): reference state containing all inputs of the component.
+        precision: reduced precision to compare against 'float64'.
+        **kwargs: additional keyword arguments used to initialize the
+            component.
+
+    Returns:
+        deviation_dict (dict): dictionary whose keys are output quantity names
+            and values are dictionaries with the maximum ('max') and mean
+            ('mean') absolute deviation from the double precision outputs.
+    """
+    reference_outputs = _get_output_dict(
+        component_class(precision='float64', **kwargs), state)
+    outputs = _get_output_dict(
+        component_class(precision=precision, **kwargs), state)
+    deviation_dict = {}
+    for name, reference in reference_outputs.items():
+        deviation = np.abs(outputs[name].values - reference.values)
+        deviation_dict[name] = {
+            'max': float(np.max(deviation)) if deviation.size > 0 else 0.,
+            'mean': float(np.mean(deviation)) if deviation.size > 0 else 0.,
+        }
+    return deviation_dict
+
+
+def report_precision_deviation(
+        component_class, state, precision='float32', **kwargs):
+    """
+    Prints a table of the maximum and mean absolute deviation of each output
+    of a component run at reduced precision from its double precision outputs.
+    Takes the same arguments as :func:`get_precision_deviation`.
+    """
+    deviation_dict = get_precision_deviation(
+        component_class, state, precision=precision, **kwargs)
+    name_width = max([len(name) for name in deviation_dict] + [4])
+    print('{:<{width}}  {:>12}  {:>12}'.format(
+        'name', 'max', 'mean', width=name_width))
+    for name in sorted(deviation_dict.keys()):
+        print('{:<{width}}  {:>12.4e}  {:>12.4e}'.format(
+            name, deviation_dict[name]['max'], deviation_dict[name]['mean'],
+            width=name_width))
+    return deviation_dict
+
+
+def _get_output_dict(component, state):
+    outputs = component(state)
+    if isinstance(outputs, tuple):
+        output_dict = {}
+        for output in outputs:
+            output_dict.update(output)
+        return output_dict
+    else:
+        return outputs
@@ -0,0 +1,86 @@
+import queue
+import threading
+
+
+__all__ = ['ForcingPrefetcher']
+
+# queue items marking the end of the timesteps, or an error while reading
+_finished = object()
+_failed = object()
+
+
+class ForcingPrefetcher(object):
+    """
+    Iterates over the forcing of a sequence of timesteps, reading upcoming
+    timesteps on a background thread so that reading and decoding forcing
+    overlaps with stepping the model. Yields (i_timestep, forcing) pairs in
+    order.
+
+    Call :meth:`close` (or use the prefetcher as a context manager) to stop
+    the background thread if iteration is abandoned early.
+
+    Args:
+        get_forcing: function taking a timestep index and returning the
+            forcing for that timestep, for example
+            :meth:`ERA5ForcingProvider.get_forcing`.
+        timesteps: iterable of timestep indices to read.
+        max_pending: number of timesteps which may be read ahead of the one
+            being used.
+    """
+
+    def __init__(self, get_forcing, timesteps, max_pending=2):
+        self._get_forcing = get_forcing
+        self._timesteps = timesteps
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._read_forcing, daemon=True)
+        self._thread.start()
+
+    def _read_forcing(self):
+        try:
+            for i_timestep in self._timesteps:
+                item = (i_timestep, self._get_forcing(i_timestep))
+                if not self._put(item):
+                    return
+        except Exception as error:
+            self._put((_failed, error))
+        else:
+            self._put((_finished, None))
+
+    def _put(self, item):
+        """Waits for space in the queue, returning False if stopped first."""
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            raise StopIteration
+        key, value = self._queue.get()
+        if key is _finished:
+            self.close()
+            raise StopIteration
+        elif key is _failed:
+            self.close()
+            raise value
+        return key, value
+
+    def close(self):
+        """Stops reading ahead and waits for the background thread to exit."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
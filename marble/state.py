@@ -1,4 +1,6 @@
-__all__ = ['register_alias', 'register_alias_dict', 'AliasDict']
+import collections.abc
+
+__all__ = ['register_alias', 'register_alias_dict', 'AliasDict', 'SlotDict']
 
 _alias_to_long_name = {}
 
@@ -35,5 +37,116 @@ class AliasDict(dict):
         return '%s(%s)' % (type(self).__name__, dictrepr)
 
     def update(self, *args, **kwargs):
-        for k, v in dict(*args, **kwargs).iteritems():
+        for k, v in dict(*args, **kwargs).items():
             self[k] = v
+
+
+_missing = object()
+
+
+class SlotDict(collections.abc.MutableMapping):
+    """
+    Dictionary-like container which can be used in place of
+    :class:`AliasDict`.
+
+    Each quantity is given an integer slot when it is first added, and its
+    long name and any aliases registered for it at that time are resolved to
+    that slot once. Aliases registered later are resolved the first time
+    they are used. Accessing a value by name or alias is then a single
+    lookup followed by a list index, which takes about half as long as with
+    :class:`AliasDict` but still longer than with a plain dict. Code which
+    accesses the same quantities repeatedly can get their slots once with
+    :meth:`slot` and use :meth:`get_slot` and :meth:`set_slot`, which skip
+    the name lookup.
+    """
+
+    __slots__ = ('_slots', '_names', '_values')
+
+    def __init__(self, *args, **kwargs):
+        self._slots = {}
+        self._names = []
+        self._values = []
+        self.update(*args, **kwargs)
+
+    def _add_slot(self, key):
+        long_name = _alias_to_long_name.get(key, key)
+        if long_name in self._slots:
+            i_slot = self._slots[long_name]
+        else:
+            i_slot = len(self._names)
+            self._names.append(long_name)
+            self._values.append(_missing)
+            self._slots[long_name] = i_slot
+            for alias, name in _alias_to_long_name.items():
+                if name == long_name:
+                    self._slots.setdefault(alias, i_slot)
+        self._slots[key] = i_slot
+        return i_slot
+
+    def _find_slot(self, key):
+        # resolves aliases registered after the slot was added
+        long_name = _alias_to_long_name.get(key, key)
+        i_slot = self._slots[long_name]
+        self._slots[key] = i_slot
+        return i_slot
+
+    def slot(self, key):
+        """Returns the integer slot of a name or alias, adding it if needed."""
+        try:
+            return self._slots[key]
+        except KeyError:
+            return self._add_slot(key)
+
+    def get_slot(self, i_slot):
+        """Returns the value stored in an integer slot."""
+        value = self._values[i_slot]
+        if value is _missing:
+            raise KeyError(self._names[i_slot])
+        return value
+
+    def set_slot(self, i_slot, value):
+        """Stores a value in an integer slot."""
+        self._values[i_slot] = value
+
+    def __getitem__(self, key):
+        try:
+            i_slot = self._slots[key]
+        except KeyError:
+            try:
+                i_slot = self._find_slot(key)
+            except KeyError:
+                raise KeyError(key) from None
+        value = self._values[i_slot]
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            self._values[self._slots[key]] = value
+        except KeyError:
+            self._values[self._add_slot(key)] = value
+
+    def __delitem__(self, key):
+        self[key]  # raise KeyError if not present, and resolve any alias
+        self._values[self._slots[key]] = _missing
+
+    def __contains__(self, key):
+        i_slot = self._slots.get(key)
+        if i_slot is None:
+            try:
+                i_slot = self._find_slot(key)
+            except KeyError:
+                return False
+        return self._values[i_slot] is not _missing
+
+    def __iter__(self):
+        for name, value in zip(self._names, self._values):
+            if value is not _missing:
+                yield name
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not _missing)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
@@ -11,7 +11,7 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['numpy', 'sympl', 'xarray', 'netcdf4']
+requirements = ['numpy>=1.20', 'sympl', 'xarray>=0.16.1', 'netcdf4']
 
 setup_requirements = [ ]
 
@@ -25,16 +25,14 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description="Machine Assisted Boundary Layer Emulation is a neural network basameterization.",
     install_requires=requirements,
+    python_requires='>=3.9',
     license="BSD license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -4,12 +4,24 @@
 """Tests for `marble` package."""
 
 import unittest
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 import marble
 import numpy as np
 import sympl as sp
+import xarray as xr
 
 
 test_era5_filename = '/home/twine/data/era5/era5-interp-2016.nc'
+example_column_filename = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'examples', 'data', 'era5_column-2016.nc')
 
 
 def get_test_state(pc_value=0.):
@@ -44,6 +56,1284 @@ def get_test_state(pc_value=0.):
     return state
 
 
+def get_latent_marble_state(n_columns=5, seed=0):
+    """
+    Returns a state with random (but physically plausible) values for every
+    input of LatentMarble, with a column dimension of length n_columns.
+    """
+    random = np.random.RandomState(seed)
+    n_features = marble.components.marble.name_feature_counts
+    state = {'time': sp.timedelta(0)}
+    for name, alias in (
+            ('liquid_water_static_energy_components', 'sl'),
+            ('total_water_mixing_ratio_components', 'rt'),
+            ('vertical_wind_components', 'w')):
+        state[name] = sp.DataArray(
+            random.randn(n_columns, n_features[alias]),
+            dims=('column', '{}_latent'.format(alias)), attrs={'units': ''})
+    scalar_inputs = {
+        'liquid_water_static_energy_at_3km': ('J/kg', 3.1e5, 1e3),
+        'total_water_mixing_ratio_at_3km': ('kg/kg', 3e-3, 1e-3),
+        'surface_latent_heat_flux': ('W/m^2', -100., 30.),
+        'surface_sensible_heat_flux': ('W/m^2', -10., 5.),
+        'surface_temperature': ('degK', 290., 3.),
+        'mid_cloud_fraction': ('', 0.2, 0.1),
+        'high_cloud_fraction': ('', 0.2, 0.1),
+        'downwelling_shortwave_radiation_at_top_of_atmosphere': ('W/m^2', 500., 200.),
+        'downwelling_shortwave_radiation_at_3km': ('W/m^2', 400., 200.),
+        'surface_air_pressure': ('Pa', 1.01e5, 500.),
+        'rain_water_mixing_ratio_at_3km': ('kg/kg', 1e-6, 1e-7),
+    }
+    for name, (units, mean, std) in scalar_inputs.items():
+        state[name] = sp.DataArray(
+            mean + std * random.randn(n_columns),
+            dims=('column',), attrs={'units': units})
+    return state
+
+
+def get_reference_network_outputs(state):
+    """
+    Evaluates the MARBLE network the long way, with separate normalization
+    and denormalization passes, returning latent tendency and diagnostic
+    arrays.
+    """
+    module = marble.components.marble
+    weight_ds = module.weight_ds
+    inputs = {}
+    for name, properties in marble.LatentMarble.input_properties.items():
+        inputs[properties['alias']] = state[name].values
+    inputs['lhf'] = inputs['lhf'] * 3600.
+    inputs['shf'] = inputs['shf'] * 3600.
+    X = module.concatenate_pbl_input(inputs)
+    X = (X - weight_ds['pbl_input_mean'].values) / weight_ds['pbl_input_scale'].values
+    X = np.dot(X, weight_ds['pbl_encoder_W'].values) + weight_ds['pbl_encoder_b'].values
+    X[X < 0.] = 0.
+    X = np.dot(X, weight_ds['pbl_hidden_W'].values) + weight_ds['pbl_hidden_b'].values
+    X[X < 0.] = 0.
+    tendency = np.dot(X, weight_ds['pbl_tend_decoder_W'].values) + weight_ds['pbl_tend_decoder_b'].values
+    tendency *= weight_ds['state_scale'].values
+    diagnostic = np.dot(X, weight_ds['pbl_diag_decoder_W'].values) + weight_ds['pbl_diag_decoder_b'].values
+    diagnostic *= weight_ds['diagnostic_scale'].values
+    diagnostic += weight_ds['diagnostic_mean'].values
+    return tendency, diagnostic
+
+
+class TestLatentMarble(unittest.TestCase):
+
+    def test_inference_plan_matches_reference(self):
+        state = get_latent_marble_state()
+        tendency, diagnostic = get_reference_network_outputs(state)
+        tendency_dict = marble.components.marble.get_state_dict_from_array(tendency)
+        diagnostic_dict = marble.components.marble.get_diagnostic_dict_from_array(diagnostic)
+        tendency_dict['sl'] = tendency_dict['sl'] + diagnostic_dict['sl_rad_clr']
+        tendencies, diagnostics = marble.LatentMarble()(state)
+        for name, properties in marble.LatentMarble.tendency_properties.items():
+            self.assertTrue(np.allclose(
+                tendencies[name].values, tendency_dict[properties['alias']],
+                rtol=1e-10, atol=0.), name)
+        for name, properties in marble.LatentMarble.diagnostic_properties.items():
+            if properties['alias'] in diagnostic_dict:
+                self.assertTrue(np.allclose(
+                    diagnostics[name].values, diagnostic_dict[properties['alias']],
+                    rtol=1e-10, atol=1e-12), name)
+
+    def test_inference_plan_is_immutable(self):
+        plan = marble.components.marble.get_inference_plan()
+        with self.assertRaises(ValueError):
+            plan.encoder_W[0, 0] = 0.
+        with self.assertRaises(AttributeError):
+            plan.encoder_W = None
+        self.assertTrue(plan.decoder_W.flags['C_CONTIGUOUS'])
+
+
+def get_latent_forcing_state(n_columns=5, seed=0):
+    """
+    Returns a state with every input of LatentMarble and
+    LatentHorizontalAdvectiveForcing.
+    """
+    state = get_latent_marble_state(n_columns=n_columns, seed=seed)
+    random = np.random.RandomState(seed + 1)
+    n_features = marble.components.marble.name_feature_counts
+    for name, alias in (
+            ('liquid_water_static_energy_components_horizontal_advective_tendency', 'sl'),
+            ('total_water_mixing_ratio_components_horizontal_advective_tendency', 'rt')):
+        state[name] = sp.DataArray(
+            0.01 * random.randn(n_columns, n_features[alias]),
+            dims=('column', '{}_latent'.format(alias)), attrs={'units': 'hr^-1'})
+    # keep the state near the training distribution so it stays bounded
+    for name in ('liquid_water_static_energy_components', 'total_water_mixing_ratio_components'):
+        state[name].values[:] *= 0.1
+    return state
+
+
+def run_sympl_latent_integration(state, n_steps, order, timestep):
+    stepper = sp.AdamsBashforth(
+        [marble.LatentMarble(), marble.LatentHorizontalAdvectiveForcing()], order=order)
+    state = dict(state)
+    for _ in range(n_steps):
+        _, next_state = stepper(state, timestep=timestep)
+        state.update(next_state)
+        state['time'] = state['time'] + timestep
+    return state
+
+
+class TestLatentIntegrator(unittest.TestCase):
+
+    def test_matches_sympl_adams_bashforth(self):
+        timestep = sp.timedelta(hours=1)
+        for order in (1, 2, 3):
+            state = get_latent_forcing_state()
+            reference = run_sympl_latent_integration(state, 4, order, timestep)
+            integrator = marble.LatentIntegrator(timestep, order=order)
+            result = integrator.integrate_state(state, 4)
+            self.assertEqual(result['time'], reference['time'])
+            for name in ('liquid_water_static_energy_components', 'total_water_mixing_ratio_components'):
+                self.assertEqual(result[name].dims, reference[name].dims)
+                self.assertTrue(np.allclose(
+                    result[name].values, reference[name].values, rtol=1e-10, atol=1e-12),
+                    (name, order))
+
+    def test_history_and_time_varying_forcing(self):
+        timestep = sp.timedelta(hours=1)
+        state = get_latent_forcing_state(n_columns=3)
+        integrator = marble.LatentIntegrator(timestep)
+        forcing_properties = marble.components.integrator.get_forcing_properties()
+        forcing = {
+            alias: state[properties['name']].values
+            for alias, properties in forcing_properties.items()}
+        latent_state = {
+            'sl': state['liquid_water_static_energy_components'].values,
+            'rt': state['total_water_mixing_ratio_components'].values}
+        final_state, history = integrator.integrate(
+            latent_state, lambda i_step: forcing, 3, store_history=True)
+        self.assertEqual(history['sl'].shape, (3, 3, latent_state['sl'].shape[1]))
+        self.assertTrue(np.all(history['sl'][0] == latent_state['sl']))
+        self.assertEqual(history['precip'].shape, (3, 3))
+        _, diagnostics = marble.LatentMarble()(state)
+        self.assertTrue(np.allclose(
+            history['precip'][0], diagnostics['surface_precipitation_rate'].values))
+        integrator.reset()
+        self.assertTrue(np.allclose(
+            integrator.integrate(latent_state, forcing, 3)['rt'], final_state['rt']))
+
+    def test_masked_columns_match_separate_runs(self):
+        timestep = sp.timedelta(hours=1)
+        n_columns, n_steps = 4, 6
+        state = get_latent_forcing_state(n_columns=n_columns)
+        forcing_properties = marble.components.integrator.get_forcing_properties()
+        random = np.random.RandomState(2)
+        forcing = {}
+        for alias, properties in forcing_properties.items():
+            values = state[properties['name']].values
+            noise = 1. + 0.01 * random.randn(n_steps, *values.shape)
+            forcing[alias] = values[None, ...] * noise
+        latent_state = {
+            'sl': state['liquid_water_static_energy_components'].values,
+            'rt': state['total_water_mixing_ratio_components'].values}
+        start_steps = np.array([0, 1, 2, 0])
+        durations = np.array([6, 3, 4, 0])
+        for name in forcing:  # forcing outside of a column's run is not used
+            forcing[name][0, 1:3] = np.nan
+        integrator = marble.LatentIntegrator(timestep, order=2)
+        result, history = integrator.integrate(
+            latent_state, forcing, n_steps, store_history=True,
+            start_steps=start_steps, durations=durations)
+        for i_column in range(n_columns):
+            start, end = start_steps[i_column], start_steps[i_column] + durations[i_column]
+            column_integrator = marble.LatentIntegrator(timestep, order=2)
+            column_result = column_integrator.integrate(
+                {name: array[i_column:i_column + 1] for name, array in latent_state.items()},
+                {name: array[start:end, i_column:i_column + 1] for name, array in forcing.items()},
+                end - start)
+            for name in ('sl', 'rt'):
+                self.assertTrue(np.allclose(
+                    result[name][i_column], column_result[name][0], rtol=1e-12), i_column)
+            self.assertTrue(np.all(np.isnan(history['precip'][:start, i_column])))
+            self.assertTrue(np.all(np.isnan(history['sl'][end:, i_column])))
+            self.assertFalse(np.any(np.isnan(history['sl'][start:end, i_column])))
+
+
+@unittest.skipIf(
+    not os.path.isfile(example_column_filename), 'example column file not found')
+class TestERA5ForcingProvider(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import xarray as xr
+        cls.provider = marble.ERA5ForcingProvider(example_column_filename)
+        with xr.open_dataset(example_column_filename) as dataset:
+            cls.dataset = dataset.load()
+
+    def test_forcing_matches_file(self):
+        for i_timestep in (0, 7):
+            forcing = self.provider.get_forcing(i_timestep)
+            self.assertTrue(np.isclose(
+                forcing['surface_latent_heat_flux'].values,
+                self.dataset['lhf'][i_timestep].values / 3600.))
+            self.assertEqual(
+                float(forcing['liquid_water_static_energy_at_3km'].values),
+                float(self.dataset['sl'][i_timestep, -1]))
+            sl_adv_latent = marble.convert_height_to_principal_components(
+                self.dataset['sl_adv'][i_timestep].values, basis_name='sl',
+                subtract_mean=False)
+            self.assertTrue(np.allclose(
+                forcing['liquid_water_static_energy_components_horizontal_advective_tendency'].values,
+                sl_adv_latent, rtol=1e-12))
+            w_latent = marble.convert_height_to_principal_components(
+                self.dataset['w'][i_timestep].values, basis_name='w')
+            self.assertTrue(np.allclose(
+                forcing['vertical_wind_components'].values, w_latent, rtol=1e-12))
+
+    def test_state_is_read_only_view(self):
+        state = self.provider.get_state(3)
+        rt_latent = state['total_water_mixing_ratio_components'].values
+        self.assertFalse(rt_latent.flags.writeable)
+        self.assertTrue(np.allclose(rt_latent, marble.convert_height_to_principal_components(
+            self.dataset['rt'][3].values, basis_name='rt'), rtol=1e-12))
+        height_state = self.provider.get_state(3, latent=False)
+        self.assertTrue(np.all(
+            height_state['liquid_water_static_energy'].values == self.dataset['sl'][3].values))
+
+    def test_timeseries_drives_latent_integrator(self):
+        n_steps = 4
+        timestep = sp.timedelta(hours=1)
+        stepper = sp.AdamsBashforth(
+            [marble.LatentMarble(), marble.LatentHorizontalAdvectiveForcing()], order=1)
+        state = self.provider.get_state()
+        initial_state = {
+            'sl': state['liquid_water_static_energy_components'].values[None, :],
+            'rt': state['total_water_mixing_ratio_components'].values[None, :]}
+        for i_timestep in range(n_steps):
+            state.update(self.provider.get_forcing(i_timestep))
+            _, next_state = stepper(state, timestep=timestep)
+            state.update(next_state)
+        integrator = marble.LatentIntegrator(timestep)
+        result = integrator.integrate(
+            initial_state, self.provider.get_forcing_timeseries(0, n_steps), n_steps)
+        self.assertTrue(np.allclose(
+            result['sl'][0], state['liquid_water_static_energy_components'].values,
+            rtol=1e-10))
+        self.assertTrue(np.allclose(
+            result['rt'][0], state['total_water_mixing_ratio_components'].values,
+            rtol=1e-10))
+
+
+class TestForcingPrefetcher(unittest.TestCase):
+
+    def test_yields_forcing_in_order(self):
+        def get_forcing(i_timestep):
+            return {'sst': np.full(3, 290. + i_timestep)}
+        with marble.ForcingPrefetcher(get_forcing, range(5)) as prefetcher:
+            result = list(prefetcher)
+        self.assertEqual([i_timestep for i_timestep, _ in result], list(range(5)))
+        for i_timestep, forcing in result:
+            self.assertTrue(np.all(forcing['sst'] == 290. + i_timestep))
+
+    def test_reads_ahead_while_waiting(self):
+        read_timesteps = []
+
+        def get_forcing(i_timestep):
+            read_timesteps.append(i_timestep)
+            return {}
+        prefetcher = marble.ForcingPrefetcher(get_forcing, range(100), max_pending=3)
+        self.assertEqual(next(prefetcher)[0], 0)
+        for _ in range(100):
+            if len(read_timesteps) >= 4:
+                break
+            time.sleep(0.01)
+        self.assertEqual(read_timesteps[:4], [0, 1, 2, 3])
+        prefetcher.close()
+        self.assertLess(len(read_timesteps), 100)
+
+    def test_raises_reader_error(self):
+        def get_forcing(i_timestep):
+            if i_timestep == 2:
+                raise KeyError('missing forcing')
+            return {}
+        prefetcher = marble.ForcingPrefetcher(get_forcing, range(5))
+        self.assertEqual(next(prefetcher)[0], 0)
+        self.assertEqual(next(prefetcher)[0], 1)
+        with self.assertRaises(KeyError):
+            next(prefetcher)
+        with self.assertRaises(StopIteration):
+            next(prefetcher)
+
+
+class TestWorkspaces(unittest.TestCase):
+
+    def get_peak_allocation(self, function):
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            function()
+            return tracemalloc.get_traced_memory()[1] - start_memory
+        finally:
+            tracemalloc.stop()
+
+    def test_steady_state_array_call_only_allocates_outputs(self):
+        n_columns = 20000
+        for precision in ('float64', 'float32'):
+            component = marble.LatentMarble(precision=precision)
+            state = sp.get_numpy_arrays_with_properties(
+                get_latent_marble_state(n_columns=n_columns), component.input_properties)
+            first_outputs = component.array_call(state)
+            peak_allocation = self.get_peak_allocation(lambda: component.array_call(state))
+            output_bytes = n_columns * component._plan.n_output * 8
+            self.assertLess(peak_allocation, output_bytes + 256 * 1024, precision)
+            # outputs of earlier calls are not overwritten by later ones
+            second_outputs = component.array_call(state)
+            self.assertIsNot(first_outputs[0]['sl'].base, second_outputs[0]['sl'].base)
+
+    def test_workspaces_kept_for_recent_batch_sizes(self):
+        component = marble.LatentMarble()
+        outputs = {}
+        for n_columns in (3, 5, 7, 9, 11, 3):
+            state = sp.get_numpy_arrays_with_properties(
+                get_latent_marble_state(n_columns=n_columns), component.input_properties)
+            outputs[n_columns] = component.array_call(state)
+            reference = marble.LatentMarble().array_call(state)
+            self.assertTrue(np.all(outputs[n_columns][0]['sl'] == reference[0]['sl']))
+        self.assertEqual(list(component._workspaces), [7, 9, 11, 3])
+
+
+def get_alias_arrays(state, component):
+    return {
+        properties['alias']: state[name].values
+        for name, properties in component.input_properties.items()
+    }
+
+
+class TestPredict(unittest.TestCase):
+
+    def test_latent_marble_predict_matches_call(self):
+        state = get_latent_marble_state(n_columns=7)
+        component = marble.LatentMarble()
+        tendencies, diagnostics = component(state)
+        inputs = get_alias_arrays(state, component)
+        packed_inputs = marble.components.marble.concatenate_pbl_input(inputs)
+        for predict_inputs in (inputs, packed_inputs):
+            predicted_tendencies, predicted_diagnostics = component.predict(predict_inputs)
+            for name, properties in component.tendency_properties.items():
+                self.assertTrue(np.all(
+                    predicted_tendencies[properties['alias']] == tendencies[name].values), name)
+            for name, properties in component.diagnostic_properties.items():
+                self.assertTrue(np.all(
+                    predicted_diagnostics[properties['alias']] == diagnostics[name].values), name)
+
+    def test_chunked_predict_on_packed_inputs(self):
+        state = get_latent_marble_state(n_columns=25)
+        packed_inputs = marble.components.marble.concatenate_pbl_input(
+            get_alias_arrays(state, marble.LatentMarble))
+        reference = marble.LatentMarble().predict(packed_inputs)
+        result = marble.LatentMarble(chunk_size=10).predict(packed_inputs)
+        self.assertTrue(np.allclose(
+            result[0]['sl'], reference[0]['sl'],
+            rtol=1e-12, atol=1e-12 * np.abs(reference[0]['sl']).max()))
+
+    def test_packed_inputs_do_not_allocate_input_workspace(self):
+        state = get_latent_marble_state(n_columns=7)
+        component = marble.LatentMarble()
+        inputs = get_alias_arrays(state, component)
+        packed_inputs = marble.components.marble.concatenate_pbl_input(inputs)
+        component.predict(packed_inputs)
+        self.assertIsNone(component._workspaces[7].pbl_input)
+        reference = component.predict(packed_inputs)
+        result = component.predict(inputs)
+        self.assertIsNotNone(component._workspaces[7].pbl_input)
+        self.assertTrue(np.all(result[0]['sl'] == reference[0]['sl']))
+
+    def test_packed_inputs_of_wrong_shape_raise(self):
+        with self.assertRaises(ValueError):
+            marble.LatentMarble().predict(np.zeros((3, 5)))
+
+    def test_converter_predict_matches_call(self):
+        state = get_test_state(pc_value=0.6)
+        state.update(marble.InputPrincipalComponentsToHeight()(state))
+        for component in (
+                marble.InputHeightToPrincipalComponents(),
+                marble.InputPrincipalComponentsToHeight()):
+            reference = component(state)
+            inputs = get_alias_arrays(state, component)
+            packed_inputs = np.concatenate(
+                [inputs[properties['alias']]
+                 for properties in component.input_properties.values()], axis=-1)
+            for predict_inputs in (inputs, packed_inputs):
+                result = component.predict(predict_inputs)
+                for name, properties in component.diagnostic_properties.items():
+                    self.assertTrue(np.allclose(
+                        result[properties['alias']], reference[name].values), name)
+
+
+def get_gridded_dataset(state, shape=(4, 3, 5)):
+    """
+    Returns a Dataset of the quantities in a column state, with the column
+    dimension reshaped to (time, lat, lon).
+    """
+    dims = ['time', 'lat', 'lon']
+    ds = xr.Dataset(coords={dim: np.arange(size) for dim, size in zip(dims, shape)})
+    for name, array in state.items():
+        if name != 'time':
+            ds[name] = xr.DataArray(
+                array.values.reshape(shape + array.shape[1:]),
+                dims=dims + list(array.dims[1:]), attrs=array.attrs)
+    return ds
+
+
+class TestApplyToDataset(unittest.TestCase):
+
+    def assert_matches_latent_marble(self, output_ds, state):
+        tendencies, diagnostics = marble.LatentMarble()(state)
+        n_columns = state['surface_temperature'].shape[0]
+        for name, value in tendencies.items():
+            output = output_ds['tendency_of_' + name]
+            self.assertEqual(output.dims[:3], ('time', 'lat', 'lon'))
+            self.assertTrue(np.allclose(
+                output.values.reshape(value.shape), value.values,
+                rtol=1e-12, atol=1e-12 * np.abs(value.values).max()), name)
+        for name, value in diagnostics.items():
+            if name != 'height':
+                self.assertTrue(np.allclose(
+                    output_ds[name].values.reshape(value.shape), value.values,
+                    rtol=1e-12, atol=1e-12 * np.abs(value.values).max()), name)
+        cloud_fraction = marble.DiagnosticPrincipalComponentsToHeight().predict({
+            'rcld': diagnostics['cloud_water_mixing_ratio_components'].values,
+            'rrain': diagnostics['rain_water_mixing_ratio_components'].values,
+            'cld': diagnostics['cloud_fraction_components'].values,
+            'sl_rad_clr': diagnostics['clear_sky_radiative_heating_rate_components'].values,
+        })['cld']
+        self.assertTrue(np.allclose(
+            output_ds['cloud_fraction'].values.reshape(n_columns, 20), cloud_fraction))
+        self.assertEqual(output_ds['surface_precipitation_rate'].attrs['units'], 'mm/hr')
+        self.assertTrue(np.all(output_ds['lat'].values == np.arange(3)))
+
+    def test_latent_inputs(self):
+        state = get_latent_marble_state(n_columns=60)
+        output_ds = marble.apply_to_dataset(get_gridded_dataset(state))
+        self.assert_matches_latent_marble(output_ds, state)
+
+    def test_height_inputs_are_projected(self):
+        state = get_latent_marble_state(n_columns=60)
+        state.update(marble.InputPrincipalComponentsToHeight()(state))
+        ds = get_gridded_dataset(state).drop_vars([
+            'liquid_water_static_energy_components',
+            'total_water_mixing_ratio_components',
+            'vertical_wind_components'])
+        output_ds = marble.apply_to_dataset(ds)
+        self.assert_matches_latent_marble(output_ds, state)
+
+    @unittest.skipIf(importlib.util.find_spec('dask') is None, 'dask is not installed')
+    def test_dask_inputs_give_lazy_outputs(self):
+        state = get_latent_marble_state(n_columns=60)
+        ds = get_gridded_dataset(state).chunk({'time': 2, 'lat': 2})
+        output_ds = marble.apply_to_dataset(ds)
+        output = output_ds['surface_precipitation_rate']
+        self.assertIsNot(type(output.data), np.ndarray)
+        self.assertEqual(output.chunks, ((2, 2), (2, 1), (5,)))
+        self.assert_matches_latent_marble(output_ds.compute(), state)
+
+    def test_missing_input_raises(self):
+        ds = get_gridded_dataset(get_latent_marble_state(n_columns=60))
+        with self.assertRaises(ValueError):
+            marble.apply_to_dataset(ds.drop_vars('surface_temperature'))
+
+    def test_wrong_units_raise(self):
+        ds = get_gridded_dataset(get_latent_marble_state(n_columns=60))
+        ds['surface_temperature'].attrs['units'] = 'degC'
+        with self.assertRaises(ValueError):
+            marble.apply_to_dataset(ds)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_collects_stages_of_latent_marble(self):
+        component = marble.LatentMarble()
+        state = get_latent_marble_state(n_columns=50)
+        with marble.instrument() as stats:
+            component(state)
+            component(state)
+        for name in ('__call__', 'concatenate_pbl_input', 'evaluate', 'split_outputs'):
+            self.assertEqual(stats['LatentMarble.' + name].calls, 2)
+        call_stats = stats['LatentMarble.__call__']
+        self.assertLess(call_stats.self_time, call_stats.time)
+        self.assertGreater(stats['LatentMarble.evaluate'].allocated_bytes, 0)
+        self.assertGreaterEqual(
+            call_stats.allocated_bytes, stats['LatentMarble.evaluate'].allocated_bytes)
+
+    def test_collects_stages_of_decomposition(self):
+        state = get_latent_marble_state(n_columns=4)
+        with marble.instrument(trace_memory=False) as stats:
+            marble.InputPrincipalComponentsToHeight()(state)
+        self.assertEqual(
+            set(stats), set('InputPrincipalComponentsToHeight.' + name for name in (
+                '__call__', 'pack', 'reconstruct', 'split')))
+        self.assertIsNone(stats['InputPrincipalComponentsToHeight.pack'].allocated_bytes)
+
+    def test_nothing_collected_when_off(self):
+        state = get_latent_marble_state(n_columns=4)
+        with marble.instrument() as stats:
+            pass
+        marble.LatentMarble()(state)
+        self.assertEqual(len(stats), 0)
+        self.assertIs(
+            marble.components.instrumentation.stage('evaluate'),
+            marble.components.instrumentation.stage('split_outputs'))
+
+
+class TestJacobian(unittest.TestCase):
+
+    def test_jacobian_matches_finite_differences(self):
+        component = marble.LatentMarble()
+        state = get_latent_marble_state(n_columns=3)
+        jacobian = component.jacobian(state)
+        raw_state = sp.get_numpy_arrays_with_properties(state, component.input_properties)
+        n_sl = raw_state['sl'].shape[1]
+
+        def get_tendency_array(raw_state):
+            tendencies, _ = component.array_call(raw_state)
+            return np.concatenate([tendencies['sl'], tendencies['rt']], axis=1)
+        n_state = get_tendency_array(raw_state).shape[1]
+        self.assertEqual(jacobian.shape, (3, n_state, n_state))
+        epsilon = 1e-4
+        for j in range(jacobian.shape[2]):
+            alias, k = ('sl', j) if j < n_sl else ('rt', j - n_sl)
+            tendency_arrays = []
+            for sign in (1, -1):
+                perturbed_state = dict(raw_state)
+                perturbed_state[alias] = raw_state[alias].copy()
+                perturbed_state[alias][:, k] += sign * epsilon
+                tendency_arrays.append(get_tendency_array(perturbed_state))
+            finite_difference = (tendency_arrays[0] - tendency_arrays[1]) / (2 * epsilon)
+            self.assertTrue(np.allclose(
+                finite_difference, jacobian[:, :, j],
+                rtol=1e-4, atol=1e-6 * np.abs(jacobian).max()), j)
+
+
+class TestImplicitLatentIntegrator(unittest.TestCase):
+
+    def setUp(self):
+        state = get_latent_forcing_state(n_columns=3)
+        forcing_properties = marble.components.integrator.get_forcing_properties()
+        self.forcing = {
+            alias: state[properties['name']].values
+            for alias, properties in forcing_properties.items()}
+        self.latent_state = {
+            'sl': state['liquid_water_static_energy_components'].values,
+            'rt': state['total_water_mixing_ratio_components'].values}
+
+    def get_tendency_array(self, latent_state):
+        # the forward Euler increment over one hour is the tendency in hr^-1
+        integrator = marble.LatentIntegrator(sp.timedelta(hours=1))
+        new_state = integrator.integrate(latent_state, self.forcing, 1)
+        return np.concatenate([
+            new_state[name] - latent_state[name] for name in ('sl', 'rt')], axis=1)
+
+    def test_backward_euler_solves_implicit_equation(self):
+        timestep = sp.timedelta(hours=3)
+        integrator = marble.ImplicitLatentIntegrator(
+            timestep, method='backward_euler', n_iterations=6)
+        new_state = integrator.integrate(self.latent_state, self.forcing, 1)
+        increment = np.concatenate([
+            new_state[name] - self.latent_state[name] for name in ('sl', 'rt')], axis=1)
+        residual = increment - 3. * self.get_tendency_array(new_state)
+        self.assertLess(np.abs(residual).max(), 1e-6 * np.abs(increment).max())
+
+    def test_rosenbrock_approaches_forward_euler_for_short_steps(self):
+        timestep = sp.timedelta(seconds=1)
+        implicit_state = marble.ImplicitLatentIntegrator(timestep).integrate(
+            self.latent_state, self.forcing, 1)
+        explicit_state = marble.LatentIntegrator(timestep).integrate(
+            self.latent_state, self.forcing, 1)
+        for name in ('sl', 'rt'):
+            implicit_increment = implicit_state[name] - self.latent_state[name]
+            explicit_increment = explicit_state[name] - self.latent_state[name]
+            self.assertTrue(np.allclose(
+                implicit_increment, explicit_increment, rtol=1e-2,
+                atol=1e-3 * np.abs(explicit_increment).max()))
+
+    def test_masked_columns_are_not_stepped(self):
+        integrator = marble.ImplicitLatentIntegrator(sp.timedelta(hours=2))
+        new_state = integrator.integrate(
+            self.latent_state, self.forcing, 2, start_steps=[0, 0, 2], durations=[2, 1, 0])
+        self.assertTrue(np.all(new_state['sl'][2] == self.latent_state['sl'][2]))
+        self.assertFalse(np.all(new_state['sl'][1] == self.latent_state['sl'][1]))
+
+
+class TestAdaptiveLatentIntegrator(unittest.TestCase):
+
+    def setUp(self):
+        state = get_latent_forcing_state(n_columns=4)
+        forcing_properties = marble.components.integrator.get_forcing_properties()
+        self.forcing = {
+            alias: state[properties['name']].values
+            for alias, properties in forcing_properties.items()}
+        # make the columns differ in how stiff their tendencies are
+        self.forcing['sl_adv'] = self.forcing['sl_adv'] * np.array([0., 1., 10., 100.])[:, None]
+        self.latent_state = {
+            'sl': state['liquid_water_static_energy_components'].values,
+            'rt': state['total_water_mixing_ratio_components'].values}
+
+    def test_single_substep_is_heun_step(self):
+        integrator = marble.AdaptiveLatentIntegrator(
+            sp.timedelta(hours=1), rtol=np.inf, max_level=0)
+        result = integrator.integrate(self.latent_state, self.forcing, 1)
+        euler = marble.LatentIntegrator(sp.timedelta(hours=1))
+        euler_state = euler.integrate(self.latent_state, self.forcing, 1)
+        euler.reset()
+        second_euler_state = euler.integrate(euler_state, self.forcing, 1)
+        for name in ('sl', 'rt'):
+            first_tendency = euler_state[name] - self.latent_state[name]
+            second_tendency = second_euler_state[name] - euler_state[name]
+            self.assertTrue(np.allclose(
+                result[name], self.latent_state[name] + 0.5 * (first_tendency + second_tendency),
+                rtol=1e-12))
+        self.assertEqual(integrator.n_column_evaluations, 2 * 4)
+
+    def test_inactive_columns_are_not_evaluated(self):
+        integrator = marble.AdaptiveLatentIntegrator(
+            sp.timedelta(hours=1), rtol=np.inf, max_level=0)
+        result = integrator.integrate(
+            self.latent_state, self.forcing, 2, start_steps=[0, 1, 1, 2])
+        # two evaluations per active column on each step
+        self.assertEqual(integrator.n_column_evaluations, 2 * (1 + 3))
+        reference = marble.AdaptiveLatentIntegrator(
+            sp.timedelta(hours=1), rtol=np.inf, max_level=0).integrate(
+                {name: array[:1] for name, array in self.latent_state.items()},
+                {name: array[:1] for name, array in self.forcing.items()}, 2)
+        for name in ('sl', 'rt'):
+            self.assertTrue(np.allclose(result[name][0], reference[name][0], rtol=1e-12))
+            self.assertTrue(np.all(result[name][3] == self.latent_state[name][3]))
+
+    def test_batched_columns_match_separate_runs(self):
+        integrator = marble.AdaptiveLatentIntegrator(sp.timedelta(hours=1), rtol=1e-3)
+        result = integrator.integrate(self.latent_state, self.forcing, 3)
+        levels = integrator._levels.copy()
+        self.assertGreater(len(set(levels)), 1)
+        for i_column in range(4):
+            column_integrator = marble.AdaptiveLatentIntegrator(
+                sp.timedelta(hours=1), rtol=1e-3)
+            column_result = column_integrator.integrate(
+                {name: array[i_column:i_column + 1] for name, array in self.latent_state.items()},
+                {name: array[i_column:i_column + 1] for name, array in self.forcing.items()}, 3)
+            for name in ('sl', 'rt'):
+                self.assertTrue(np.allclose(
+                    result[name][i_column], column_result[name][0], rtol=1e-12))
+
+    def test_tighter_tolerance_takes_more_evaluations(self):
+        n_evaluations = []
+        results = []
+        for rtol in (1e-2, 1e-4):
+            integrator = marble.AdaptiveLatentIntegrator(sp.timedelta(hours=1), rtol=rtol)
+            results.append(integrator.integrate(self.latent_state, self.forcing, 2))
+            n_evaluations.append(integrator.n_column_evaluations)
+        self.assertLess(n_evaluations[0], n_evaluations[1])
+        difference = np.linalg.norm(results[0]['sl'] - results[1]['sl'], axis=1)
+        self.assertTrue(np.all(difference < 1e-2 * np.linalg.norm(results[1]['sl'], axis=1)))
+
+
+class TestHeightMarble(unittest.TestCase):
+
+    def test_matches_latent_marble_with_conversions(self):
+        latent_state = get_latent_marble_state()
+        tendencies, diagnostics = marble.LatentMarble()(latent_state)
+        diagnostics['time'] = latent_state['time']
+        height_diagnostics = marble.DiagnosticPrincipalComponentsToHeight()(diagnostics)
+        height_state = marble.InputPrincipalComponentsToHeight()(latent_state)
+        height_state.update({
+            name: value for name, value in latent_state.items()
+            if name in marble.HeightMarble.input_properties or name == 'time'
+        })
+        height_tendencies, height_diagnostics_fused = marble.HeightMarble()(height_state)
+        for name in ('liquid_water_static_energy', 'total_water_mixing_ratio'):
+            basis_name = {'liquid_water_static_energy': 'sl', 'total_water_mixing_ratio': 'rt'}[name]
+            expected = marble.convert_principal_components_to_height(
+                tendencies[name + '_components'].values, basis_name, add_mean=False)
+            self.assertTrue(np.allclose(
+                height_tendencies[name].values, expected, rtol=1e-8,
+                atol=1e-10 * np.max(np.abs(expected))), name)
+        for name, value in height_diagnostics.items():
+            self.assertTrue(np.allclose(
+                height_diagnostics_fused[name].values, value.values, rtol=1e-8,
+                atol=1e-10 * np.max(np.abs(value.values))), name)
+        for name in ('low_cloud_fraction', 'surface_precipitation_rate', 'column_cloud_water', 'height'):
+            self.assertTrue(np.allclose(
+                height_diagnostics_fused[name].values, diagnostics[name].values), name)
+
+
+class TestChunkedLatentMarble(unittest.TestCase):
+
+    def assert_outputs_equal(self, outputs, reference_outputs):
+        for output, reference in zip(outputs, reference_outputs):
+            for name in reference.keys():
+                # matrix products of different sizes may round differently
+                self.assertTrue(np.allclose(
+                    output[name].values, reference[name].values,
+                    rtol=1e-12, atol=1e-12 * np.abs(reference[name].values).max()), name)
+
+    def test_chunked_matches_unchunked(self):
+        state = get_latent_marble_state(n_columns=103)
+        reference_outputs = marble.LatentMarble()(state)
+        for chunk_size, n_workers in ((10, 1), (10, 4), (103, 2), (500, 1)):
+            component = marble.LatentMarble(chunk_size=chunk_size, n_workers=n_workers)
+            self.assert_outputs_equal(component(state), reference_outputs)
+
+    def test_auto_chunk_size(self):
+        state = get_latent_marble_state(n_columns=300)
+        component = marble.LatentMarble(chunk_size='auto', n_workers=2)
+        self.assert_outputs_equal(component(state), marble.LatentMarble()(state))
+        self.assertIn(component._chunk_size, marble.components.marble.chunk_size_candidates)
+
+    def test_worker_threads_are_not_kept(self):
+        import threading
+        state = get_latent_marble_state(n_columns=50)
+        n_threads = threading.active_count()
+        marble.LatentMarble(chunk_size=10, n_workers=3)(state)
+        self.assertEqual(threading.active_count(), n_threads)
+
+    def test_invalid_chunk_size_raises(self):
+        for chunk_size in (0, 'fast'):
+            with self.assertRaises(ValueError):
+                marble.LatentMarble(chunk_size=chunk_size)
+
+
+def get_loaded_dataset_count(array_dict):
+    module = marble.components.marble
+    n_columns = next(iter(array_dict.values())).shape[0]
+    n_loaded = module.get_weight_dataset.cache_info().currsize + module.get_pc_dataset.cache_info().currsize
+    return {'n_loaded': np.full(n_columns, n_loaded)}
+
+
+class TestProcessParallel(unittest.TestCase):
+
+    def test_failed_pool_releases_shared_memory(self):
+        from marble.components import parallel
+        created = []
+
+        class RecordingSharedParameters(parallel.SharedParameters):
+            def __init__(self, *args, **kwargs):
+                super(RecordingSharedParameters, self).__init__(*args, **kwargs)
+                created.append(self)
+
+        original = parallel.SharedParameters
+        parallel.SharedParameters = RecordingSharedParameters
+        try:
+            with self.assertRaises(ValueError):
+                marble.ColumnProcessPool(0)
+        finally:
+            parallel.SharedParameters = original
+        self.assertEqual(len(created), 1)
+        self.assertIsNone(created[0]._shared_memory)
+
+    def test_process_parallel_matches_serial(self):
+        state = get_latent_marble_state(n_columns=11)
+        reference_outputs = marble.LatentMarble()(state)
+        with marble.ProcessParallelLatentMarble(3) as component:
+            outputs = component(state)
+        for output, reference in zip(outputs, reference_outputs):
+            for name in reference.keys():
+                self.assertTrue(np.allclose(
+                    output[name].values, reference[name].values,
+                    rtol=1e-12, atol=0.), name)
+
+    def test_workers_do_not_load_datasets(self):
+        context = multiprocessing.get_context('spawn')
+        with marble.ColumnProcessPool(2, context=context) as pool:
+            result = pool.map_columns(get_loaded_dataset_count, {'x': np.zeros(4)})
+        self.assertEqual(result['n_loaded'].shape, (4,))
+        self.assertTrue(np.all(result['n_loaded'] == 0))
+
+    def test_no_columns(self):
+        state = get_latent_marble_state(n_columns=0)
+        with marble.ProcessParallelLatentMarble(2) as component:
+            tendencies, diagnostics = component(state)
+        self.assertEqual(tendencies['liquid_water_static_energy_components'].shape, (0, 9))
+        self.assertEqual(diagnostics['surface_precipitation_rate'].shape, (0,))
+
+    def test_chunking_arguments_raise(self):
+        with self.assertRaises(TypeError):
+            marble.ProcessParallelLatentMarble(2, chunk_size=10)
+
+
+class TestPreloadableCache(unittest.TestCase):
+
+    def test_preload_replaces_cached_result(self):
+        calls = []
+
+        @marble.components.marble.preloadable_cache
+        def get_value(name, precision='float64'):
+            calls.append((name, precision))
+            return (name, precision)
+
+        self.assertEqual(get_value('sl'), ('sl', 'float64'))
+        get_value.preload('preloaded', 'sl', 'float64')
+        self.assertEqual(get_value('sl'), 'preloaded')
+        self.assertEqual(get_value('sl', precision='float64'), 'preloaded')
+        self.assertEqual(calls, [('sl', 'float64')])
+
+
+class TestEnsembleLatentMarble(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.weight_filename = marble.components.marble.weight_filename
+        self.perturbed_filename = os.path.join(self.directory, 'weights-perturbed.nc')
+        weight_ds = marble.components.marble.get_weight_dataset().copy(deep=True)
+        random = np.random.RandomState(0)
+        weight_ds['pbl_hidden_W'].values *= 1 + 0.05 * random.randn(
+            *weight_ds['pbl_hidden_W'].shape)
+        weight_ds.to_netcdf(self.perturbed_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_members_match_separate_networks(self):
+        state = get_latent_marble_state(n_columns=20)
+        component = marble.EnsembleLatentMarble(
+            [self.weight_filename, self.perturbed_filename], chunk_size=8)
+        tendencies, diagnostics = component(state)
+        reference_tendencies, reference_diagnostics = marble.LatentMarble()(state)
+        perturbed_plan = marble.components.marble.InferencePlan.from_dataset(
+            marble.components.marble.get_weight_dataset(self.perturbed_filename))
+        pbl_input_array = marble.components.marble.concatenate_pbl_input({
+            properties['alias']: state[name].values
+            for name, properties in marble.LatentMarble.input_properties.items()})
+        perturbed_tendencies = marble.components.marble.get_state_dict_from_array(
+            perturbed_plan.evaluate(pbl_input_array)[:, :perturbed_plan.n_state])
+        for name, properties in marble.LatentMarble.tendency_properties.items():
+            self.assertEqual(tendencies[name].dims[:2], ('ensemble_member', 'column'))
+            self.assertTrue(np.allclose(
+                tendencies[name].values[0], reference_tendencies[name].values,
+                rtol=1e-12, atol=1e-12), name)
+            self.assertTrue(np.allclose(
+                tendencies[name].values[1], perturbed_tendencies[properties['alias']],
+                rtol=1e-12, atol=1e-12), name)
+        for name in reference_diagnostics.keys():
+            if name != 'height':
+                self.assertTrue(np.allclose(
+                    diagnostics[name].values[0], reference_diagnostics[name].values,
+                    rtol=1e-12, atol=1e-12), name)
+
+    def test_unchunked_matches_chunked(self):
+        state = get_latent_marble_state(n_columns=20)
+        filenames = [self.weight_filename, self.perturbed_filename]
+        chunked, _ = marble.EnsembleLatentMarble(filenames, chunk_size=8)(state)
+        unchunked, _ = marble.EnsembleLatentMarble(filenames, chunk_size=None)(state)
+        for name in chunked.keys():
+            self.assertTrue(np.allclose(
+                unchunked[name].values, chunked[name].values,
+                rtol=1e-12, atol=1e-12), name)
+
+    def test_statistics(self):
+        state = get_latent_marble_state(n_columns=5)
+        component = marble.EnsembleLatentMarble(
+            [self.weight_filename, self.perturbed_filename], statistics=True)
+        tendencies, diagnostics = component(state)
+        precipitation = diagnostics['surface_precipitation_rate'].values
+        self.assertTrue(np.allclose(
+            diagnostics['surface_precipitation_rate_ensemble_mean'].values,
+            precipitation.mean(axis=0)))
+        self.assertTrue(np.allclose(
+            diagnostics['surface_precipitation_rate_ensemble_spread'].values,
+            precipitation.std(axis=0)))
+        name = 'liquid_water_static_energy_components'
+        self.assertTrue(np.allclose(
+            diagnostics['tendency_of_{}_ensemble_mean'.format(name)].values,
+            tendencies[name].values.mean(axis=0)))
+        self.assertEqual(
+            diagnostics['tendency_of_{}_ensemble_spread'.format(name)].attrs['units'], 'hr^-1')
+
+    def test_mismatched_architecture_raises(self):
+        plan = marble.components.marble.get_inference_plan()
+        smaller_plan = plan._replace(
+            hidden_W=plan.hidden_W[:64, :64], encoder_W=plan.encoder_W[:, :64])
+        with self.assertRaises(ValueError):
+            marble.StackedInferencePlan.from_plans([plan, smaller_plan])
+
+
+class TestParameterBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        marble.export_parameter_bundle(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bundle_matches_datasets(self):
+        bundle = marble.load_parameter_bundle(self.directory, preload=False)
+        module = marble.components.marble
+        self.assertEqual(bundle.metadata, module.get_network_metadata())
+        plan = module.get_inference_plan('float64')
+        for name in marble.components.parallel.plan_array_names:
+            array = getattr(bundle.plan, name)
+            self.assertIsInstance(array, np.memmap, name)
+            self.assertFalse(array.flags.writeable, name)
+            self.assertTrue(np.all(array == getattr(plan, name)), name)
+        for basis_name, basis in bundle.bases.items():
+            reference = marble.get_basis(basis_name)
+            for name in marble.Basis._fields:
+                self.assertTrue(np.all(getattr(basis, name) == getattr(reference, name)))
+
+    def test_preloaded_bundle_does_not_load_datasets(self):
+        code = (
+            'import sys, marble; '
+            'marble.load_parameter_bundle(sys.argv[1]); '
+            'marble.get_basis("sl"); marble.LatentMarble(); '
+            'marble.InputHeightToPrincipalComponents(); '
+            'module = marble.components.marble; '
+            'assert module.get_weight_dataset.cache_info().currsize == 0; '
+            'assert module.get_pc_dataset.cache_info().currsize == 0'
+        )
+        subprocess.check_call([sys.executable, '-c', code, self.directory])
+
+    def test_incompatible_format_version_raises(self):
+        filename = os.path.join(self.directory, 'metadata.json')
+        with open(filename, 'r') as f:
+            text = f.read()
+        with open(filename, 'w') as f:
+            f.write(text.replace('"format_version": 1', '"format_version": 0'))
+        with self.assertRaises(ValueError):
+            marble.load_parameter_bundle(self.directory, preload=False)
+
+
+class TestPrecision(unittest.TestCase):
+
+    def test_float32_latent_marble_matches_float64(self):
+        state = get_latent_marble_state(n_columns=50)
+        deviation = marble.get_precision_deviation(marble.LatentMarble, state)
+        tendencies, diagnostics = marble.LatentMarble(precision='float32')(state)
+        for name, value in list(tendencies.items()) + list(diagnostics.items()):
+            self.assertEqual(value.dtype, np.float64, name)
+            scale = np.max(np.abs(value.values))
+            self.assertLess(deviation[name]['max'], 1e-4 * scale + 1e-12, name)
+
+    def test_float32_input_conversion_matches_float64(self):
+        state = get_test_state(pc_value=0.6)
+        deviation = marble.get_precision_deviation(
+            marble.InputPrincipalComponentsToHeight, state)
+        result = marble.InputPrincipalComponentsToHeight(precision='float32')(state)
+        for name in result.keys():
+            self.assertEqual(result[name].dtype, np.float64, name)
+            scale = np.max(np.abs(result[name].values))
+            self.assertLess(deviation[name]['max'], 1e-6 * scale, name)
+
+    def test_float32_height_marble_matches_float64(self):
+        # at the mean profiles, where subtracting them matters most
+        latent_state = get_latent_marble_state(n_columns=50)
+        for name in (
+                'liquid_water_static_energy_components',
+                'total_water_mixing_ratio_components', 'vertical_wind_components'):
+            latent_state[name].values[:] = 0.
+        state = marble.InputPrincipalComponentsToHeight()(latent_state)
+        state.update({
+            name: value for name, value in latent_state.items()
+            if name in marble.HeightMarble.input_properties or name == 'time'
+        })
+        deviation = marble.get_precision_deviation(marble.HeightMarble, state)
+        tendencies, _ = marble.HeightMarble()(state)
+        for name, value in tendencies.items():
+            scale = np.max(np.abs(value.values))
+            self.assertLess(deviation[name]['max'], 1e-5 * scale, name)
+
+    def test_float32_height_input_conversion_matches_float64(self):
+        state = get_test_state(pc_value=0.6)
+        height_state = marble.InputPrincipalComponentsToHeight()(state)
+        height_state['time'] = state['time']
+        deviation = marble.get_precision_deviation(
+            marble.InputHeightToPrincipalComponents, height_state)
+        result = marble.InputHeightToPrincipalComponents(precision='float32')(height_state)
+        for name in result.keys():
+            self.assertEqual(result[name].dtype, np.float64, name)
+            scale = np.max(np.abs(result[name].values))
+            self.assertLess(deviation[name]['max'], 1e-6 * scale, name)
+
+    def test_float32_projection_matches_float64(self):
+        state = get_test_state(pc_value=0.6)
+        height_state = marble.InputPrincipalComponentsToHeight()(state)
+        for name, long_name in (
+                ('sl', 'liquid_water_static_energy'),
+                ('rt', 'total_water_mixing_ratio'),
+                ('w', 'vertical_wind')):
+            height = height_state[long_name].values
+            reference = marble.get_basis(name, 'float64').project(height)
+            result = marble.get_basis(name, 'float32').project(height)
+            self.assertEqual(result.dtype, np.float32, name)
+            self.assertLess(
+                np.max(np.abs(result - reference)), 1e-6 * np.max(np.abs(reference)), name)
+
+    def test_invalid_precision_raises(self):
+        with self.assertRaises(ValueError):
+            marble.LatentMarble(precision='float16')
+        with self.assertRaises(ValueError):
+            marble.InputHeightToPrincipalComponents(precision='float16')
+
+
+class TestLazyLoading(unittest.TestCase):
+
+    def test_import_does_not_load_datasets(self):
+        code = (
+            'import sys, marble; '
+            'assert "xarray" not in sys.modules; '
+            'marble.LatentMarble; '
+            'assert marble.components.marble.get_weight_dataset.cache_info().currsize == 0'
+        )
+        subprocess.check_call([sys.executable, '-c', code])
+
+    def test_module_attributes_load_on_access(self):
+        module = marble.components.marble
+        self.assertEqual(module.name_feature_counts, module.get_network_metadata().name_feature_counts)
+        self.assertIs(module.weight_ds, module.get_weight_dataset())
+        self.assertIs(module.pc_ds, module.get_pc_dataset())
+
+
+class TestBasis(unittest.TestCase):
+
+    def test_basis_matrices_are_contiguous(self):
+        basis = marble.get_basis('sl')
+        self.assertTrue(basis.projection_matrix.flags['C_CONTIGUOUS'])
+        self.assertTrue(basis.reconstruction_matrix.flags['C_CONTIGUOUS'])
+        self.assertEqual(basis.projection_matrix.shape, (basis.n_levels, basis.n_components))
+        self.assertIs(basis, marble.get_basis('sl', precision='float64'))
+
+    def test_project_and_reconstruct_into_out(self):
+        basis = marble.get_basis('rt')
+        latent = np.random.RandomState(0).randn(4, basis.n_components)
+        height = np.empty((4, basis.n_levels))
+        result = basis.reconstruct(latent, out=height)
+        self.assertIs(result, height)
+        self.assertTrue(np.allclose(
+            height, marble.convert_principal_components_to_height(latent, 'rt')))
+        latent_out = np.empty((4, basis.n_components))
+        result = basis.project(height, out=latent_out)
+        self.assertIs(result, latent_out)
+        self.assertTrue(np.allclose(latent_out, latent))
+
+    def test_convert_functions_match_direct_computation(self):
+        pc_ds = marble.components.marble.get_pc_dataset()
+        n_components = marble.components.marble.name_feature_counts['sl']
+        principal_components = pc_ds['sl_principal_components'].values[:n_components, :]
+        height = np.random.RandomState(1).randn(3, 20) * 1e3 + pc_ds['sl_mean'].values
+        expected = np.dot(height - pc_ds['sl_mean'].values, principal_components.T)
+        result = marble.convert_height_to_principal_components(height, 'sl')
+        self.assertTrue(np.allclose(result, expected, rtol=1e-10, atol=1e-10))
+
+
+class TestStackedConversions(unittest.TestCase):
+
+    def test_diagnostic_conversion_matches_per_field(self):
+        state = get_test_state(pc_value=0.3)
+        state['clear_sky_radiative_heating_rate_components'] = sp.DataArray(
+            np.ones([marble.components.marble.name_feature_counts['sl']]) * 0.3,
+            dims=('sl_latent',), attrs={'units': 'hr^-1'})
+        result = marble.DiagnosticPrincipalComponentsToHeight()(state)
+        for name, basis_name, add_mean in (
+                ('cloud_water_mixing_ratio', 'rcld', True),
+                ('rain_water_mixing_ratio', 'rrain', True),
+                ('cloud_fraction', 'cld', True),
+                ('clear_sky_radiative_heating_rate', 'sl', False)):
+            expected = marble.convert_principal_components_to_height(
+                state[name + '_components'].values, basis_name, add_mean=add_mean)
+            self.assertTrue(np.allclose(result[name].values, expected), name)
+
+    def test_input_conversion_matches_per_field(self):
+        state = get_test_state(pc_value=0.6)
+        result = marble.InputPrincipalComponentsToHeight()(state)
+        for name, basis_name in (
+                ('liquid_water_static_energy', 'sl'),
+                ('total_water_mixing_ratio', 'rt'),
+                ('vertical_wind', 'w')):
+            expected = marble.convert_principal_components_to_height(
+                state[name + '_components'].values, basis_name)
+            self.assertTrue(np.allclose(result[name].values, expected), name)
+
+
+def get_column_state(i):
+    return {
+        'time': sp.timedelta(hours=i),
+        'air_temperature': sp.DataArray(
+            np.arange(3.) + i, dims=('z_star',), attrs={'units': 'degK'}),
+        'surface_temperature': sp.DataArray(
+            np.array(290. + i), dims=(), attrs={'units': 'degK'}),
+    }
+
+
+class TestColumnStore(unittest.TestCase):
+
+    def test_store_and_retrieve_with_growth(self):
+        store = marble.ColumnStore(capacity=2)
+        for i in range(5):
+            store.store(get_column_state(i))
+        self.assertEqual(store['air_temperature'].shape, (5, 3))
+        self.assertTrue(np.all(store['air_temperature'][:, 0] == np.arange(5.)))
+        self.assertTrue(np.all(store['surface_temperature'] == 290. + np.arange(5.)))
+
+    def test_retrieve_by_alias(self):
+        marble.register_alias('T_test', 'air_temperature')
+        store = marble.ColumnStore()
+        store.store(get_column_state(0))
+        self.assertTrue(np.all(store['T_test'] == store['air_temperature']))
+
+    def test_spill_by_alias_and_long_name(self):
+        marble.register_alias('T_spill_test', 'air_temperature')
+        directory = tempfile.mkdtemp()
+        try:
+            store = marble.ColumnStore(capacity=1, spill_directory=directory)
+            state = get_column_state(0)
+            state['T_spill_test'] = state.pop('air_temperature')
+            store.store(state)
+            for i in range(1, 4):
+                store.store(get_column_state(i))
+            self.assertEqual(store['T_spill_test'].shape[0], 4)
+            self.assertTrue(np.all(
+                store['air_temperature'][3] == get_column_state(3)['air_temperature'].values))
+            store.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_getitem_returns_view(self):
+        store = marble.ColumnStore()
+        store.store(get_column_state(0))
+        store.store(get_column_state(1))
+        view = store['air_temperature']
+        self.assertTrue(
+            np.shares_memory(view, store._columns['air_temperature'][0]))
+        self.assertFalse(view.flags['OWNDATA'])
+        view[0] = -1.
+        self.assertTrue(np.all(store['air_temperature'][0] == -1.))
+
+    def test_spill_to_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = marble.ColumnStore(capacity=2, spill_directory=directory)
+            for i in range(5):
+                store.store(get_column_state(i))
+            self.assertIsInstance(store['air_temperature'], np.memmap)
+            self.assertEqual(store['air_temperature'].shape, (5, 3))
+            self.assertTrue(np.all(store['air_temperature'][:, 0] == np.arange(5.)))
+            self.assertTrue(np.all(store['surface_temperature'] == 290. + np.arange(5.)))
+            store.close()
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_store_multi_dimensional_raises(self):
+        store = marble.ColumnStore()
+        state = {'air_temperature': sp.DataArray(
+            np.zeros((2, 3)), dims=('x', 'z_star'), attrs={'units': 'degK'})}
+        with self.assertRaises(marble.NotAColumnException):
+            store.store(state)
+
+
+def get_batched_state(i, n_columns=3):
+    return {
+        'time': sp.timedelta(hours=i),
+        'air_temperature': sp.DataArray(
+            np.arange(n_columns * 4.).reshape((n_columns, 4)) + i,
+            dims=('column', 'z_star'), attrs={'units': 'degK'}),
+        'surface_temperature': sp.DataArray(
+            290. + i + np.arange(n_columns), dims=('column',), attrs={'units': 'degK'}),
+    }
+
+
+class TestStreamingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, filename, **kwargs):
+        with marble.StreamingStore(filename, chunk_length=4, **kwargs) as store:
+            for i in range(10):
+                store.store(get_batched_state(i))
+            self.assertEqual(store['air_temperature'].shape, (10, 3, 4))
+            partial = store.read('surface_temperature', start=2, stop=7)
+        self.assertEqual(partial.shape, (5, 3))
+        self.assertTrue(np.all(partial[:, 0] == 290. + np.arange(2, 7)))
+        self.assertTrue(np.all(
+            store['air_temperature'][9] == get_batched_state(9)['air_temperature'].values))
+
+    def test_netcdf(self):
+        self.check_store(os.path.join(self.directory, 'out.nc'))
+
+    def test_store_after_close_raises(self):
+        store = marble.StreamingStore(os.path.join(self.directory, 'out.nc'), chunk_length=2)
+        store.store(get_batched_state(0))
+        store.close()
+        self.assertRaises(ValueError, store.store, get_batched_state(1))
+        self.assertEqual(store['air_temperature'].shape, (1, 3, 4))
+
+    def test_changed_quantities_raise(self):
+        filename = os.path.join(self.directory, 'out.nc')
+        with marble.StreamingStore(filename, chunk_length=2) as store:
+            for i in range(2):
+                store.store(get_batched_state(i))
+            state = get_batched_state(2)
+            state.pop('surface_temperature')
+            self.assertRaises(ValueError, store.store, state)
+            state = get_batched_state(2)
+            state['air_temperature'] = state['air_temperature'].transpose()
+            self.assertRaises(ValueError, store.store, state)
+            store.store(get_batched_state(2))
+        self.assertEqual(store['air_temperature'].shape, (3, 3, 4))
+
+    @unittest.skipIf(importlib.util.find_spec('zarr') is None, 'zarr is not installed')
+    def test_zarr(self):
+        self.check_store(os.path.join(self.directory, 'out.zarr'))
+
+
+class TestSlotDict(unittest.TestCase):
+
+    def setUp(self):
+        marble.register_alias('slot_test_alias', 'slot_test_long_name')
+
+    def test_alias_access(self):
+        state = marble.SlotDict({'slot_test_long_name': 1.})
+        self.assertEqual(state['slot_test_alias'], 1.)
+        state['slot_test_alias'] = 2.
+        self.assertEqual(state['slot_test_long_name'], 2.)
+        self.assertEqual(list(state.keys()), ['slot_test_long_name'])
+        self.assertIn('slot_test_alias', state)
+
+    def test_alias_registered_after_slot(self):
+        state = marble.SlotDict({'slot_test_late_long_name': 1.})
+        marble.register_alias('slot_test_late_alias', 'slot_test_late_long_name')
+        self.assertIn('slot_test_late_alias', state)
+        self.assertEqual(state['slot_test_late_alias'], 1.)
+        del state['slot_test_late_alias']
+        self.assertNotIn('slot_test_late_long_name', state)
+        self.assertRaises(KeyError, state.__getitem__, 'slot_test_late_alias')
+
+    def test_setting_by_alias_stores_long_name(self):
+        state = marble.SlotDict()
+        state['slot_test_alias'] = 3.
+        self.assertEqual(dict(state), {'slot_test_long_name': 3.})
+
+    def test_slot_access(self):
+        state = marble.SlotDict({'a': 1., 'slot_test_long_name': 2.})
+        i_slot = state.slot('slot_test_alias')
+        self.assertEqual(state.get_slot(i_slot), 2.)
+        state.set_slot(i_slot, 5.)
+        self.assertEqual(state['slot_test_long_name'], 5.)
+
+    def test_delete_and_missing(self):
+        state = marble.SlotDict({'a': 1., 'b': 2.})
+        del state['a']
+        self.assertNotIn('a', state)
+        self.assertEqual(len(state), 1)
+        with self.assertRaises(KeyError):
+            state['a']
+        self.assertIsNone(state.get('c'))
+        state['a'] = 4.
+        self.assertEqual(dict(state), {'a': 4., 'b': 2.})
+
+    def test_alias_dict_update(self):
+        state = marble.AliasDict()
+        state.update({'slot_test_alias': 1.})
+        self.assertEqual(dict(state), {'slot_test_long_name': 1.})
+
+
 class TestPrincipalComponentConversions(unittest.TestCase):
     """Tests for `marble` package."""
 
@@ -81,6 +1371,5 @@ class TestPrincipalComponentConversions(unittest.TestCase):
         result = converter(state)
 
 
-
 if __name__ == '__main__':
     unittest.main()